@@ -0,0 +1,40 @@
+from typing import Dict
+
+from fastapi import APIRouter, status
+
+from app.schemas.cache_schema import CacheStatus
+from app.services.individuals import individual_cache, missing_individuals
+from app.services.family_enviroment import family_cache, family_name_cache, missing_families
+from app.services.family_membership import roster_cache
+from app.services.memory import missing_memories
+from app.services.patient import missing_patients
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"]
+)
+
+
+@router.get('/cache',
+            response_model=Dict[str, CacheStatus],
+            status_code=status.HTTP_200_OK,
+            description="Retrieve the entries and hit rates of the caches of this worker")
+async def get_cache():
+    """
+    Get the status of the caches
+    the caches are per worker process, every worker reports its own caches
+
+    :return:
+    Dict[str, CacheStatus]: status of every cache by name
+    """
+
+    return {
+        "individuals": individual_cache.status(),
+        "families": family_cache.status(),
+        "family_names": family_name_cache.status(),
+        "rosters": roster_cache.status(),
+        "missing_individuals": missing_individuals.status(),
+        "missing_families": missing_families.status(),
+        "missing_memories": missing_memories.status(),
+        "missing_patients": missing_patients.status(),
+    }
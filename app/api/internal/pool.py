@@ -0,0 +1,30 @@
+from fastapi import APIRouter, status
+
+from app.db.database import engine, async_engine, replica_engines
+from app.db.pool import get_pool_status
+from app.schemas.pool_schema import PoolsResponse
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"]
+)
+
+
+@router.get('/pool',
+            response_model=PoolsResponse,
+            status_code=status.HTTP_200_OK,
+            description="Retrieve connections and wait times of the database pools of this worker")
+async def get_pool():
+    """
+    Get the status of the database pools
+    the pools are per worker process, every worker reports its own pools
+
+    :return:
+    PoolsResponse: pool of the sync engine, pool of the async engine and pools of the read replicas
+    """
+
+    return {
+        "engine": get_pool_status(engine.pool),
+        "async_engine": get_pool_status(async_engine.pool),
+        "replicas": [get_pool_status(replica.pool) for replica in replica_engines],
+    }
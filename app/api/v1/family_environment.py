@@ -1,17 +1,21 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 
-from app.db.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_async_db
 from app.schemas.exception_schema import ExceptionSchema
+from app.schemas.pagination_schema import Page
+from app.utils.pagination import (Pagination, get_pagination, build_page,
+                                  TYPEAHEAD_DEFAULT_LIMIT, TYPEAHEAD_MAX_LIMIT)
 from app.services.family_enviroment import (service_get_all_families,
-                                            service_get_family_by_name,
-                                            service_get_family_by_id,
+                                            service_search_families,
                                             service_create_family,
                                             service_update_family,
                                             service_delete_family)
 
 from app.schemas.family_environment_schema import (FamilyEnvironmentResponse,
+                                                   FamilyEnvironmentSearchResponse,
                                                    FamilyEnvironmentCreate,
                                                    FamilyEnvironmentUpdate)
 
@@ -22,22 +26,56 @@ router = APIRouter(
 
 
 @router.get('/',
-            response_model=List[FamilyEnvironmentResponse],
+            response_model=Page[FamilyEnvironmentResponse],
             responses={
                 status.HTTP_204_NO_CONTENT: {"model": None},
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve a family environment by id")
-async def get_family(db: Session = Depends(get_db)):
+async def get_family(pagination: Pagination = Depends(get_pagination),
+                     db: AsyncSession = Depends(get_async_db)):
     """
     Retrieve a family environment by id
 
+    :param pagination: limit and cursor of the page
+    :param db: database connection
+
     :return:
-    List[FamilyEnvironmentResponse]
+    Page[FamilyEnvironmentResponse]
     """
 
-    res = service_get_all_families(db=db)
+    res = await service_get_all_families(db=db, limit=pagination.limit + 1, after_id=pagination.after)
     if res:  # check if there are families
+        return build_page(res, pagination.limit, key=lambda row: row.family_environment_id)
+
+    raise HTTPException(
+        status_code=status.HTTP_204_NO_CONTENT
+    )
+
+
+@router.get('/search',
+            response_model=List[FamilyEnvironmentSearchResponse],
+            responses={
+                status.HTTP_204_NO_CONTENT: {"model": None},
+            },
+            status_code=status.HTTP_200_OK,
+            description="Search families by name, typeahead")
+async def search_family(q: str = Query(..., min_length=1, max_length=255, description="text typed by the user"),
+                        limit: int = Query(TYPEAHEAD_DEFAULT_LIMIT, ge=1, le=TYPEAHEAD_MAX_LIMIT),
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Search families by a similar name, the most similar first
+
+    :param q: text typed by the user
+    :param limit: max number of families
+    :param db: database connection
+
+    :return:
+    List[FamilyEnvironmentSearchResponse]: the best matches
+    """
+
+    res = await service_search_families(db=db, query=q, limit=limit)
+    if res:  # check if names are matched
         return res
 
     raise HTTPException(
@@ -53,7 +91,7 @@ async def get_family(db: Session = Depends(get_db)):
              status_code=status.HTTP_201_CREATED,
              description="Create a family environment"
              )
-async def create_family(family_environment_create: FamilyEnvironmentCreate, db: Session = Depends(get_db)):
+async def create_family(family_environment_create: FamilyEnvironmentCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create a family
 
@@ -64,15 +102,15 @@ async def create_family(family_environment_create: FamilyEnvironmentCreate, db:
     FamilyEnvironmentResponse: pydantic schema of family response
     """
 
-    res = service_get_family_by_name(db=db, name=family_environment_create.name)
-    if res:  # check if family is exits
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="family already exists",
-        )
+    res = await service_create_family(db=db, family=family_environment_create)
+    if res:
+        return res
 
-    res = service_create_family(db=db, family=family_environment_create)
-    return res
+    # the family is exits
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="family already exists",
+    )
 
 
 @router.put('/{family_id}',
@@ -84,7 +122,7 @@ async def create_family(family_environment_create: FamilyEnvironmentCreate, db:
             status_code=status.HTTP_201_CREATED,
             description="Update a family environment by id")
 async def update_family(family_id: int, family_update: FamilyEnvironmentUpdate,
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_async_db)):
     """
 
     :param family_id: ID of a family
@@ -95,23 +133,20 @@ async def update_family(family_id: int, family_update: FamilyEnvironmentUpdate,
      FamilyEnvironmentResponse: pydantic schema of family response
     """
 
-    res = service_get_family_by_id(db=db, family_id=family_id)
-    if res:  # check if the family exits
-
-        res_update = service_update_family(db=db, family_id=family_id, family=family_update)
-
-        # TODO: Decoupling the update errors
-        if res_update:  # fail if the family name already used
-            return res_update
+    res = await service_update_family(db=db, family_id=family_id, family=family_update)
+    if res:
+        return res
 
+    if res is None:  # check if the family exits
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="The family name already exists"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The family not found"
         )
 
+    # fail if the family name already used
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="The family not found"
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="The family name already exists"
     )
 
 
@@ -119,7 +154,7 @@ async def update_family(family_id: int, family_update: FamilyEnvironmentUpdate,
                responses={status.HTTP_404_NOT_FOUND: {"model": ExceptionSchema}},
                status_code=status.HTTP_200_OK,
                description="Delete a family environment by id")
-async def delete_family(family_id: int, db: Session = Depends(get_db)):
+async def delete_family(family_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Delete a family
 
@@ -130,9 +165,8 @@ async def delete_family(family_id: int, db: Session = Depends(get_db)):
     {"message": "The individual deleted"}: confirmation message
     """
 
-    res = service_get_family_by_id(db=db, family_id=family_id)
+    res = await service_delete_family(db=db, family_id=family_id)
     if res:  # check if a family is exits
-        service_delete_family(db=db, family_id=family_id)
         return {"message": "The individual deleted"}
 
     raise HTTPException(
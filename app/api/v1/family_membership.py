@@ -1,23 +1,37 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import List, Optional
 
-from app.db.database import get_db
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_async_db, stream_in_session
+from app.db.models.resource_version import VERSION_FAMILY_MEMBERS
 from app.schemas.exception_schema import ExceptionSchema
+from app.schemas.pagination_schema import Page
+from app.utils.pagination import Pagination, get_pagination, build_page
+from app.utils.ndjson import JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE, StreamFormat, streaming_response
+from app.utils.rows import Detail, ReadPath, get_detail, get_read_path
+from app.utils.etag import make_etag, conditional_response
+from app.services.family_enviroment import service_get_family_by_name, invalidate_family
+from app.services.resource_version import service_get_version
 from app.services.family_membership import (service_get_all_family_membership,
-                                            service_get_family_membership,
-                                            service_get_family_members_by_family,
+                                            service_get_all_family_membership_rows,
+                                            service_stream_all_family_membership,
+                                            service_stream_all_family_membership_rows,
+                                            service_get_family_roster,
                                             service_create_family_membership,
-                                            service_get_family_by_membership_id,
+                                            service_bulk_create_family_membership,
                                             service_update_family_membership,
-                                            service_delete_family_membership, service_count_families_for_individual)
+                                            service_delete_family_membership)
 
 from app.schemas.family_member_schema import (FamilyMemberBasicResponse,
                                               FamilyMemberCreate,
                                               FamilyMemberUpdate,
                                               FamilyMemberFullResponse,
-                                              FamilyMemberInFamily)
-from app.services.patient import service_get_patient_by_id, service_search_for_patients
+                                              FamilyMemberInFamily,
+                                              FamilyMemberBulkResponse)
+
+# max memberships of a bulk creation, the batch is one statement in one transaction
+MAX_BULK_MEMBERSHIPS = 1000
 
 router = APIRouter(
     prefix="/familymember",
@@ -26,26 +40,47 @@ router = APIRouter(
 
 
 @router.get('/',
-            response_model=List[FamilyMemberFullResponse],
+            response_model=Page[FamilyMemberFullResponse],
             responses={
+                status.HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}},
                 status.HTTP_204_NO_CONTENT: {"model": None},
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve a families memberships")
-def get_family_member(db: Session = Depends(get_db)):
+async def get_family_member(pagination: Pagination = Depends(get_pagination),
+                            stream: Optional[StreamFormat] = Query(
+                                None, description="stream all memberships as ndjson or a json array, "
+                                                  "the pagination is ignored"),
+                            detail: Detail = Depends(get_detail),
+                            read_path: ReadPath = Depends(get_read_path),
+                            db: AsyncSession = Depends(get_async_db)):
     """
     Get all families memberships
 
+    :param pagination: limit and cursor of the page
+    :param stream: None for a page, ndjson or json to stream all memberships
+    :param detail: summary for a preview of other_details of the individuals, full for the whole text
+    :param read_path: orm or core, set by the setting core_read_endpoints
     :param db: database connection
 
     :return:
-    List[FamilyMemberFullResponse]: list of families memberships
+    Page[FamilyMemberFullResponse]: a page of families memberships, or StreamingResponse of all memberships
     """
 
-    res = service_get_all_family_membership(db=db)
+    if stream:  # the memberships are read from a server side cursor batch by batch
+        batches = (stream_in_session(service_stream_all_family_membership_rows, detail=detail) if read_path == "core"
+                   else stream_in_session(service_stream_all_family_membership, detail=detail))
+        return streaming_response(batches, FamilyMemberFullResponse, stream)
+
+    if read_path == "core":
+        res = await service_get_all_family_membership_rows(db=db, limit=pagination.limit + 1,
+                                                           after_id=pagination.after, detail=detail)
+    else:
+        res = await service_get_all_family_membership(db=db, limit=pagination.limit + 1, after_id=pagination.after,
+                                                      detail=detail)
 
     if res:  # check if there is a family membership
-        return res
+        return build_page(res, pagination.limit, key=lambda row: row.family_environment_member_id)
 
     raise HTTPException(
         status_code=status.HTTP_204_NO_CONTENT
@@ -55,26 +90,46 @@ def get_family_member(db: Session = Depends(get_db)):
 @router.get('/{family_name}',
             response_model=FamilyMemberInFamily,
             responses={
+                status.HTTP_304_NOT_MODIFIED: {"model": None},
                 status.HTTP_404_NOT_FOUND: {"model": ExceptionSchema},
             },
             status_code=status.HTTP_200_OK,
-            description="Retrieve all members in family"
+            description="Retrieve all members in family, 304 if the If-None-Match header is the ETag of the members"
             )
-def get_family_member_by_family(family_name: str, db: Session = Depends(get_db)):
+async def get_family_member_by_family(family_name: str, request: Request, response: Response,
+                                      db: AsyncSession = Depends(get_async_db)):
     """
     Get all members in a family by family name
 
     :param family_name: name of a family
+    :param request: the request, its If-None-Match header
+    :param response: the response, its ETag header
     :param db: database connection
 
     :return:
-    None or FamilyMemberInFamily: pydantic schema of all members in a family
+    Response of FamilyMemberInFamily: all members in a family serialised by the cache of the rosters,
+    or Response 304 Not Modified
     """
 
-    res = service_get_family_members_by_family(db=db, family_name=family_name)
-    if res:  # check if a family is exits
-        return res
+    family = await service_get_family_by_name(db=db, name=family_name)
+    if family is None:  # check if a family is exits
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="the family is not exist"
+        )
 
+    # the version is read before the members, a write in between is sent again on the next poll
+    version = await service_get_version(db=db, resource=VERSION_FAMILY_MEMBERS, scope_id=family.family_environment_id)
+    not_modified = conditional_response(request, response,
+                                        make_etag(VERSION_FAMILY_MEMBERS, family.family_environment_id, version))
+    if not_modified:
+        return not_modified
+
+    roster = await service_get_family_roster(db=db, family=family, version=version)
+    if roster is not None:  # check if the family is not deleted or renamed in between
+        return Response(content=roster, media_type=JSON_MEDIA_TYPE, headers=dict(response.headers))
+
+    invalidate_family(family.family_environment_id)  # the cached row is stale, the next request reads the name
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="the family is not exist"
@@ -89,7 +144,7 @@ def get_family_member_by_family(family_name: str, db: Session = Depends(get_db))
              },
              status_code=status.HTTP_200_OK,
              description="Create new membership")
-def create_family_membership(family_membership: FamilyMemberCreate, db: Session = Depends(get_db)):
+async def create_family_membership(family_membership: FamilyMemberCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create a family membership
 
@@ -100,40 +155,57 @@ def create_family_membership(family_membership: FamilyMemberCreate, db: Session
     FamilyMemberBasicResponse: pydantic schema of family basic response
     """
 
-    res = service_get_family_membership(db=db, family_membership=family_membership)
-    if not res:  # check if a family membership is not exist
-
-        is_patient = service_get_patient_by_id(db=db, patient_id=family_membership.individual_id)
-        count = service_count_families_for_individual(db=db, individual_id=family_membership.individual_id)
-
-        # Check if the membership for a patient
-        # - an individual must not be a patient
-        # - number of memberships is zero
-        if is_patient and count >= 1:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="The is patient and already has a family"
-            )
-
-        res_create = service_create_family_membership(db=db, family_membership=family_membership)
-
-        # check values of the membership
-        # - family_environment_id is a foreign key
-        # - individual_id is a foreign key
-        if res_create:
-            return res_create
+    res = await service_create_family_membership(db=db, family_membership=family_membership)
+    if res and res.family_environment_member_id is not None:
+        return res
 
+    # check values of the membership
+    # - family_environment_id is a foreign key
+    # - individual_id is a foreign key
+    if res is False:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Bad values"
         )
 
+    # check if a family membership is not exist,
+    # skipped with no failed check: the same membership was inserted concurrently and ON CONFLICT skipped it
+    if res.membership_exists or not res.is_patient:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The membership already exists"
+        )
+
+    # Check if the membership for a patient
+    # - an individual must not be a patient
+    # - number of memberships is zero
     raise HTTPException(
         status_code=status.HTTP_409_CONFLICT,
-        detail="the membership already exits"
+        detail="The individual is patient and already has a family"
     )
 
 
+@router.post('/bulk',
+             response_model=FamilyMemberBulkResponse,
+             status_code=status.HTTP_200_OK,
+             description=f"Create memberships in bulk, at most {MAX_BULK_MEMBERSHIPS} per request")
+async def bulk_create_family_membership(family_memberships: List[FamilyMemberCreate] = Body(
+                                            ..., max_length=MAX_BULK_MEMBERSHIPS),
+                                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Create family memberships in bulk, the batch is checked and inserted at once
+
+    :param family_memberships: list of pydantic schema of family creation, 422 if longer than MAX_BULK_MEMBERSHIPS
+    :param db: database connection
+
+    :return:
+    FamilyMemberBulkResponse: created memberships and rejected memberships with the reason
+    """
+
+    res = await service_bulk_create_family_membership(db=db, memberships=family_memberships)
+    return res
+
+
 @router.put('/{membership_id}',
             response_model=FamilyMemberBasicResponse,
             responses={
@@ -142,7 +214,7 @@ def create_family_membership(family_membership: FamilyMemberCreate, db: Session
             },
             status_code=status.HTTP_201_CREATED,
             description="Update membership by membership ID")
-def update_family_membership(membership_id: int, membership: FamilyMemberUpdate, db: Session = Depends(get_db)):
+async def update_family_membership(membership_id: int, membership: FamilyMemberUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     Update a family membership
 
@@ -154,40 +226,35 @@ def update_family_membership(membership_id: int, membership: FamilyMemberUpdate,
     FamilyMemberBasicResponse: pydantic schema of a family membership basic response
     """
 
-    res = service_get_family_by_membership_id(db=db, membership_id=membership_id)
-
-    if res:  # check if the membership is exits
-
-        is_new_patient = service_search_for_patients(db=db, patient_ids=[membership.individual_id, res.individual_id])
-
-        # check if the new individual and the old individual are patients
-        # if it patient it means, it has a family
-        # patient has only one family.
+    res = await service_update_family_membership(db=db,
+                                                 membership_id=membership_id,
+                                                 membership=membership)
 
-        if is_new_patient:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Update not allowed, the new individual is patient"
-            )
-
-        res_update = service_update_family_membership(db=db,
-                                                      membership_id=membership_id,
-                                                      membership=membership)
-
-        # check if the membership is exits
-        # - family_environment_id is a foreign key
-        # - individual_id is a foreign key
-        if res_update:
-            return res_update
+    if res and res.family_environment_member_id is not None:
+        return res
 
+    # check values of the membership
+    # - family_environment_id is a foreign key
+    # - individual_id is a foreign key
+    # - the membership must not exist
+    if res is False:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Bad request, check values"
         )
 
+    if not res.membership_exists:  # check if the membership is exits
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="the membership not found"
+        )
+
+    # the new individual or the old individual is patient
+    # if it patient it means, it has a family
+    # patient has only one family.
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="the membership not found"
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Update not allowed, the new individual is patient"
     )
 
 
@@ -198,7 +265,7 @@ def update_family_membership(membership_id: int, membership: FamilyMemberUpdate,
                },
                status_code=status.HTTP_200_OK,
                description="Delete membership by membership ID")
-def delete_family_membership(membership_id: int, db: Session = Depends(get_db)):
+async def delete_family_membership(membership_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     delete a family membership
 
@@ -209,23 +276,19 @@ def delete_family_membership(membership_id: int, db: Session = Depends(get_db)):
     {"message": "Membership is deleted"}: confirmation message
     """
 
-    res = service_get_family_by_membership_id(db=db, membership_id=membership_id)
-
-    if res:  # check if a family membership is exits
-
-        is_patient = service_get_patient_by_id(db=db, patient_id=res.individual_id)
-
-        # check if a family has a patient
-        if is_patient:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Delete not allowed, the membership has patient"
-            )
+    res = await service_delete_family_membership(db=db, membership_id=membership_id)
 
-        service_delete_family_membership(db=db, membership_id=membership_id)
+    if res.family_environment_member_id is not None:
         return {"message": "Membership is deleted"}
 
+    if not res.membership_exists:  # check if a family membership is exits
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="the membership not found"
+        )
+
+    # the individual of the membership is a patient
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="the membership not found"
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Delete not allowed, the membership has patient"
     )
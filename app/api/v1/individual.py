@@ -1,19 +1,28 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
 
-from app.db.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_async_db
 from app.schemas.exception_schema import ExceptionSchema
+from app.schemas.pagination_schema import Page
+from app.utils.pagination import (Pagination, get_pagination, build_page,
+                                  TYPEAHEAD_DEFAULT_LIMIT, TYPEAHEAD_MAX_LIMIT)
+from app.utils.ndjson import NDJSON_MEDIA_TYPE, iter_request_rows
+from app.utils.rows import Detail, ReadPath, get_detail, get_read_path
 from app.services.individuals import (service_get_all_individuals,
-                                      service_get_individual_by_name,
-                                      service_get_individual_by_id,
+                                      service_get_all_individual_rows,
+                                      service_search_individuals,
                                       service_create_individual,
+                                      service_bulk_create_individuals,
                                       service_update_individual,
                                       service_delete_individual)
 
 from app.schemas.individual_schema import (IndividualResponse,
+                                           IndividualSearchResponse,
                                            IndividualCreate,
-                                           IndividualUpdate)
+                                           IndividualUpdate,
+                                           IndividualBulkResponse)
 
 router = APIRouter(
     prefix="/individual",
@@ -22,25 +31,68 @@ router = APIRouter(
 
 
 @router.get('/',
-            response_model=List[IndividualResponse],
+            response_model=Page[IndividualResponse],
             responses={
                 status.HTTP_204_NO_CONTENT: {"model": None},
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve an individual by id")
-async def get_individual(db: Session = Depends(get_db)):
+async def get_individual(pagination: Pagination = Depends(get_pagination),
+                         detail: Detail = Depends(get_detail),
+                         read_path: ReadPath = Depends(get_read_path),
+                         db: AsyncSession = Depends(get_async_db)):
     """
     Retrieve all individual
     :parameter:
+    pagination: limit and cursor of the page
+    detail: summary for a preview of other_details, full for the whole text
+    read_path: orm or core, set by the setting core_read_endpoints
     db: Database connection
 
     :return:
-    List[IndividualResponse]: List of all individuals
+    Page[IndividualResponse]: a page of individuals
     """
 
-    res = service_get_all_individuals(db=db)
+    if read_path == "core":
+        res = await service_get_all_individual_rows(db=db, limit=pagination.limit + 1, after_id=pagination.after,
+                                                    detail=detail)
+    else:
+        res = await service_get_all_individuals(db=db, limit=pagination.limit + 1, after_id=pagination.after,
+                                                detail=detail)
     if res:
+        return build_page(res, pagination.limit, key=lambda row: row.individual_id)
+    raise HTTPException(
+        status_code=status.HTTP_204_NO_CONTENT
+    )
+
+
+@router.get('/search',
+            response_model=List[IndividualSearchResponse],
+            responses={
+                status.HTTP_204_NO_CONTENT: {"model": None},
+            },
+            status_code=status.HTTP_200_OK,
+            description="Search individuals by name, typeahead")
+async def search_individual(q: str = Query(..., min_length=1, max_length=255, description="text typed by the user"),
+                            limit: int = Query(TYPEAHEAD_DEFAULT_LIMIT, ge=1, le=TYPEAHEAD_MAX_LIMIT),
+                            detail: Detail = Depends(get_detail),
+                            db: AsyncSession = Depends(get_async_db)):
+    """
+    Search individuals by a similar name, the most similar first
+
+    :param q: text typed by the user
+    :param limit: max number of individuals
+    :param detail: summary for a preview of other_details, full for the whole text
+    :param db: database connection
+
+    :return:
+    List[IndividualSearchResponse]: the best matches
+    """
+
+    res = await service_search_individuals(db=db, query=q, limit=limit, detail=detail)
+    if res:  # check if names are matched
         return res
+
     raise HTTPException(
         status_code=status.HTTP_204_NO_CONTENT
     )
@@ -54,7 +106,7 @@ async def get_individual(db: Session = Depends(get_db)):
              status_code=status.HTTP_201_CREATED,
              description="Create an individual"
              )
-async def create_individual(individual_create: IndividualCreate, db: Session = Depends(get_db)):
+async def create_individual(individual_create: IndividualCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create an individual
     :parameter:
@@ -65,13 +117,50 @@ async def create_individual(individual_create: IndividualCreate, db: Session = D
     IndividualResponse: pydantic schema of the updated data
     """
 
-    res = service_get_individual_by_name(db=db, name=individual_create.name)
-    if res:  # check if the individual is already exits
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Individual already exists",
-        )
-    res = service_create_individual(db=db, individual=individual_create)
+    res = await service_create_individual(db=db, individual=individual_create)
+    if res:
+        return res
+
+    # the individual is already exits
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Individual already exists",
+    )
+
+
+@router.post('/bulk',
+             response_model=IndividualBulkResponse,
+             responses={
+                 status.HTTP_422_UNPROCESSABLE_ENTITY: {"model": ExceptionSchema}
+             },
+             status_code=status.HTTP_201_CREATED,
+             description="Create individuals in bulk from a JSON array or a NDJSON stream",
+             openapi_extra={
+                 "requestBody": {
+                     "required": True,
+                     "content": {
+                         "application/json": {
+                             "schema": {"type": "array", "items": {"$ref": "#/components/schemas/IndividualCreate"}}
+                         },
+                         NDJSON_MEDIA_TYPE: {
+                             "schema": {"$ref": "#/components/schemas/IndividualCreate"}
+                         }
+                     }
+                 }
+             })
+async def bulk_create_individuals(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Create individuals in bulk
+    :parameter:
+    request: body with a JSON array or a NDJSON stream (application/x-ndjson) of individuals
+    db: database connection
+
+    :return:
+    IndividualBulkResponse: number of created individuals and the rows with a used name
+    """
+
+    individuals = iter_request_rows(request, IndividualCreate)
+    res = await service_bulk_create_individuals(db=db, individuals=individuals)
     return res
 
 
@@ -84,7 +173,7 @@ async def create_individual(individual_create: IndividualCreate, db: Session = D
             status_code=status.HTTP_201_CREATED,
             description="Update an individual by id")
 async def update_individual(individual_id: int, individual_update: IndividualUpdate,
-                            db: Session = Depends(get_db)):
+                            db: AsyncSession = Depends(get_async_db)):
     """
     Update an individual
     :parameter:
@@ -96,22 +185,20 @@ async def update_individual(individual_id: int, individual_update: IndividualUpd
     IndividualResponse: pydantic schema of update data
     """
 
-    res = service_get_individual_by_id(db=db, individual_id=individual_id)
-    if res:  # check if the individual is already exits
-        res_update = service_update_individual(db=db, individual_id=individual_id, individual=individual_update)
-
-        # TODO: Decoupling the update errors
-        if res_update:  # fails if the individual name is already used
-            return res_update
+    res = await service_update_individual(db=db, individual_id=individual_id, individual=individual_update)
+    if res:
+        return res
 
+    if res is None:  # check if the individual is already exits
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="The individual name already used"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The individual not found"
         )
 
+    # fails if the individual name is already used
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="The individual not found"
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="The individual name already used"
     )
 
 
@@ -119,7 +206,7 @@ async def update_individual(individual_id: int, individual_update: IndividualUpd
                responses={status.HTTP_404_NOT_FOUND: {"model": ExceptionSchema}},
                status_code=status.HTTP_200_OK,
                description="Delete an individual by id")
-async def delete_individual(individual_id: int, db: Session = Depends(get_db)):
+async def delete_individual(individual_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Delete an individual
     :parameter:
@@ -130,9 +217,8 @@ async def delete_individual(individual_id: int, db: Session = Depends(get_db)):
     {"message": "The individual deleted"}: confirmation message
     """
 
-    res = service_get_individual_by_id(db=db, individual_id=individual_id)
+    res = await service_delete_individual(db=db, individual_id=individual_id)
     if res:  # check if the individual is already exits
-        service_delete_individual(db=db, individual_id=individual_id)
         return {"message": "The individual deleted"}
 
     raise HTTPException(
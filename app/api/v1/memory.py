@@ -1,23 +1,37 @@
-from typing import List
+import asyncio
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.database import get_db
+from app.db.database import get_async_db
+from app.db.models.resource_version import VERSION_MEMORIES
 from app.schemas.exception_schema import ExceptionSchema
-from app.services.individuals import service_get_individual_by_id
-from app.services.family_enviroment import service_get_family_by_id
+from app.schemas.pagination_schema import Page
+from app.utils.pagination import Pagination, get_pagination, get_ranked_pagination, build_page
+from app.utils.ndjson import NDJSON_MEDIA_TYPE, iter_ndjson_models
+from app.utils.rows import Detail, get_detail
+from app.utils.loader import EntityLoader, get_loader
+from app.utils.etag import make_etag, conditional_response
+from app.services.resource_version import service_get_version
+from app.services.individuals import INDIVIDUAL_BY_ID, INDIVIDUAL_RESPONSE_BY_ID
+from app.services.family_enviroment import FAMILY_BY_ID, FAMILY_RESPONSE_BY_ID
 
 from app.services.memory import (service_get_all_memory_family,
+                                 service_search_memories,
                                  service_get_memory_family_individual,
                                  service_get_memory_family_individual_full,
                                  service_create_memory,
-                                 service_get_memory_by_id, service_update_memory_by_id, service_delete_memory_by_id)
+                                 service_import_memories,
+                                 service_update_memory_by_id,
+                                 service_delete_memory_by_id)
 
 from app.schemas.memory_schema import (MemoryBasicResponse,
+                                       MemorySearchResponse,
                                        MemoryFullResponse,
                                        MemoryCreate,
-                                       MemoryUpdate)
+                                       MemoryUpdate,
+                                       MemoryImportResponse)
 
 router = APIRouter(
     prefix="/memory",
@@ -25,63 +39,132 @@ router = APIRouter(
 )
 
 
-@router.get('/{family_id}',
-            response_model=List[MemoryBasicResponse],
+# declared before /{family_id}, otherwise search is parsed as a family ID
+@router.get('/search',
+            response_model=Page[MemorySearchResponse],
             responses={
                 status.HTTP_204_NO_CONTENT: {"model": None}
             },
             status_code=status.HTTP_200_OK,
-            description="Retrieve a memory by family")
-async def get_memory(family_id: int, db: Session = Depends(get_db)):
+            description="Search memories by keywords")
+async def search_memory(q: str = Query(..., min_length=1, max_length=256,
+                                       description='keywords, "a phrase", -excluded or alternatives with or'),
+                        family_id: Optional[int] = Query(None, description="only memories of a family"),
+                        individual_id: Optional[int] = Query(None, description="only memories of an individual"),
+                        patient_id: Optional[int] = Query(None, description="only memories of a patient network"),
+                        pagination: Pagination = Depends(get_ranked_pagination),
+                        detail: Detail = Depends(get_detail),
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Full-text search of memories, the best match first
+
+    :param q: search query
+    :param family_id: ID of a family, None for all families
+    :param individual_id: ID of an individual, None for all individuals
+    :param patient_id: ID of a patient, None for all patients
+    :param pagination: limit and cursor of the page
+    :param detail: summary for a preview of the texts, full for the whole texts
+    :param db: database connection
+    :return:
+    Page[MemorySearchResponse]: a page of matched memories
+    """
+
+    ret = await service_search_memories(db=db, query=q, family_id=family_id, individual_id=individual_id,
+                                        patient_id=patient_id, limit=pagination.limit + 1,
+                                        after=pagination.after, detail=detail)
+    if ret:  # check if memories are matched
+        return build_page(ret, pagination.limit, key=lambda row: [row.rank, row.memory_id])
+
+    raise HTTPException(
+        status_code=status.HTTP_204_NO_CONTENT
+    )
+
+
+@router.get('/{family_id}',
+            response_model=Page[MemoryBasicResponse],
+            responses={
+                status.HTTP_204_NO_CONTENT: {"model": None},
+                status.HTTP_304_NOT_MODIFIED: {"model": None},
+            },
+            status_code=status.HTTP_200_OK,
+            description="Retrieve a memory by family, 304 if the If-None-Match header is the ETag of the memories")
+async def get_memory(family_id: int, request: Request, response: Response,
+                     pagination: Pagination = Depends(get_pagination),
+                     detail: Detail = Depends(get_detail),
+                     db: AsyncSession = Depends(get_async_db)):
     """
     Get memory
 
     :param family_id: ID of a family
+    :param request: the request, its If-None-Match header
+    :param response: the response, its ETag header
+    :param pagination: limit and cursor of the page
+    :param detail: summary for a preview of the texts, full for the whole texts
     :param db: database connection
     :return:
-    List[MemoryBasicResponse]: list of memory
+    Page[MemoryBasicResponse]: a page of memory, or Response 304 Not Modified
     """
 
-    ret = service_get_all_memory_family(db=db, family_id=family_id)
+    # the version is read before the memories, a write in between is sent again on the next poll
+    version = await service_get_version(db=db, resource=VERSION_MEMORIES, scope_id=family_id)
+    not_modified = conditional_response(request, response, make_etag(VERSION_MEMORIES, family_id, version))
+    if not_modified:
+        return not_modified
+
+    ret = await service_get_all_memory_family(db=db, family_id=family_id, limit=pagination.limit + 1,
+                                              after_id=pagination.after, detail=detail)
     if ret:  # check if there are memories
-        return ret
+        return build_page(ret, pagination.limit, key=lambda row: row.memory_id)
 
     raise HTTPException(
-        status_code=status.HTTP_204_NO_CONTENT
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers=dict(response.headers)  # the ETag of the empty list
     )
 
 
 @router.get('/{family_id}/{individual_id}/full',
-            response_model=List[MemoryFullResponse],
+            response_model=Page[MemoryFullResponse],
             responses={
                 status.HTTP_204_NO_CONTENT: {"model": None},
                 status.HTTP_400_BAD_REQUEST: {"model": ExceptionSchema}
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve a memory by family and individual")
-async def get_memory_family_individual_full(individual_id: int, family_id: int, db: Session = Depends(get_db)):
+async def get_memory_family_individual_full(individual_id: int, family_id: int,
+                                            pagination: Pagination = Depends(get_pagination),
+                                            detail: Detail = Depends(get_detail),
+                                            loader: EntityLoader = Depends(get_loader),
+                                            db: AsyncSession = Depends(get_async_db)):
     """
     Get all memories with full response of a specific individual and a specific family
 
     :param individual_id: ID of an individual
     :param family_id: ID of a family
+    :param pagination: limit and cursor of the page
+    :param detail: summary for a preview of the texts, full for the whole texts
+    :param loader: loader of the individual and the family of the request
     :param db: database connection
 
     :return:
-    List[MemoryFullResponse]: list of memories
+    Page[MemoryFullResponse]: a page of memories
     """
 
-    ret_individual = service_get_individual_by_id(db=db, id=individual_id)
-    ret_family = service_get_family_by_id(db=db, id=family_id)
+    # the rows of the response are the existence checks
+    ret_individual, ret_family = await asyncio.gather(
+        loader.load(INDIVIDUAL_RESPONSE_BY_ID[detail], individual_id),
+        loader.load(FAMILY_RESPONSE_BY_ID, family_id)
+    )
 
     # TODO: check if there is a membership
 
     # check if an individual and a family are exists
     if ret_individual and ret_family:
-        ret = service_get_memory_family_individual_full(db=db, family_id=family_id, individual_id=individual_id)
+        ret = await service_get_memory_family_individual_full(db=db, individual=ret_individual, family=ret_family,
+                                                              limit=pagination.limit + 1, after_id=pagination.after,
+                                                              detail=detail)
 
         if ret:
-            return ret
+            return build_page(ret, pagination.limit, key=lambda row: row.memory_id)
         raise HTTPException(
             status_code=status.HTTP_204_NO_CONTENT
         )
@@ -93,35 +176,47 @@ async def get_memory_family_individual_full(individual_id: int, family_id: int,
 
 
 @router.get('/{family_id}/{individual_id}',
-            response_model=List[MemoryBasicResponse],
+            response_model=Page[MemoryBasicResponse],
             responses={
                 status.HTTP_204_NO_CONTENT: {"model": None},
                 status.HTTP_400_BAD_REQUEST: {"model": ExceptionSchema}
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve a memory by family and individual")
-async def get_memory_family_individual(individual_id: int, family_id: int, db: Session = Depends(get_db)):
+async def get_memory_family_individual(individual_id: int, family_id: int,
+                                       pagination: Pagination = Depends(get_pagination),
+                                       detail: Detail = Depends(get_detail),
+                                       loader: EntityLoader = Depends(get_loader),
+                                       db: AsyncSession = Depends(get_async_db)):
     """
     Get all memories with basic response of a specific individual and a specific family
 
     :param individual_id: ID of an individual
     :param family_id: ID of a family
+    :param pagination: limit and cursor of the page
+    :param detail: summary for a preview of the texts, full for the whole texts
+    :param loader: loader of the individual and the family of the request
     :param db: database connection
 
     :return:
-    List[MemoryFullResponse]: list of memories
+    Page[MemoryBasicResponse]: a page of memories
     """
 
-    ret_individual = service_get_individual_by_id(db=db, id=individual_id)
-    ret_family = service_get_family_by_id(db=db, id=family_id)
+    # the lookups are cached, the ones not cached are fetched together
+    ret_individual, ret_family = await asyncio.gather(
+        loader.load(INDIVIDUAL_BY_ID, individual_id),
+        loader.load(FAMILY_BY_ID, family_id)
+    )
 
     # TODO: check if there is a membership
 
     # check if an individual and a family are exists
     if ret_individual and ret_family:
-        ret = service_get_memory_family_individual(db=db, family_id=family_id, individual_id=individual_id)
+        ret = await service_get_memory_family_individual(db=db, family_id=family_id, individual_id=individual_id,
+                                                         limit=pagination.limit + 1, after_id=pagination.after,
+                                                         detail=detail)
         if ret:
-            return ret
+            return build_page(ret, pagination.limit, key=lambda row: row.memory_id)
         raise HTTPException(
             status_code=status.HTTP_204_NO_CONTENT
         )
@@ -139,7 +234,7 @@ async def get_memory_family_individual(individual_id: int, family_id: int, db: S
              },
              status_code=status.HTTP_201_CREATED,
              description="Create a memory")
-async def create_memory(memory: MemoryCreate, db: Session = Depends(get_db)):
+async def create_memory(memory: MemoryCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create a memory
 
@@ -149,7 +244,7 @@ async def create_memory(memory: MemoryCreate, db: Session = Depends(get_db)):
     MemoryBasicResponse: pydantic of memory basic response
     """
 
-    ret = service_create_memory(db=db, memory=memory)
+    ret = await service_create_memory(db=db, memory=memory)
 
     # validate the creation
     if ret:
@@ -161,6 +256,38 @@ async def create_memory(memory: MemoryCreate, db: Session = Depends(get_db)):
     )
 
 
+@router.post('/import',
+             response_model=MemoryImportResponse,
+             status_code=status.HTTP_201_CREATED,
+             description="Import memories from a NDJSON stream",
+             openapi_extra={
+                 "requestBody": {
+                     "required": True,
+                     "content": {
+                         NDJSON_MEDIA_TYPE: {"schema": {"$ref": "#/components/schemas/MemoryCreate"}}
+                     }
+                 }
+             })
+async def import_memories(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Import memories from a NDJSON stream, one memory per line
+
+    the body is parsed while it is received, it is never buffered.
+    A line longer than MAX_NDJSON_LINE_LENGTH stops the import, it is the last rejected line
+    and the memories before it are kept
+
+    :param request: body with a NDJSON stream of memories
+    :param db: database connection
+
+    :return:
+    MemoryImportResponse: number of inserted memories and the rejected lines
+    """
+
+    memories = iter_ndjson_models(request.stream(), MemoryCreate)
+    ret = await service_import_memories(db=db, memories=memories)
+    return ret
+
+
 @router.put('/{memory_id}',
             response_model=MemoryBasicResponse,
             responses={
@@ -168,7 +295,7 @@ async def create_memory(memory: MemoryCreate, db: Session = Depends(get_db)):
             },
             status_code=status.HTTP_201_CREATED,
             description="Update a memory by id")
-async def update_memory(memory_id: int, text: MemoryUpdate, db: Session = Depends(get_db)):
+async def update_memory(memory_id: int, text: MemoryUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     Update a memory by id
 
@@ -180,11 +307,10 @@ async def update_memory(memory_id: int, text: MemoryUpdate, db: Session = Depend
     MemoryBasicResponse: pydantic basic response of memory
     """
 
-    ret = service_get_memory_by_id(db=db, memory_id=memory_id)
+    ret = await service_update_memory_by_id(db=db, memory_id=memory_id, memory=text)
 
     if ret:  # check if the memory exist
-        ret_update = service_update_memory_by_id(db=db, memory_id=memory_id, memory=text)
-        return ret_update
+        return ret
 
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
@@ -198,7 +324,7 @@ async def update_memory(memory_id: int, text: MemoryUpdate, db: Session = Depend
                },
                status_code=status.HTTP_200_OK,
                description="Delete a memory by id")
-async def delete_memory(memory_id: int, db: Session = Depends(get_db)):
+async def delete_memory(memory_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Delete a memory by id
 
@@ -209,11 +335,10 @@ async def delete_memory(memory_id: int, db: Session = Depends(get_db)):
     None
     """
 
-    ret = service_get_memory_by_id(db=db, memory_id=memory_id)
+    ret = await service_delete_memory_by_id(db=db, memory_id=memory_id)
 
     # check if a memory exist
     if ret:
-        service_delete_memory_by_id(db=db, memory_id=memory_id)
         return {"message": "memory deleted"}
 
     raise HTTPException(
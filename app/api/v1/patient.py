@@ -1,20 +1,23 @@
-from typing import List
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.database import get_db
+from app.db.database import get_async_db, stream_in_session
+from app.db.models.resource_version import VERSION_PATIENTS
 from app.schemas.exception_schema import ExceptionSchema
-from app.services.family_membership import service_count_families_for_individual
-
+from app.schemas.pagination_schema import Page
+from app.utils.pagination import Pagination, get_pagination, build_page
+from app.utils.ndjson import NDJSON_MEDIA_TYPE, StreamFormat, streaming_response
+from app.utils.rows import Detail, get_detail
+from app.utils.etag import make_etag, conditional_response
+from app.services.resource_version import service_get_version
 from app.services.patient import (service_get_all_patient,
-                                  service_get_patient,
                                   service_create_patient,
-                                  service_get_family_patient_by_id,
-                                  service_get_patient_by_id,
                                   service_update_patient,
                                   service_delete_patient,
-                                  service_get_all_memories_of_all_individual_by_patient)
+                                  service_get_all_memories_of_all_individual_by_patient,
+                                  service_stream_memories_of_all_individual_by_patient)
 
 from app.schemas.patient_schema import (PatientBasicResponse,
                                         PatientCreate,
@@ -28,53 +31,82 @@ router = APIRouter(
 
 
 @router.get('/',
-            response_model=List[PatientBasicResponse],
+            response_model=Page[PatientBasicResponse],
             responses={
-                status.HTTP_204_NO_CONTENT: {"model": None}
+                status.HTTP_204_NO_CONTENT: {"model": None},
+                status.HTTP_304_NOT_MODIFIED: {"model": None},
             },
             status_code=status.HTTP_200_OK,
-            description="Retrieve a patient by id")
-async def get_patient(db: Session = Depends(get_db)):
+            description="Retrieve a patient by id, 304 if the If-None-Match header is the ETag of the patients")
+async def get_patient(request: Request, response: Response,
+                      pagination: Pagination = Depends(get_pagination),
+                      db: AsyncSession = Depends(get_async_db)):
     """
     Get all patient
 
+    :param request: the request, its If-None-Match header
+    :param response: the response, its ETag header
+    :param pagination: limit and cursor of the page
     :param db: database connection
 
     :return:
-    List[PatientBasicResponse]: List of all patient
+    Page[PatientBasicResponse]: a page of patients, or Response 304 Not Modified
     """
 
-    res = service_get_all_patient(db)
+    # the version is read before the patients, a write in between is sent again on the next poll
+    version = await service_get_version(db=db, resource=VERSION_PATIENTS)
+    not_modified = conditional_response(request, response, make_etag(VERSION_PATIENTS, 0, version))
+    if not_modified:
+        return not_modified
+
+    res = await service_get_all_patient(db, limit=pagination.limit + 1, after_id=pagination.after)
     if res:  # check if there are patients
-        return res
+        return build_page(res, pagination.limit, key=lambda row: row.patient_id)
 
     raise HTTPException(
-        status_code=status.HTTP_204_NO_CONTENT
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers=dict(response.headers)  # the ETag of the empty list
     )
 
 
 @router.get('/memory/{patient_id}',
-            response_model=List[PatientMemory],
+            response_model=Page[PatientMemory],
             responses={
+                status.HTTP_200_OK: {"content": {NDJSON_MEDIA_TYPE: {}}},
                 status.HTTP_204_NO_CONTENT: {"model": None}
             },
             status_code=status.HTTP_200_OK,
             description="Retrieve memories of all individual for a given patient by id")
-async def get_memory_patient(patient_id: int, db: Session = Depends(get_db)):
+async def get_memory_patient(patient_id: int, pagination: Pagination = Depends(get_pagination),
+                             stream: Optional[StreamFormat] = Query(
+                                 None, description="stream all memories as ndjson or a json array, "
+                                                   "the pagination is ignored"),
+                             detail: Detail = Depends(get_detail),
+                             db: AsyncSession = Depends(get_async_db)):
     """
     Retrieve memories of all individual for a given patient by ID
 
     :param patient_id: ID of a patient
+    :param pagination: limit and cursor of the page
+    :param stream: None for a page, ndjson or json to stream all memories
+    :param detail: summary for a preview of the texts, full for the whole texts
     :param db: database connection
 
     :return:
-    List[PatientMemory]: List of memories
+    Page[PatientMemory]: a page of memories, or StreamingResponse of all memories
     """
 
-    res = service_get_all_memories_of_all_individual_by_patient(db=db, patient_id=patient_id)
+    if stream:  # the memories are read from a server side cursor batch by batch
+        return streaming_response(stream_in_session(service_stream_memories_of_all_individual_by_patient,
+                                                    patient_id=patient_id, detail=detail),
+                                  PatientMemory, stream)
+
+    res = await service_get_all_memories_of_all_individual_by_patient(db=db, patient_id=patient_id,
+                                                                      limit=pagination.limit + 1,
+                                                                      after_id=pagination.after, detail=detail)
 
     if res:  # Check if memories are exists
-        return res
+        return build_page(res, pagination.limit, key=lambda row: row.memory_id)
 
     raise HTTPException(
         status_code=status.HTTP_204_NO_CONTENT
@@ -89,7 +121,7 @@ async def get_memory_patient(patient_id: int, db: Session = Depends(get_db)):
              },
              status_code=status.HTTP_201_CREATED,
              description="Create a patient")
-async def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
+async def create_patient(patient: PatientCreate, db: AsyncSession = Depends(get_async_db)):
     """
     Create a patient
 
@@ -100,41 +132,30 @@ async def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
     PatientBasicResponse: pydantic schema of patient basic response
     """
 
-    res = service_get_patient(db=db, patient=patient)
+    res = await service_create_patient(db=db, patient=patient)
 
-    if not res:  # check if the patient is exits
-
-        patient_family = service_get_family_patient_by_id(db=db, family_id=patient.family_environment_id)
-
-        # TODO: optimize the search criteria of patient, in one query
-        if not patient_family:  # check if the patient has family
-
-            count = service_count_families_for_individual(db=db, individual_id=patient.patient_id)
-
-            # check number of families
-            # - patient must have only one family
-            if count == 1:
-
-                patient_create = service_create_patient(db=db, patient=patient)
+    # check the creation of a patient
+    # - patient_id: must be a foreign key in Individual
+    # - family_environment_id: must be a foreign key in family environment
+    if res and res.patient_id is not None:
+        return res
 
-                # check the creation of a patient
-                # - patient_id: must be a foreign key in Individual
-                # - family_environment_id: must be a foreign key in family environment
-                if patient_create:
-                    return patient_create
+    if res and res.patient_exists:  # check if the patient is exits
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Patient already exist"
+        )
 
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Bad request, check values"
-            )
+    if res and res.family_full:  # check if the family has a patient
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Family is full"
         )
 
+    # - patient must have only one family
     raise HTTPException(
-        status_code=status.HTTP_409_CONFLICT,
-        detail="Patient already exist"
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Bad request, check values"
     )
 
 
@@ -147,7 +168,7 @@ async def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
             },
             status_code=status.HTTP_200_OK,
             description="Update a patient by id")
-async def update_patient(patient: PatientUpdate, db: Session = Depends(get_db)):
+async def update_patient(patient: PatientUpdate, db: AsyncSession = Depends(get_async_db)):
     """
     Update patient
 
@@ -158,31 +179,31 @@ async def update_patient(patient: PatientUpdate, db: Session = Depends(get_db)):
     PatientUpdate: pydantic schema of updating a patient
     """
 
-    res = service_get_patient(db=db, patient=patient)
-    if res:  # check if the patient_id is valid
-        patient_family = service_get_family_patient_by_id(db=db, family_id=patient.family_environment_id)
-        if not patient_family:  # check if the family is already has patient
-            count = service_count_families_for_individual(db=db, individual_id=patient.patient_id)
-            if count == 1:  # check if the patient has more than one family membership
-                ret_update_patient = service_update_patient(db=db, patient=patient)
-                if ret_update_patient:  # check if the update done
-                    return ret_update_patient
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Bad request, bad values"
-                )
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Bad request, individual has more than family membership"
-            )
+    res = await service_update_patient(db=db, patient=patient)
+    if res and res.patient_id is not None:  # check if the update done
+        return res
+
+    if res and not res.patient_exists:  # check if the patient_id is valid
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Patient not found"
+        )
+
+    if res and res.family_full:  # check if the family is already has patient
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Family is full"
         )
 
+    if res and res.memberships != 1:  # check if the patient has more than one family membership
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bad request, individual has more than family membership"
+        )
+
     raise HTTPException(
-        status_code=status.HTTP_404_NOT_FOUND,
-        detail="Patient not found"
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Bad request, bad values"
     )
 
 
@@ -192,7 +213,7 @@ async def update_patient(patient: PatientUpdate, db: Session = Depends(get_db)):
                },
                status_code=status.HTTP_200_OK,
                description="Delete a patient by id")
-async def delete_patient(patient_id: int, db: Session = Depends(get_db)):
+async def delete_patient(patient_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     Delete a patient by id
 
@@ -203,9 +224,8 @@ async def delete_patient(patient_id: int, db: Session = Depends(get_db)):
     {"message": "delete patient"}: confirmation message
     """
 
-    res = service_get_patient_by_id(db=db, patient_id=patient_id)
-    if res:
-        service_delete_patient(db=db, patient_id=patient_id)
+    res = await service_delete_patient(db=db, patient_id=patient_id)
+    if res:  # check if the patient exists
         return {"message": "delete patient"}
 
     raise HTTPException(
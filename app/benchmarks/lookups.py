@@ -0,0 +1,192 @@
+"""
+Microbenchmark of the lookups by ID
+
+compares the per call overhead of the statements of the hot paths, built on every call
+and as the cached lambda statements of the services:
+- the lookup of an individual by ID (service_get_individual_by_id)
+- the IN (...) query of the loader of a request (EntityRows.select)
+- the version of a resource (service_get_version, the ETags), on the database only
+
+    python -m app.benchmarks.lookups              # statement overhead, sqlite in memory, no database server
+    python -m app.benchmarks.lookups --database   # the services on the configured database (asyncpg)
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import create_engine, lambda_stmt, select
+from sqlalchemy.orm import Session
+
+from app.db.models import (
+    individual,
+    family_environment,
+    patient,
+    family_member,
+    memory,
+    patient_memory_feed,
+    resource_version
+)
+from app.db.models.individual import Individual
+from app.db.models.resource_version import ResourceVersion, VERSION_FAMILY_MEMBERS
+from app.services.individuals import INDIVIDUAL_BY_ID
+
+BATCH = 10  # IDs per query of the loader
+WARM_UP = 1000  # calls of every lookup before the timings, the compiled cache and the prepared statements are filled
+REPEAT = 5  # the variants are timed in turns, the best of the rounds is reported
+
+
+def _report(name: str, seconds: float, calls: int, baseline: float = None):
+    per_call = seconds / calls * 1e6
+    ratio = f"  x{baseline / seconds:.2f}" if baseline else ""
+    print(f"{name:<36} {per_call:8.1f} us/call{ratio}")
+
+
+def _timeit(lookup, args) -> float:
+    start = time.perf_counter()
+    for arg in args:
+        lookup(arg)
+    return time.perf_counter() - start
+
+
+def _best(timeit, variants) -> list:
+    # the rounds alternate the variants, a slow period of the machine does not favour one of them
+    best = [float("inf")] * len(variants)
+    for _ in range(REPEAT):
+        for n, (lookup, args) in enumerate(variants):
+            best[n] = min(best[n], timeit(lookup, args))
+    return best
+
+
+def _by_id(individual_id: int):
+    return select(Individual.individual_id, Individual.name, Individual.date_of_birth).where(
+        Individual.individual_id == individual_id)
+
+
+def _by_ids(ids: list):
+    return select(*INDIVIDUAL_BY_ID.columns).where(INDIVIDUAL_BY_ID.key.in_(ids))
+
+
+def bench_statements(calls: int):
+    """
+    the statements are executed on a sqlite database in memory,
+    the time is mostly building, compiling and reading the rows, the round trip to a server is not included
+    """
+
+    engine = create_engine("sqlite://")
+    Individual.__table__.create(engine)
+    with Session(engine) as db:
+        db.add_all(Individual(individual_id=i, name=f"individual {i}") for i in range(1, 101))
+        db.commit()
+
+    ids = [i % 100 + 1 for i in range(calls)]
+    batches = [[(i + n) % 100 + 1 for n in range(BATCH)] for i in range(calls)]
+
+    with Session(engine) as db:
+        def built(individual_id):
+            return db.execute(_by_id(individual_id)).first()
+
+        def cached(individual_id):  # the statement of service_get_individual_by_id
+            return db.execute(lambda_stmt(lambda: select(Individual.individual_id, Individual.name,
+                                                         Individual.date_of_birth)
+                                          .where(Individual.individual_id == individual_id))).first()
+
+        def built_many(batch):
+            return db.execute(_by_ids(batch)).all()
+
+        def cached_many(batch):
+            return db.execute(INDIVIDUAL_BY_ID.select(batch)).all()
+
+        for lookup, args in ((built, ids), (cached, ids), (built_many, batches), (cached_many, batches)):
+            _timeit(lookup, args[:WARM_UP])
+
+        baseline, seconds = _best(_timeit, [(built, ids), (cached, ids)])
+        _report("by ID, select()", baseline, calls)
+        _report("by ID, lambda_stmt", seconds, calls, baseline)
+
+        baseline, seconds = _best(_timeit, [(built_many, batches), (cached_many, batches)])
+        _report(f"loader IN ({BATCH} IDs), select()", baseline, calls)
+        _report(f"loader IN ({BATCH} IDs), lambda_stmt", seconds, calls, baseline)
+
+
+async def bench_database(calls: int):
+    """
+    the services and the same statements built on every call, on the configured database
+    asyncpg prepares both on the server, the difference is the overhead in the process,
+    the lookup by ID is measured without and with the cache of the lookups
+    """
+
+    from app.db.database import AsyncSessionLocal
+    from app.services.individuals import service_get_individual_by_id, individual_cache
+    from app.services.resource_version import service_get_version
+
+    async with AsyncSessionLocal() as db:
+        ids = (await db.scalars(select(Individual.individual_id).limit(100))).all()
+        if not ids:
+            print("no individual in the database")
+            return
+        batches = [[ids[(i + n) % len(ids)] for n in range(BATCH)] for i in range(calls)]
+        ids = [ids[i % len(ids)] for i in range(calls)]
+
+        async def run(lookup, args) -> float:
+            start = time.perf_counter()
+            for arg in args:
+                await lookup(arg)
+            return time.perf_counter() - start
+
+        async def built(individual_id):
+            return (await db.execute(_by_id(individual_id))).first()
+
+        async def service(individual_id):
+            return await service_get_individual_by_id(db=db, individual_id=individual_id)
+
+        async def built_many(batch):
+            return (await db.execute(_by_ids(batch))).all()
+
+        async def cached_many(batch):
+            return (await db.execute(INDIVIDUAL_BY_ID.select(batch))).all()
+
+        async def built_version(family_id):
+            return await db.scalar(select(ResourceVersion.version).where(
+                ResourceVersion.resource == VERSION_FAMILY_MEMBERS, ResourceVersion.scope_id == family_id))
+
+        async def version(family_id):
+            return await service_get_version(db=db, resource=VERSION_FAMILY_MEMBERS, scope_id=family_id)
+
+        async def best(*variants) -> list:
+            # as _best, the rounds alternate the variants
+            seconds = [float("inf")] * len(variants)
+            for _ in range(REPEAT):
+                for n, (lookup, args) in enumerate(variants):
+                    seconds[n] = min(seconds[n], await run(lookup, args))
+            return seconds
+
+        maxsize, individual_cache.maxsize = individual_cache.maxsize, 0
+        for lookup, args in ((built, ids), (service, ids), (built_many, batches), (cached_many, batches),
+                             (built_version, ids), (version, ids)):
+            await run(lookup, args[:WARM_UP])
+
+        baseline, seconds = await best((built, ids), (service, ids))
+        _report("by ID, select()", baseline, calls)
+        _report("by ID, service (lambda_stmt)", seconds, calls, baseline)
+
+        individual_cache.maxsize = maxsize
+        _report("by ID, service (cached)", (await best((service, ids)))[0], calls, baseline)
+
+        baseline, seconds = await best((built_many, batches), (cached_many, batches))
+        _report(f"loader IN ({BATCH} IDs), select()", baseline, calls)
+        _report(f"loader IN ({BATCH} IDs), lambda_stmt", seconds, calls, baseline)
+
+        baseline, seconds = await best((built_version, ids), (version, ids))
+        _report("version, select()", baseline, calls)
+        _report("version, service (lambda_stmt)", seconds, calls, baseline)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--database", action="store_true", help="run the services on the configured database")
+    args = parser.parse_args()
+
+    if args.database:
+        asyncio.run(bench_database(args.calls))
+    else:
+        bench_statements(args.calls)
@@ -0,0 +1,66 @@
+"""
+Benchmark of the read paths of the memberships list (GET /v1/familymember/)
+
+rows per second of the ORM path (ORM objects read by the schemas with orm_mode)
+and of the core path (columns validated in bulk), serialised to JSON like a response,
+on the memberships of the configured database:
+
+    python -m app.benchmarks.read_paths
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app.db.models import (
+    individual,
+    family_environment,
+    patient,
+    family_member,
+    memory,
+    patient_memory_feed
+)
+from app.schemas.family_member_schema import FamilyMemberFullResponse
+
+MEMBERS = TypeAdapter(List[FamilyMemberFullResponse])
+
+
+async def bench(limit: int, repeat: int):
+    from app.db.database import AsyncSessionLocal
+    from app.services.family_membership import (service_get_all_family_membership,
+                                                service_get_all_family_membership_rows)
+
+    async def orm() -> int:
+        async with AsyncSessionLocal() as db:
+            res = await service_get_all_family_membership(db=db, limit=limit)
+            return len(MEMBERS.dump_json(MEMBERS.validate_python(res, from_attributes=True)))
+
+    async def core() -> int:
+        async with AsyncSessionLocal() as db:
+            res = await service_get_all_family_membership_rows(db=db, limit=limit)
+            return len(MEMBERS.dump_json(res))
+
+    async with AsyncSessionLocal() as db:
+        rows = len(await service_get_all_family_membership_rows(db=db, limit=limit))
+    if not rows:
+        print("no membership in the database")
+        return
+
+    for name, read in (("orm", orm), ("core", core)):
+        await read()  # warm up the compiled cache and the pool
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await read()
+        seconds = (time.perf_counter() - start) / repeat
+        print(f"{name:<6} {rows} rows {seconds * 1000:8.1f} ms {rows / seconds:10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=None, help="max number of memberships, all by default")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(bench(args.limit, args.repeat))
@@ -10,13 +10,15 @@ DB_PASSWORD = config.password
 DB_NAME = config.name
 
 
-def get_database_url(db_name: str = DB_NAME) -> str:
+def get_database_url(db_name: str = DB_NAME, driver: str = "psycopg2", host: str = DB_HOST) -> str:
     """
     Build a dynamic database connection URL
 
     :param db_name: database name
+    :param driver: DBAPI driver, psycopg2 for the sync engine and asyncpg for the async engine
+    :param host: database server, the primary by default or a read replica
     :return:
     str: a database connection url
     """
 
-    return f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
\ No newline at end of file
+    return f"postgresql+{driver}://{DB_USER}:{DB_PASSWORD}@{host}/{DB_NAME}"
\ No newline at end of file
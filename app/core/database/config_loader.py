@@ -1,5 +1,6 @@
 from pathlib import Path
 from functools import lru_cache
+from typing import List, Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,6 +14,50 @@ class Settings(BaseSettings):
     user_db: str
     password: str
 
+    # connection pool of the engines
+    # - pool_null_pool disables pooling, a connection is opened per checkout (behind PgBouncer)
+    # - pool_recycle is in seconds, -1 never recycle a connection
+    pool_size: int = 5
+    pool_max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = -1
+    pool_pre_ping: bool = False
+    pool_null_pool: bool = False
+
+    # asyncpg prepares the statements on the server, the prepared statements are cached per connection
+    prepared_statement_cache_size: int = 500
+
+    # read replicas, the read only statements are sent to the replicas
+    # - replica_hosts is a json list of hosts with the credentials of the primary, e.g. ["replica1", "replica2:5433"]
+    # - replica_balancing picks a replica for a session, round_robin or least_connections
+    replica_hosts: List[str] = []
+    replica_balancing: Literal["round_robin", "least_connections"] = "round_robin"
+
+    # cache of the lookups of individuals and families by ID and name in every worker, see app.utils.cache
+    # - entity_cache_size is the max number of entries of a cache, 0 disables the cache
+    # - entity_cache_ttl is in seconds, the other workers see a write once their entries expire
+    entity_cache_size: int = 10000
+    entity_cache_ttl: float = 60.0
+
+    # negative cache of the IDs not found by the lookups, updates and deletes by ID in every worker
+    # - missing_id_cache_size is the max number of IDs of an entity, 0 disables the cache
+    # - missing_id_cache_ttl is in seconds, short: a row created by another worker is seen once the ID expires
+    missing_id_cache_size: int = 10000
+    missing_id_cache_ttl: float = 5.0
+
+    # cache of the serialised rosters of the families (GET /v1/familymember/{family_name}), see app.utils.cache
+    # - roster_cache_backend is memory (in every worker) or redis (shared by the workers)
+    # - roster_cache_url is the server of the redis backend, redis://[[user]:password@]host[:port][/db]
+    # - roster_cache_size is the max number of rosters of the memory backend, 0 disables it
+    # - roster_cache_ttl is in seconds, the key of a roster is its version, a write never serves a stale roster
+    roster_cache_backend: Literal["memory", "redis"] = "memory"
+    roster_cache_url: str = "redis://localhost:6379/0"
+    roster_cache_size: int = 1000
+    roster_cache_ttl: float = 300.0
+
+    # endpoints that read the rows without ORM objects, by name of the route function, see app.utils.rows
+    core_read_endpoints: List[str] = []
+
     model_config = SettingsConfigDict(env_file=f"{BASE_DIR}/config/.env")
 
 
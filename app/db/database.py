@@ -1,19 +1,42 @@
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, DDL
 
-from app.core.config import get_database_url
+from app.core.config import config, get_database_url
+from app.db.pool import get_pool_options, get_connect_args
+from app.db.routing import ReplicaSet, RoutingSession
 
 # Database connection URL
 DATABASE_URL = get_database_url()
+ASYNC_DATABASE_URL = get_database_url(driver="asyncpg")
 
 # Create SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **get_pool_options(config))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
 
+# Create SQLAlchemy async engine and session used by the API routers
+# - expire_on_commit is disabled, lazy refresh of attributes is not possible in async
+# - the pool is configured by the pool_* settings, see app.db.pool
+async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=get_connect_args(config),
+                                   **get_pool_options(config, is_async=True))
+
+# Read replicas, a session sends its reads to a replica until it writes, see app.db.routing
+replica_engines = [create_async_engine(get_database_url(driver="asyncpg", host=host),
+                                       connect_args=get_connect_args(config),
+                                       **get_pool_options(config, is_async=True))
+                   for host in config.replica_hosts]
+replicas = ReplicaSet([replica.sync_engine for replica in replica_engines], balancing=config.replica_balancing)
+
+AsyncSessionLocal = async_sessionmaker(autoflush=False, bind=async_engine, expire_on_commit=False,
+                                       class_=AsyncSession, sync_session_class=RoutingSession, replicas=replicas)
+
 # Base class for all models
 Base = declarative_base()
 
+# pg_trgm provides the trigram operators and the gin_trgm_ops index operator class of the name searches
+PG_TRGM_EXTENSION = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+
 
 # DB Utilities
 def get_db():
@@ -21,4 +44,27 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def stream_in_session(service, **kwargs):
+    """
+    Run a streaming service in its own session
+
+    the session of get_async_db is closed before a StreamingResponse is sent,
+    the streamed rows are read by a session that lives as long as the response
+
+    :param service: async generator of a service, it takes the session as db
+    :param kwargs: arguments of the service
+    :return:
+    AsyncIterator of the items of the service
+    """
+
+    async with AsyncSessionLocal() as db:
+        async for item in service(db=db, **kwargs):
+            yield item
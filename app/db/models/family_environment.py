@@ -1,15 +1,25 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Index, event, text
 from sqlalchemy.orm import relationship
-from ..database import Base
+from ..database import Base, PG_TRGM_EXTENSION
 
 
 class FamilyEnvironment(Base):
     __tablename__ = "family_environments"
+    __table_args__ = (
+        # trigram index of the name search
+        Index("ix_family_environments_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     family_environment_id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, nullable=False)
+    # number of members, maintained by the triggers of family_environment_members
+    member_count = Column(Integer, nullable=False, server_default=text("0"))
 
     # Relationships
     patients = relationship("Patient", back_populates="family_environment")
     members = relationship("FamilyEnvironmentMember", back_populates="family_environment")
-    memories = relationship("Memory", back_populates="family_environment")
\ No newline at end of file
+    memories = relationship("Memory", back_populates="family_environment")
+
+
+event.listen(FamilyEnvironment.__table__, "before_create", PG_TRGM_EXTENSION)
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from ..database import Base
+from ..triggers import listen_triggers
 
 
 class FamilyEnvironmentMember(Base):
     __tablename__ = "family_environment_members"
+    __table_args__ = (
+        # an individual has one membership per family, it also indexes the members of a family
+        UniqueConstraint("family_environment_id", "individual_id",
+                         name="uq_family_environment_members_family_individual"),
+        # families of an individual
+        Index("ix_family_environment_members_individual_id", "individual_id", "family_environment_id"),
+    )
 
     family_environment_member_id = Column(Integer, primary_key=True, index=True)
     family_environment_id = Column(Integer, ForeignKey("family_environments.family_environment_id", ondelete="CASCADE"),
@@ -15,3 +23,35 @@ class FamilyEnvironmentMember(Base):
     # Relationships
     family_environment = relationship("FamilyEnvironment", back_populates="members")
     individual = relationship("Individual", back_populates="family_memberships")
+
+
+# individuals.membership_count and family_environments.member_count are maintained by statement level triggers,
+# in the transaction of the insert, update or delete of the memberships (bulk inserts and cascade deletes included)
+FAMILY_MEMBERS_COUNT_FUNCTIONS = {
+    "family_environment_members_count": """
+    IF TG_OP <> 'DELETE' THEN
+        UPDATE individuals AS i SET membership_count = i.membership_count + d.n
+        FROM (SELECT individual_id, count(*) AS n FROM new_rows GROUP BY individual_id) AS d
+        WHERE i.individual_id = d.individual_id;
+
+        UPDATE family_environments AS f SET member_count = f.member_count + d.n
+        FROM (SELECT family_environment_id, count(*) AS n FROM new_rows GROUP BY family_environment_id) AS d
+        WHERE f.family_environment_id = d.family_environment_id;
+    END IF;
+
+    IF TG_OP <> 'INSERT' THEN
+        UPDATE individuals AS i SET membership_count = i.membership_count - d.n
+        FROM (SELECT individual_id, count(*) AS n FROM old_rows GROUP BY individual_id) AS d
+        WHERE i.individual_id = d.individual_id;
+
+        UPDATE family_environments AS f SET member_count = f.member_count - d.n
+        FROM (SELECT family_environment_id, count(*) AS n FROM old_rows GROUP BY family_environment_id) AS d
+        WHERE f.family_environment_id = d.family_environment_id;
+    END IF;""",
+}
+
+FAMILY_MEMBERS_COUNT_TRIGGERS = (
+    ("family_environment_members", "family_environment_members_count", ("INSERT", "UPDATE", "DELETE")),
+)
+
+listen_triggers(FamilyEnvironmentMember.__table__, FAMILY_MEMBERS_COUNT_FUNCTIONS, FAMILY_MEMBERS_COUNT_TRIGGERS)
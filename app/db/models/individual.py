@@ -1,17 +1,27 @@
-from sqlalchemy import Column, Integer, String, Date, event
-from sqlalchemy.orm import relationship
-from ..database import Base
+from sqlalchemy import Column, Integer, String, Date, Index, event, text
+from sqlalchemy.orm import relationship, deferred
+from ..database import Base, PG_TRGM_EXTENSION
 
 
 class Individual(Base):
     __tablename__ = "individuals"
+    __table_args__ = (
+        # trigram index of the name search
+        Index("ix_individuals_name_trgm", "name", postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
 
     individual_id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), unique=True, nullable=False)
     date_of_birth = Column(Date, nullable=True)
-    other_details = Column(String, nullable=True)
+    # unbounded text, deferred: the lists read a preview (?detail=summary), see app.utils.rows
+    other_details = deferred(Column(String, nullable=True))
+    # number of family memberships, maintained by the triggers of family_environment_members
+    membership_count = Column(Integer, nullable=False, server_default=text("0"))
 
     # Relationships
     patient = relationship("Patient", back_populates="individual", uselist=False)
     family_memberships = relationship("FamilyEnvironmentMember", back_populates="individual")
-    memories = relationship("Memory", back_populates="individual")
\ No newline at end of file
+    memories = relationship("Memory", back_populates="individual")
+
+
+event.listen(Individual.__table__, "before_create", PG_TRGM_EXTENSION)
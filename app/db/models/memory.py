@@ -1,17 +1,48 @@
-from sqlalchemy import Column, Integer, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, Text, ForeignKey, Index, Computed, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from ..database import Base
 
+# text search configuration of the memories, the queries must use the same configuration to hit the index
+MEMORY_TEXT_SEARCH_CONFIG = "english"
+
+# memories are hash partitioned on family_environment_id, the queries of a family read one partition
+# the number of partitions can not be changed without a migration that moves the rows
+MEMORY_PARTITIONS = 16
+
 
 class Memory(Base):
     __tablename__ = "memories"
+    __table_args__ = (
+        # memories of a family, ordered by ID for the keyset pagination
+        Index("ix_memories_family_environment_id_memory_id", "family_environment_id", "memory_id"),
+        # memories of an individual (patient feed join) and of an individual in a family
+        Index("ix_memories_individual_id_family_environment_id", "individual_id", "family_environment_id",
+              "memory_id"),
+        # full-text search of the text
+        Index("ix_memories_text_search", "text_search", postgresql_using="gin"),
+        {"postgresql_partition_by": "HASH (family_environment_id)"},
+    )
 
-    memory_id = Column(Integer, primary_key=True, index=True)
+    # the primary key of a partitioned table must contain the partition key,
+    # memory_id is still unique, it is generated by the sequence of the table
+    memory_id = Column(Integer, primary_key=True, autoincrement=True)
     family_environment_id = Column(Integer, ForeignKey("family_environments.family_environment_id", ondelete="CASCADE"),
-                                   nullable=False)
+                                   primary_key=True)
     individual_id = Column(Integer, ForeignKey("individuals.individual_id", ondelete="CASCADE"), nullable=False)
-    text = Column(Text, nullable=False)
+    # deferred: the lists read a preview (?detail=summary), see app.utils.rows
+    text = deferred(Column(Text, nullable=False))
+    # generated by the database from text, it is deferred because it is only used in WHERE of the search
+    text_search = deferred(Column(TSVECTOR, Computed(f"to_tsvector('{MEMORY_TEXT_SEARCH_CONFIG}', text)",
+                                                     persisted=True)))
 
     # Relationships
     family_environment = relationship("FamilyEnvironment", back_populates="memories")
     individual = relationship("Individual", back_populates="memories")
+
+
+for remainder in range(MEMORY_PARTITIONS):
+    event.listen(Memory.__table__, "after_create", DDL(
+        f"CREATE TABLE memories_p{remainder} PARTITION OF memories "
+        f"FOR VALUES WITH (MODULUS {MEMORY_PARTITIONS}, REMAINDER {remainder})"
+    ))
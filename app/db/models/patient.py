@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from ..database import Base
 
 
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        # a family has only one patient, a patient has only one family (primary key)
+        Index("uq_patients_family_environment_id", "family_environment_id", unique=True),
+    )
 
     patient_id = Column(Integer, ForeignKey("individuals.individual_id", ondelete="CASCADE"), primary_key=True)
     family_environment_id = Column(Integer, ForeignKey("family_environments.family_environment_id", ondelete="CASCADE"),
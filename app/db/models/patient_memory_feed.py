@@ -0,0 +1,117 @@
+from sqlalchemy import Column, Integer, Text, ForeignKey, ForeignKeyConstraint, Index
+from sqlalchemy.orm import deferred
+from ..database import Base
+from ..triggers import listen_triggers
+from .family_member import FamilyEnvironmentMember
+
+
+class PatientMemoryFeed(Base):
+    """
+    Memories of the individuals that exist with a patient, one row per patient and memory
+
+    the rows are copies of the memories, maintained by the triggers below in the transaction of the write
+    """
+
+    __tablename__ = "patient_memory_feed"
+    __table_args__ = (
+        ForeignKeyConstraint(["memory_id", "family_environment_id"],
+                             ["memories.memory_id", "memories.family_environment_id"],
+                             ondelete="CASCADE", onupdate="CASCADE"),
+        # cascade of the memories and refresh of an updated memory
+        Index("ix_patient_memory_feed_memory_id", "memory_id", "family_environment_id"),
+        # removal of the memories of an individual that leaves the family of a patient
+        Index("ix_patient_memory_feed_patient_id_individual_id", "patient_id", "individual_id"),
+    )
+
+    # the feed of a patient is a range of the primary key, ordered by memory ID
+    patient_id = Column(Integer, ForeignKey("patients.patient_id", ondelete="CASCADE", onupdate="CASCADE"),
+                        primary_key=True)
+    memory_id = Column(Integer, primary_key=True)
+    family_environment_id = Column(Integer, nullable=False)
+    individual_id = Column(Integer, nullable=False)
+    # deferred like the text of the memories, the lists read a preview (?detail=summary)
+    text = deferred(Column(Text, nullable=False))
+
+
+# the triggers of the memberships are created with the feed
+PatientMemoryFeed.__table__.add_is_dependent_on(FamilyEnvironmentMember.__table__)
+
+# the backfill of the migration selects the same columns
+PATIENT_MEMORY_FEED_INSERT = """
+    INSERT INTO patient_memory_feed (patient_id, memory_id, family_environment_id, individual_id, text)
+    SELECT p.patient_id, m.memory_id, m.family_environment_id, m.individual_id, m.text"""
+
+
+def _lock(table: str, key: str, *rows: str) -> str:
+    # transaction level advisory lock of the keys of the rows, in the namespace of the table (its oid), in order
+    keys = " UNION ".join(f"SELECT {key} FROM {source}" for source in rows)
+    return f"""
+    PERFORM pg_advisory_xact_lock('{table}'::regclass::oid::integer, key)
+    FROM (SELECT DISTINCT key FROM ({keys}) AS changed(key) ORDER BY key) AS keys;"""
+
+
+# a trigger joins the rows of the other tables, under READ COMMITTED it does not see their uncommitted rows:
+# a memory and a membership of its individual written by two concurrent transactions would both miss the feed row.
+# The triggers lock the keys they join on until the end of the transaction, the families then the individuals,
+# a statement after a lock reads the rows committed in between:
+# - memories lock their individuals
+# - memberships lock their families and their individuals
+# - patients lock their families, then the individuals of the members (the memberships are locked by the family)
+# the deletes of memories and patients are cascaded by the foreign keys
+PATIENT_MEMORY_FEED_FUNCTIONS = {
+    "patient_memory_feed_memories": f"""
+    IF TG_OP = 'UPDATE' THEN
+        {_lock("individuals", "individual_id", "new_rows", "old_rows")}
+        DELETE FROM patient_memory_feed AS feed USING old_rows AS o WHERE feed.memory_id = o.memory_id;
+    ELSE
+        {_lock("individuals", "individual_id", "new_rows")}
+    END IF;
+    {PATIENT_MEMORY_FEED_INSERT}
+    FROM new_rows AS m
+    JOIN family_environment_members AS fm ON fm.individual_id = m.individual_id
+    JOIN patients AS p ON p.family_environment_id = fm.family_environment_id
+    ON CONFLICT DO NOTHING;""",
+    "patient_memory_feed_members": f"""
+    IF TG_OP = 'INSERT' THEN
+        {_lock("family_environments", "family_environment_id", "new_rows")}
+        {_lock("individuals", "individual_id", "new_rows")}
+    ELSIF TG_OP = 'UPDATE' THEN
+        {_lock("family_environments", "family_environment_id", "new_rows", "old_rows")}
+        {_lock("individuals", "individual_id", "new_rows", "old_rows")}
+    ELSE
+        {_lock("family_environments", "family_environment_id", "old_rows")}
+        {_lock("individuals", "individual_id", "old_rows")}
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM patient_memory_feed AS feed
+        USING old_rows AS fm JOIN patients AS p ON p.family_environment_id = fm.family_environment_id
+        WHERE feed.patient_id = p.patient_id AND feed.individual_id = fm.individual_id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        {PATIENT_MEMORY_FEED_INSERT}
+        FROM new_rows AS fm
+        JOIN patients AS p ON p.family_environment_id = fm.family_environment_id
+        JOIN memories AS m ON m.individual_id = fm.individual_id
+        ON CONFLICT DO NOTHING;
+    END IF;""",
+    "patient_memory_feed_patients": f"""
+    {_lock("family_environments", "family_environment_id", "new_rows")}
+    {_lock("individuals", "fm.individual_id",
+           "new_rows AS p JOIN family_environment_members AS fm ON fm.family_environment_id = p.family_environment_id")}
+    IF TG_OP = 'UPDATE' THEN
+        DELETE FROM patient_memory_feed AS feed USING old_rows AS o WHERE feed.patient_id = o.patient_id;
+    END IF;
+    {PATIENT_MEMORY_FEED_INSERT}
+    FROM new_rows AS p
+    JOIN family_environment_members AS fm ON fm.family_environment_id = p.family_environment_id
+    JOIN memories AS m ON m.individual_id = fm.individual_id
+    ON CONFLICT DO NOTHING;""",
+}
+
+PATIENT_MEMORY_FEED_TRIGGERS = (
+    ("memories", "patient_memory_feed_memories", ("INSERT", "UPDATE")),
+    ("family_environment_members", "patient_memory_feed_members", ("INSERT", "UPDATE", "DELETE")),
+    ("patients", "patient_memory_feed_patients", ("INSERT", "UPDATE")),
+)
+
+listen_triggers(PatientMemoryFeed.__table__, PATIENT_MEMORY_FEED_FUNCTIONS, PATIENT_MEMORY_FEED_TRIGGERS)
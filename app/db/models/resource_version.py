@@ -0,0 +1,93 @@
+from sqlalchemy import Column, Integer, BigInteger, String
+from ..database import Base
+from ..triggers import listen_triggers
+from .family_environment import FamilyEnvironment
+from .family_member import FamilyEnvironmentMember
+from .individual import Individual
+from .memory import Memory
+from .patient import Patient
+
+# resources of the versions, the scope of a resource is a family or the whole table (scope 0)
+# - family_members: roster of a family, its members and their individuals
+# - memories: memories of a family
+# - patients: all patients
+VERSION_FAMILY_MEMBERS = "family_members"
+VERSION_MEMORIES = "memories"
+VERSION_PATIENTS = "patients"
+
+
+class ResourceVersion(Base):
+    """
+    Version of a resource, the ETag of the endpoints polled by the dashboards
+
+    the versions are bumped by the triggers below in the transaction of the writes (cascades and bulk writes included),
+    a version is never reset, a missing row is version 0
+    """
+
+    __tablename__ = "resource_versions"
+
+    resource = Column(String(64), primary_key=True)
+    scope_id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+# the triggers of the versioned tables are created with the versions
+for table in (FamilyEnvironment, FamilyEnvironmentMember, Individual, Memory, Patient):
+    ResourceVersion.__table__.add_is_dependent_on(table.__table__)
+
+
+def _bump(resource: str, scopes: str) -> str:
+    # one row per scope, in the order of the scopes: concurrent writes lock the versions in the same order
+    return f"""
+        INSERT INTO resource_versions (resource, scope_id, version)
+        SELECT '{resource}', scope_id, 1 FROM ({scopes}) AS changed(scope_id)
+        GROUP BY scope_id ORDER BY scope_id
+        ON CONFLICT (resource, scope_id) DO UPDATE SET version = resource_versions.version + 1;"""
+
+
+def _bump_changed_rows(resource: str, scopes: str) -> str:
+    # scopes selects the scope IDs of the rows of {rows}, new_rows and/or old_rows depending on the operation
+    return f"""
+    IF TG_OP = 'INSERT' THEN {_bump(resource, scopes.format(rows='new_rows'))}
+    ELSIF TG_OP = 'UPDATE' THEN {_bump(resource, scopes.format(rows='new_rows') + ' UNION '
+                                       + scopes.format(rows='old_rows'))}
+    ELSE {_bump(resource, scopes.format(rows='old_rows'))}
+    END IF;"""
+
+
+# a membership changes the membership_count of its individual, shown in the rosters of all the families of the
+# individual: the memberships bump these rosters in their own statement, the versions are locked in one order
+_MEMBERS_SCOPES = ("SELECT family_environment_id FROM {rows} UNION "
+                   "SELECT fm.family_environment_id FROM {rows} AS r "
+                   "JOIN family_environment_members AS fm ON fm.individual_id = r.individual_id")
+
+# the counters of the memberships update individuals and family_environments from the trigger of the memberships
+# (pg_trigger_depth() > 1), these updates are already bumped by the memberships and are skipped
+_SKIP_COUNTERS = """
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;"""
+
+# body of the trigger function of every table
+RESOURCE_VERSION_FUNCTIONS = {
+    "resource_versions_memories": _bump_changed_rows(VERSION_MEMORIES, "SELECT family_environment_id FROM {rows}"),
+    "resource_versions_members": _bump_changed_rows(VERSION_FAMILY_MEMBERS, _MEMBERS_SCOPES),
+    # an individual is shown in the roster of its families, a deleted individual is removed by the cascade
+    "resource_versions_individuals": _SKIP_COUNTERS + _bump(
+        VERSION_FAMILY_MEMBERS,
+        "SELECT fm.family_environment_id FROM new_rows AS i "
+        "JOIN family_environment_members AS fm ON fm.individual_id = i.individual_id"),
+    "resource_versions_families": _SKIP_COUNTERS + _bump(VERSION_FAMILY_MEMBERS,
+                                                         "SELECT family_environment_id FROM new_rows"),
+    "resource_versions_patients": _bump_changed_rows(VERSION_PATIENTS, "SELECT 0 FROM {rows}"),
+}
+
+RESOURCE_VERSION_TRIGGERS = (
+    ("memories", "resource_versions_memories", ("INSERT", "UPDATE", "DELETE")),
+    ("family_environment_members", "resource_versions_members", ("INSERT", "UPDATE", "DELETE")),
+    ("individuals", "resource_versions_individuals", ("UPDATE",)),
+    ("family_environments", "resource_versions_families", ("UPDATE",)),
+    ("patients", "resource_versions_patients", ("INSERT", "UPDATE", "DELETE")),
+)
+
+listen_triggers(ResourceVersion.__table__, RESOURCE_VERSION_FUNCTIONS, RESOURCE_VERSION_TRIGGERS)
@@ -0,0 +1,158 @@
+import time
+import threading
+import uuid
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool, NullPool
+
+from app.core.database.config_loader import Settings
+
+
+class PoolMetrics:
+    """
+    Wait times of the checkouts of a pool
+
+    checkouts: number of checkouts
+    timeouts: number of checkouts that waited more than pool_timeout
+    wait_time_total: seconds spent waiting for a connection
+    wait_time_max: the longest wait in seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record(self, wait_time: float, timeout: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timeout
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total": self.wait_time_total,
+                "wait_time_avg": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                "wait_time_max": self.wait_time_max,
+            }
+
+
+class _MeteredPool:
+    """
+    Mixin of a pool that measures the time a checkout waits for a connection
+
+    _do_get is the point where a pool hands over a connection,
+    it blocks while the pool is exhausted and opens the connection if it is a new one
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record(time.perf_counter() - start, timeout=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+
+class MeteredQueuePool(_MeteredPool, QueuePool):
+    pass
+
+
+class MeteredAsyncAdaptedQueuePool(_MeteredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class MeteredNullPool(_MeteredPool, NullPool):
+    pass
+
+
+def get_pool_options(config: Settings, is_async: bool = False) -> dict:
+    """
+    Build the pool arguments of create_engine from the settings
+
+    :param config: settings of the application
+    :param is_async: True for the engine of create_async_engine
+    :return:
+    dict: keyword arguments of create_engine
+    """
+
+    options = {
+        "pool_pre_ping": config.pool_pre_ping,
+        "pool_recycle": config.pool_recycle,
+    }
+
+    if config.pool_null_pool:  # PgBouncer does the pooling
+        options["poolclass"] = MeteredNullPool
+        return options
+
+    options.update(
+        poolclass=MeteredAsyncAdaptedQueuePool if is_async else MeteredQueuePool,
+        pool_size=config.pool_size,
+        max_overflow=config.pool_max_overflow,
+        pool_timeout=config.pool_timeout,
+    )
+    return options
+
+
+def get_connect_args(config: Settings) -> dict:
+    """
+    Build the asyncpg connection arguments from the settings
+
+    the statements are prepared on the server and cached by every connection of the pool.
+    Behind PgBouncer (pool_null_pool) a server connection is shared by the transactions of the clients,
+    a cached statement may be sent to a server connection that never prepared it: the caches of SQLAlchemy
+    and asyncpg are disabled and the statements get unique names, prepared_statement_cache_size is ignored
+
+    :param config: settings of the application
+    :return:
+    dict: connect_args of create_async_engine
+    """
+
+    if config.pool_null_pool:
+        return {"prepared_statement_cache_size": 0,
+                "statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__"}
+    return {"prepared_statement_cache_size": config.prepared_statement_cache_size}
+
+
+def get_pool_status(pool: Pool) -> dict:
+    """
+    Snapshot of the connections of a pool
+
+    :param pool: pool of an engine
+    :return:
+    dict: pool class, counts of the connections and wait times of the checkouts
+    """
+
+    status = {
+        "pool": type(pool).__name__,
+        "size": None,
+        "checked_out": None,
+        "idle": None,
+        "overflow": None,
+    }
+
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            # overflow() starts at -pool_size, it is positive only when the overflow connections are open
+            overflow=max(pool.overflow(), 0),
+        )
+
+    metrics = getattr(pool, "metrics", None)
+    status["wait"] = metrics.as_dict() if metrics else None
+    return status
@@ -0,0 +1,136 @@
+from itertools import count
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.lambdas import LambdaElement
+from sqlalchemy.sql.selectable import ForUpdateArg
+from sqlalchemy.sql.visitors import iterate
+
+from app.utils.cache import LRUCache
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary database
+
+    round_robin: the replicas are picked in turn
+    least_connections: the replica with the fewest connections in use is picked
+    """
+
+    def __init__(self, engines: List[Engine], balancing: str = "round_robin"):
+        self.engines = engines
+        self.balancing = balancing
+        self._turn = count()
+        self._in_use = {engine: 0 for engine in engines}
+
+        for engine in engines:  # count the connections in use, it works for every kind of pool
+            event.listen(engine, "checkout", self._on_checkout(engine))
+            event.listen(engine, "checkin", self._on_checkin(engine))
+
+    def _on_checkout(self, engine: Engine):
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self._in_use[engine] += 1
+        return on_checkout
+
+    def _on_checkin(self, engine: Engine):
+        def on_checkin(dbapi_connection, connection_record):
+            self._in_use[engine] -= 1
+        return on_checkin
+
+    def in_use(self, engine: Engine) -> int:
+        return self._in_use[engine]
+
+    def pick(self) -> Optional[Engine]:
+        """
+        Pick a replica
+
+        :return:
+        None if there is no replica, or the engine of a replica
+        """
+
+        if not self.engines:
+            return None
+
+        if self.balancing == "least_connections":
+            return min(self.engines, key=self.in_use)
+
+        return self.engines[next(self._turn) % len(self.engines)]
+
+
+# read only check of the lambda statements by the key of their cached statement: a lambda statement is only
+# built into a statement on a miss of the compiled cache, traversing it on every call costs more than it saves
+_read_only_lambdas = LRUCache(maxsize=1000, ttl=float("inf"))
+
+
+def is_read_only(clause) -> bool:
+    """
+    Check if a statement only reads
+
+    a SELECT can write with a data modifying CTE (INSERT/UPDATE/DELETE ... RETURNING in WITH)
+    or lock rows (FOR UPDATE/FOR SHARE, in the statement or a subquery),
+    a cached lambda statement is traversed into the statement it builds, once per cache key
+
+    :param clause: the executed statement
+    :return:
+    bool: True if the statement is a SELECT without data modifying CTE nor locking clause
+    """
+
+    if clause is None or not getattr(clause, "is_select", False):
+        return False
+
+    cache_key = clause._generate_cache_key() if isinstance(clause, LambdaElement) else None
+    if cache_key is None:
+        return _reads_only(clause)
+
+    read_only = _read_only_lambdas.get(cache_key.key)
+    if read_only is None:
+        read_only = _reads_only(clause)
+        _read_only_lambdas.set(cache_key.key, read_only)
+    return read_only
+
+
+def _reads_only(clause) -> bool:
+    return not any(getattr(element, "is_dml", False) or isinstance(element, ForUpdateArg)
+                   for element in iterate(clause))
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the read only statements to a read replica and the rest to the primary
+
+    - a replica is picked once per session, the reads of a request see the same replica
+    - once the session writes (flush, DML, DDL or a raw connection) every statement is sent to the primary,
+      the session reads its own writes until it is closed
+    """
+
+    def __init__(self, *args, replicas: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    @property
+    def uses_primary(self) -> bool:
+        return self.info.get("uses_primary", False)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+
+        # without replica every statement goes to the primary, the statements are not checked
+        if self.replicas is None or not self.replicas.engines or self.uses_primary:
+            return primary
+
+        if not is_read_only(clause):
+            self.info["uses_primary"] = True
+            return primary
+
+        if "replica" not in self.info:
+            self.info["replica"] = self.replicas.pick()
+
+        return self.info["replica"] or primary
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _flush_on_primary(session: Session, flush_context, instances):
+    # the statements of a flush and everything after it go to the primary
+    session.info["uses_primary"] = True
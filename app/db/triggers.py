@@ -0,0 +1,56 @@
+"""
+Statement level triggers of the models
+
+the SQL of a trigger is defined once, in its model, create_all and the migrations build the same statements from it:
+- functions: name of the function -> body, the statements run between BEGIN and RETURN NULL
+- triggers: (table, function, operations), one trigger per operation named {function}_{operation}
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import DDL, Table, event
+
+# rows of the statement, the transition tables of an operation
+TRANSITION_TABLES = {
+    "INSERT": "NEW TABLE AS new_rows",
+    "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    "DELETE": "OLD TABLE AS old_rows",
+}
+
+Triggers = Iterable[Tuple[str, str, Iterable[str]]]
+
+
+def create_trigger_statements(functions: Dict[str, str], triggers: Triggers) -> List[str]:
+    """
+    CREATE statements of the functions, then of their triggers
+    """
+
+    statements = [f"CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+                  f"BEGIN{body}\n    RETURN NULL;\nEND\n$$"
+                  for function, body in functions.items()]
+    statements += [f"CREATE TRIGGER {function}_{operation.lower()} "
+                   f"AFTER {operation} ON {table} REFERENCING {TRANSITION_TABLES[operation]} "
+                   f"FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+                   for table, function, operations in triggers
+                   for operation in operations]
+    return statements
+
+
+def drop_trigger_statements(functions: Dict[str, str], triggers: Triggers) -> List[str]:
+    """
+    DROP statements of the triggers, then of their functions
+    """
+
+    statements = [f"DROP TRIGGER IF EXISTS {function}_{operation.lower()} ON {table}"
+                  for table, function, operations in triggers
+                  for operation in operations]
+    statements += [f"DROP FUNCTION IF EXISTS {function}()" for function in functions]
+    return statements
+
+
+def listen_triggers(table: Table, functions: Dict[str, str], triggers: Triggers) -> None:
+    """
+    Create the functions and the triggers after the table, with create_all
+    """
+
+    for statement in create_trigger_statements(functions, triggers):
+        event.listen(table, "after_create", DDL(statement))
@@ -14,12 +14,16 @@ from app.api.v1.family_environment import router as family_router
 from app.api.v1.family_membership import router as family_membership
 from app.api.v1.patient import router as patient_router
 from app.api.v1.memory import router as memory_router
+from app.api.internal.pool import router as pool_router
+from app.api.internal.cache import router as cache_router
 from app.db.models import (
     individual,
     family_environment,
     patient,
     family_member,
-    memory
+    memory,
+    patient_memory_feed,
+    resource_version
 )
 
 # Create the database if it does not exist
@@ -38,4 +42,8 @@ app.include_router(individual_router, prefix="/v1")
 app.include_router(family_router, prefix="/v1")
 app.include_router(family_membership, prefix="/v1")
 app.include_router(patient_router, prefix="/v1")
-app.include_router(memory_router, prefix="/v1")
\ No newline at end of file
+app.include_router(memory_router, prefix="/v1")
+
+# internal endpoints are not part of the public API
+app.include_router(pool_router, include_in_schema=False)
+app.include_router(cache_router, include_in_schema=False)
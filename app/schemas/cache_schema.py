@@ -0,0 +1,22 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class CacheStatus(BaseModel):
+    """
+    Entries and counters of a cache of a worker
+
+    size and maxsize are None for a shared cache, its entries are counted by the server
+    """
+
+    size: Optional[int]
+    maxsize: Optional[int]
+    ttl: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expirations: int
+    invalidations: int
+    errors: int
@@ -30,11 +30,23 @@ class FamilyEnvironmentResponse(FamilyEnvironmentBase):
     family response
 
     family_environment_id: ID of a family
+    member_count: number of members of a family
     """
     family_environment_id: int
+    member_count: int = 0
 
     class Config:
         """
         orm_mode: parsing ORM object directly
         """
         orm_mode = True
+
+
+class FamilyEnvironmentSearchResponse(FamilyEnvironmentResponse):
+    """
+    Family found by a name search
+
+    similarity: similarity of the name to the query, between 0 and 1
+    """
+
+    similarity: float
@@ -79,3 +79,31 @@ class FamilyMemberInFamily(BaseModel):
 
     name: str
     members: List[FamilyMemberFullIndividual]
+
+
+class FamilyMemberBulkRejected(BaseModel):
+    """
+    A membership of a bulk creation that was not created
+
+    row: position of the membership in the bulk request, starting at 1
+    family_environment_id: ID of a family
+    individual_id: ID of an individual
+    detail: reason of the rejection
+    """
+
+    row: int
+    family_environment_id: int
+    individual_id: int
+    detail: str
+
+
+class FamilyMemberBulkResponse(BaseModel):
+    """
+    response of a bulk creation of family memberships
+
+    created: created memberships
+    rejected: memberships not created with the reason
+    """
+
+    created: List[FamilyMemberBasicResponse]
+    rejected: List[FamilyMemberBulkRejected]
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -40,14 +40,52 @@ class IndividualResponse(IndividualBase):
     individual_id: ID of an individual
     date_of_birth: Birthday of an individual
     other_details: Other details of an individual
+    membership_count: number of families of an individual
     """
 
     individual_id: int
     date_of_birth: Optional[datetime] = None
     other_details: Optional[str] = None
+    membership_count: int = 0
 
     class Config:
         """
         orm_mode: parsing ORM object directly
         """
         orm_mode = True
+
+
+class IndividualSearchResponse(IndividualResponse):
+    """
+    Individual found by a name search
+
+    similarity: similarity of the name to the query, between 0 and 1
+    """
+
+    similarity: float
+
+
+class IndividualBulkConflict(BaseModel):
+    """
+    A row of a bulk creation that was not inserted
+
+    row: position of the individual in the bulk request, starting at 1
+    name: name of the individual
+    detail: reason of the conflict
+    """
+
+    row: int
+    name: str
+    detail: str
+
+
+class IndividualBulkResponse(BaseModel):
+    """
+    response schema of a bulk creation of individuals
+
+    inserted: number of created individuals
+    conflicts: rows not inserted because the name is already used
+    """
+
+    inserted: int
+    conflicts: List[IndividualBulkConflict]
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic import BaseModel
 
 from app.schemas.individual_schema import IndividualResponse
@@ -48,6 +49,15 @@ class MemoryBasicResponse(MemoryBasic):
     memory_id: int
 
 
+class MemorySearchResponse(MemoryBasicResponse):
+    """
+    Memory found by a full-text search
+
+    rank: relevance of the memory to the query, the results are ordered by rank
+    """
+    rank: float
+
+
 class MemoryFullResponse(MemoryBasicResponse):
     """
     full response of a memory
@@ -58,3 +68,27 @@ class MemoryFullResponse(MemoryBasicResponse):
 
     individual: IndividualResponse
     family_environment: FamilyEnvironmentResponse
+
+
+class MemoryImportRejected(BaseModel):
+    """
+    A line of a memory import that was not inserted
+
+    row: line number in the NDJSON stream
+    detail: reason of the rejection
+    """
+
+    row: int
+    detail: str
+
+
+class MemoryImportResponse(BaseModel):
+    """
+    Summary of a memory import
+
+    accepted: number of inserted memories
+    rejected: lines not inserted with the reason
+    """
+
+    accepted: int
+    rejected: List[MemoryImportRejected]
@@ -0,0 +1,16 @@
+from typing import Generic, List, Optional, TypeVar
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    """
+    A page of a keyset paginated list
+
+    items: rows of the page
+    next_cursor: cursor of the next page, None if it is the last page
+    """
+
+    items: List[T]
+    next_cursor: Optional[str] = None
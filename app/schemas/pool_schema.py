@@ -0,0 +1,29 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class PoolWait(BaseModel):
+    checkouts: int
+    timeouts: int
+    wait_time_total: float
+    wait_time_avg: float
+    wait_time_max: float
+
+
+class PoolStatus(BaseModel):
+    """
+    Connections of a pool, the counts are None if the pool does not keep connections (NullPool)
+    """
+
+    pool: str
+    size: Optional[int] = None
+    checked_out: Optional[int] = None
+    idle: Optional[int] = None
+    overflow: Optional[int] = None
+    wait: Optional[PoolWait] = None
+
+
+class PoolsResponse(BaseModel):
+    engine: PoolStatus
+    async_engine: PoolStatus
+    replicas: List[PoolStatus] = []
@@ -1,52 +1,144 @@
+from typing import Optional
+
+from sqlalchemy import select, update, delete, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import config
 from app.db.models.family_environment import FamilyEnvironment
-from app.schemas.family_environment_schema import FamilyEnvironmentCreate, FamilyEnvironmentUpdate
+from app.schemas.family_environment_schema import (FamilyEnvironmentCreate, FamilyEnvironmentUpdate,
+                                                   FamilyEnvironmentResponse)
+from app.utils.cache import LRUCache
+from app.utils.loader import EntityRows
+from app.utils.pagination import TYPEAHEAD_DEFAULT_LIMIT
+from app.utils.rows import RowSchema
+from app.utils.statements import similar_names
+
+# cache of the lookups, rows of family_environment_id and name by ID, and IDs by name
+# the rows are invalidated by the update and delete of a family
+family_cache = LRUCache(config.entity_cache_size, config.entity_cache_ttl)
+family_name_cache = LRUCache(config.entity_cache_size, config.entity_cache_ttl)
+# negative cache, IDs of the lookups and deletes that found no family, removed by the creates
+missing_families = LRUCache(config.missing_id_cache_size, config.missing_id_cache_ttl)
+
+# rows loaded by ID by the loader of a request, the rows of the lookups (cached) and of FamilyEnvironmentResponse
+FAMILY_BY_ID = EntityRows(FamilyEnvironment.family_environment_id,
+                          (FamilyEnvironment.family_environment_id, FamilyEnvironment.name),
+                          cache=family_cache, missing=missing_families)
+FAMILY_RESPONSE_BY_ID = EntityRows(FamilyEnvironment.family_environment_id,
+                                   RowSchema(FamilyEnvironmentResponse, FamilyEnvironment).columns,
+                                   missing=missing_families)
+
+
+async def service_get_all_families(db: AsyncSession, limit: Optional[int] = None, after_id: Optional[int] = None):
+    """
+    Get all families ordered by ID
+    :param db: database connection
+    :param limit: max number of families, None for all
+    :param after_id: return only families with ID greater than after_id (keyset pagination)
+
+    :return:
+    None or object of families
+    """
+
+    stmt = select(FamilyEnvironment).order_by(FamilyEnvironment.family_environment_id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(FamilyEnvironment.family_environment_id > after_id)
+
+    db_family = await db.execute(stmt)
+    return db_family.scalars().all()
 
 
-def service_get_all_families(db: Session):
+async def service_search_families(db: AsyncSession, query: str, limit: int = TYPEAHEAD_DEFAULT_LIMIT):
     """
-    Get all families
+    Typeahead search of families by name, the most similar name first
+
     :param db: database connection
+    :param query: text typed by the user
+    :param limit: max number of families
 
     :return:
-    None or object of families
+    List of families with the similarity of their name
     """
 
-    db_family = db.query(FamilyEnvironment).all()
-    return db_family
+    match, similarity = similar_names(FamilyEnvironment.name, query)
+    stmt = (select(FamilyEnvironment.family_environment_id, FamilyEnvironment.name, FamilyEnvironment.member_count,
+                   similarity.label("similarity"))
+            .where(match)
+            .order_by(similarity.desc(), FamilyEnvironment.name)
+            .limit(limit))
 
+    res = await db.execute(stmt)
+    return res.all()
 
-def service_get_family_by_name(db: Session, name: str):
+
+def _cache_family(row):
+    if row is not None:
+        family_cache.set(row.family_environment_id, row)
+        family_name_cache.set(row.name, row.family_environment_id)
+    return row
+
+
+def invalidate_family(family_id: int):
+    """
+    Remove a family from the cache of the lookups, called by the writes of a family
+
+    :param family_id: ID of a family
     """
-    Get a family by name
+
+    # the name is not invalidated, a name is checked against the row of its ID
+    family_cache.invalidate(family_id)
+
+
+async def service_get_family_by_name(db: AsyncSession, name: str):
+    """
+    Get a family by name, cached
 
     :param db: database connection
     :param name: name of a family
 
     :return:
-    None or object of a family
+    None or row of a family (family_environment_id, name)
     """
 
-    return db.query(FamilyEnvironment).filter(FamilyEnvironment.name == name).first()
+    family_id = family_name_cache.get(name)
+    row = family_cache.get(family_id) if family_id is not None else None
+    if row is not None and row.name == name:
+        return row
+
+    # lambda statement, the statement is built and compiled once, the name is a bound parameter
+    res = await db.execute(lambda_stmt(lambda: select(FamilyEnvironment.family_environment_id, FamilyEnvironment.name)
+                                       .where(FamilyEnvironment.name == name)))
+    return _cache_family(res.first())
 
 
-def service_get_family_by_id(db: Session, family_id: int):
+async def service_get_family_by_id(db: AsyncSession, family_id: int):
     """
-    Get a family by ID
+    Get a family by ID, cached
 
     :param db: Database connection
     :param family_id: ID of a family
 
     :return:
-    None or object of a family
+    None or row of a family (family_environment_id, name)
     """
 
-    return db.query(FamilyEnvironment).filter(FamilyEnvironment.family_environment_id == family_id).first()
+    row = family_cache.get(family_id)
+    if row is not None or missing_families.get(family_id):
+        return row
+
+    res = await db.execute(lambda_stmt(
+        lambda: select(FamilyEnvironment.family_environment_id, FamilyEnvironment.name)
+        .where(FamilyEnvironment.family_environment_id == family_id)
+    ))
+    row = _cache_family(res.first())
+    if row is None:
+        missing_families.set(family_id, True)
+    return row
 
 
-def service_create_family(db: Session, family: FamilyEnvironmentCreate):
+async def service_create_family(db: AsyncSession, family: FamilyEnvironmentCreate):
     """
     Create of a family
 
@@ -54,17 +146,22 @@ def service_create_family(db: Session, family: FamilyEnvironmentCreate):
     :param family: pydantic schema of family creation
 
     :return:
-    None or object of a family
+    None if the name is already used, or object of a family
     """
 
-    db_family = FamilyEnvironment(name=family.name)
-    db.add(db_family)
-    db.commit()
-    db.refresh(db_family)
+    # INSERT ... RETURNING, the created row is read by the same statement
+    # the unique name is checked by the insert itself
+    db_family = await db.scalar(pg_insert(FamilyEnvironment)
+                                .values(name=family.name)
+                                .on_conflict_do_nothing(index_elements=[FamilyEnvironment.name])
+                                .returning(FamilyEnvironment))
+    await db.commit()
+    if db_family is not None:
+        missing_families.invalidate(db_family.family_environment_id)
     return db_family
 
 
-def service_update_family(db: Session, family_id: int, family: FamilyEnvironmentUpdate):
+async def service_update_family(db: AsyncSession, family_id: int, family: FamilyEnvironmentUpdate):
     """
     Update a family
 
@@ -73,19 +170,24 @@ def service_update_family(db: Session, family_id: int, family: FamilyEnvironment
     :param family: pydantic schema of updating a family
 
     :return:
-    None or object of updated family
+    None if the family is not found, False if the name is already used, or object of updated family
     """
 
     try:
-        db_query = db.query(FamilyEnvironment).filter(FamilyEnvironment.family_environment_id == family_id)
-        db_query.update(family.model_dump())
-        db.commit()
-        return db_query.first()
+        # UPDATE ... RETURNING, the updated row is read by the same statement
+        db_family = await db.scalar(update(FamilyEnvironment)
+                                    .where(FamilyEnvironment.family_environment_id == family_id)
+                                    .values(**family.model_dump())
+                                    .returning(FamilyEnvironment))
+        await db.commit()
+        invalidate_family(family_id)
+        return db_family
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
+        return False
 
 
-def service_delete_family(db: Session, family_id: int):
+async def service_delete_family(db: AsyncSession, family_id: int):
     """
     Delete a family
 
@@ -93,10 +195,17 @@ def service_delete_family(db: Session, family_id: int):
     :param family_id: ID of a family
 
     :return:
-    None
+    bool: False if the family is not found
     """
 
-    # TODO: handle failure of the deletion
-    db_query = db.query(FamilyEnvironment).filter(FamilyEnvironment.family_environment_id == family_id)
-    db_query.delete()
-    db.commit()
+    if missing_families.get(family_id):
+        return False
+
+    # DELETE ... RETURNING, the deletion is also the existence check
+    deleted = await db.scalar(delete(FamilyEnvironment)
+                              .where(FamilyEnvironment.family_environment_id == family_id)
+                              .returning(FamilyEnvironment.family_environment_id))
+    await db.commit()
+    invalidate_family(family_id)
+    missing_families.set(family_id, True)
+    return deleted is not None
@@ -1,35 +1,156 @@
+from typing import List, Optional
+
+from sqlalchemy import (select, update, delete, func, case, exists, column, bindparam, literal, or_,
+                        Integer, String)
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager, joinedload, undefer
 
+from app.core.config import config
 from app.db.models.family_member import FamilyEnvironmentMember
 from app.db.models.family_environment import FamilyEnvironment
+from app.db.models.individual import Individual
+from app.db.models.patient import Patient
+from app.utils.cache import create_cache_backend
+from app.utils.ndjson import STREAM_BATCH_SIZE
+from app.utils.rows import Detail, detail_column, row_schemas, set_previews
+from app.utils.statements import lock_rows, select_write_with_checks
+
+from app.schemas.family_member_schema import (FamilyMemberCreate, FamilyMemberUpdate, FamilyMemberFullResponse,
+                                              FamilyMemberInFamily)
+
+# columns of FamilyMemberFullResponse by detail, the individual and the family are read with the membership
+FAMILY_MEMBER_ROWS = row_schemas(FamilyMemberFullResponse, FamilyEnvironmentMember,
+                                 individual=Individual, family_environment=FamilyEnvironment)
+
+# cache of the rosters serialised as JSON, shared by the workers with the redis backend
+# the key is the family, its version and its name, the version is bumped by the writes of the memberships,
+# the individuals and the family
+roster_cache = create_cache_backend(config.roster_cache_backend, config.roster_cache_size, config.roster_cache_ttl,
+                                    url=config.roster_cache_url)
+
+
+def _select_family_members(detail: Detail):
+    # query relation many-to-many
+    if detail == "full":
+        return select(FamilyEnvironmentMember).options(
+            joinedload(FamilyEnvironmentMember.individual).undefer(Individual.other_details),
+            joinedload(FamilyEnvironmentMember.family_environment)
+        ).order_by(FamilyEnvironmentMember.family_environment_member_id)
+
+    # other_details stays deferred, its preview is selected with the individual of the join
+    return (select(FamilyEnvironmentMember, detail_column(Individual.other_details, detail))
+            .join(FamilyEnvironmentMember.individual)
+            .options(contains_eager(FamilyEnvironmentMember.individual),
+                     joinedload(FamilyEnvironmentMember.family_environment))
+            .order_by(FamilyEnvironmentMember.family_environment_member_id))
 
-from app.schemas.family_member_schema import FamilyMemberCreate, FamilyMemberUpdate
 
+def _family_members(rows, detail: Detail) -> list:
+    # rows of (membership,) or (membership, preview of other_details)
+    if detail == "full":
+        return [member for member, in rows]
+    return set_previews(rows, "other_details", target=lambda member: member.individual)
 
-def service_get_all_family_membership(db: Session):
+
+async def service_get_all_family_membership(db: AsyncSession, limit: Optional[int] = None,
+                                            after_id: Optional[int] = None, detail: Detail = "full"):
     """
-    Get all families memberships
+    Get all families memberships ordered by membership ID
 
     :param db: database connection
+    :param limit: max number of memberships, None for all
+    :param after_id: return only memberships with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of other_details of the individuals, full for the whole text
 
     :return:
     None or object of all families memberships
     """
 
-    # query relation many-to-many
-    return db.query(FamilyEnvironmentMember).options(
-        joinedload(FamilyEnvironmentMember.individual),
-        joinedload(FamilyEnvironmentMember.family_environment)
-    ).all()
+    stmt = _select_family_members(detail).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(FamilyEnvironmentMember.family_environment_member_id > after_id)
 
+    res = await db.execute(stmt)
+    return _family_members(res, detail)
 
-def service_get_family_members_by_family(db: Session, family_name: str):
+
+async def service_stream_all_family_membership(db: AsyncSession, detail: Detail = "full",
+                                               batch_size: int = STREAM_BATCH_SIZE):
     """
-    Get all members in a family by family name
+    Stream all families memberships ordered by membership ID through a server side cursor
 
     :param db: database connection
-    :param family_name: name of a family
+    :param detail: summary for a preview of other_details of the individuals, full for the whole text
+    :param batch_size: number of memberships fetched from the cursor at once
+
+    :return:
+    AsyncIterator of lists of at most batch_size memberships
+    """
+
+    # the relationships are many-to-one, joinedload and contains_eager are compatible with yield_per
+    res = await db.stream(_select_family_members(detail).execution_options(yield_per=batch_size))
+    async for partition in res.partitions():
+        yield _family_members(partition, detail)
+
+
+def _select_family_member_rows(detail: Detail):
+    return (select(*FAMILY_MEMBER_ROWS[detail].columns)
+            .join(Individual, Individual.individual_id == FamilyEnvironmentMember.individual_id)
+            .join(FamilyEnvironment,
+                  FamilyEnvironment.family_environment_id == FamilyEnvironmentMember.family_environment_id)
+            .order_by(FamilyEnvironmentMember.family_environment_member_id))
+
+
+async def service_get_all_family_membership_rows(db: AsyncSession, limit: Optional[int] = None,
+                                                 after_id: Optional[int] = None, detail: Detail = "full"):
+    """
+    Get all families memberships ordered by membership ID, read without ORM objects (core read path)
+
+    :param db: database connection
+    :param limit: max number of memberships, None for all
+    :param after_id: return only memberships with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of other_details of the individuals, full for the whole text
+
+    :return:
+    List of FamilyMemberFullResponse
+    """
+
+    stmt = _select_family_member_rows(detail).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(FamilyEnvironmentMember.family_environment_member_id > after_id)
+
+    res = await db.execute(stmt)
+    return FAMILY_MEMBER_ROWS[detail].validate(res.all())
+
+
+async def service_stream_all_family_membership_rows(db: AsyncSession, batch_size: int = STREAM_BATCH_SIZE,
+                                                    detail: Detail = "full"):
+    """
+    Stream all families memberships ordered by membership ID through a server side cursor,
+    read without ORM objects (core read path)
+
+    :param db: database connection
+    :param batch_size: number of memberships fetched from the cursor at once
+    :param detail: summary for a preview of other_details of the individuals, full for the whole text
+
+    :return:
+    AsyncIterator of lists of at most batch_size FamilyMemberFullResponse
+    """
+
+    rows = FAMILY_MEMBER_ROWS[detail]
+    res = await db.stream(_select_family_member_rows(detail).execution_options(yield_per=batch_size))
+    async for partition in res.partitions():
+        yield rows.validate(partition)
+
+
+async def service_get_family_members_by_family_id(db: AsyncSession, family_id: int):
+    """
+    Get all members in a family by family ID
+
+    :param db: database connection
+    :param family_id: ID of a family
 
     :return:
     None or object of all members in a family
@@ -37,120 +158,286 @@ def service_get_family_members_by_family(db: Session, family_name: str):
 
     # query all member in a family
     # query the details of each member from individual
-    family = (
-        db.query(FamilyEnvironment)
+    family = await db.execute(
+        select(FamilyEnvironment)
         .options(
             joinedload(FamilyEnvironment.members).joinedload(FamilyEnvironmentMember.individual)
+            .undefer(Individual.other_details)
         )
-        .filter(FamilyEnvironment.name == family_name)
-        .first()
+        .where(FamilyEnvironment.family_environment_id == family_id)
     )
 
-    return family
+    # joined eager loading of a collection must be de-duplicated
+    return family.unique().scalars().first()
 
 
-def service_get_family_membership(db: Session, family_membership: FamilyMemberCreate):
+async def service_get_family_roster(db: AsyncSession, family, version: int) -> Optional[bytes]:
     """
-    Get a family membership
+    Get all members in a family serialised as JSON, cached
 
     :param db: database connection
-    :param family_membership: pydantic scheme of a family membership, I reused FamilyMemberCreate
+    :param family: row of a family (family_environment_id, name), the name is the name of the request
+    :param version: version of the roster, read before the members (a newer roster may be cached as this version,
+    never an older one)
 
     :return:
-    None or an object of family membership
+    None if the family is deleted or its name is not the name of the row (the row is stale),
+    or FamilyMemberInFamily serialised as JSON
     """
 
-    return db.query(FamilyEnvironmentMember).filter(
-        FamilyEnvironmentMember.family_environment_id == family_membership.family_environment_id,
-        FamilyEnvironmentMember.individual_id == family_membership.individual_id
-    ).first()
+    # the name is in the key, a stale row of a renamed family never reads the roster of its ID under another name
+    key = f"roster:{family.family_environment_id}:{version}:{family.name}"
+    roster = await roster_cache.get(key)
+    if roster is not None:
+        return roster
+
+    res = await service_get_family_members_by_family_id(db=db, family_id=family.family_environment_id)
+    if res is None or res.name != family.name:  # the family is deleted or renamed
+        return None
 
+    roster = FamilyMemberInFamily.model_validate(res, from_attributes=True).model_dump_json().encode()
+    await roster_cache.set(key, roster)
+    return roster
 
-def service_get_family_by_membership_id(db: Session, membership_id: int):
+
+async def service_create_family_membership(db: AsyncSession, family_membership: FamilyMemberCreate):
     """
-    Get family membership by membership id
+    Create a family membership
 
-    :param db: database connection
-    :param membership_id: ID of a membership
+    :param db: database
+    :param family_membership: pydantic schema of family membership creation
+
+    one conditional INSERT, the membership is created only if it does not exist
+    and the individual is not a patient that already has a family,
+    the row of the individual is locked first like the patient writes
 
     :return:
-    None or an object of family membership
+    False if a foreign key is not valid, or row of the created membership
+    (family_environment_member_id is None if it is not created) with the checks membership_exists and is_patient
     """
 
-    return db.query(FamilyEnvironmentMember).filter(
-        FamilyEnvironmentMember.family_environment_member_id == membership_id).first()
+    member = FamilyEnvironmentMember
+    individual_id = family_membership.individual_id
+    is_patient = (exists().where(Patient.patient_id == individual_id)
+                  & exists().where(member.individual_id == individual_id))
+
+    inserted = (
+        pg_insert(member)
+        .from_select(["family_environment_id", "individual_id", "role"],
+                     select(literal(family_membership.family_environment_id, Integer),
+                            literal(individual_id, Integer),
+                            literal(family_membership.role, String))
+                     .where(~is_patient))
+        .on_conflict_do_nothing(constraint="uq_family_environment_members_family_individual")
+        .returning(member.family_environment_member_id, member.family_environment_id,
+                   member.individual_id, member.role)
+        .cte("inserted")
+    )
 
+    # the patient writes of the individual lock its row too, is_patient sees them once they are committed
+    await db.execute(lock_rows(Individual.individual_id, [individual_id]))
 
-def service_create_family_membership(db: Session, family_membership: FamilyMemberCreate):
+    try:
+        res = (await db.execute(select_write_with_checks(
+            inserted,
+            exists().where(member.family_environment_id == family_membership.family_environment_id,
+                           member.individual_id == individual_id).label("membership_exists"),
+            is_patient.label("is_patient")
+        ))).one()
+        await db.commit()
+        return res
+
+    except IntegrityError:
+        await db.rollback()
+        return False
+
+
+async def service_bulk_create_family_membership(db: AsyncSession, memberships: List[FamilyMemberCreate]):
     """
-    Create a family membership
+    Create family memberships in bulk
 
-    :param db: database
-    :param family_membership: pydantic schema of family membership creation
+    the whole batch is checked and inserted by one statement in one transaction, a membership is rejected if
+    - family_environment_id or individual_id is not a foreign key
+    - the membership already exists, or it is repeated earlier in the batch
+    - the individual is a patient and already has a family
+    a batch that fails on a family or an individual deleted concurrently is checked again once,
+    if it fails again every membership is rejected
+
+    :param db: database connection
+    :param memberships: pydantic schemas of family membership creation
 
     :return:
-    None or an object of a family membership
+    dict: the created memberships and the rejected ones with the reason
     """
 
-    try:
-        db_membership = FamilyEnvironmentMember(family_environment_id=family_membership.family_environment_id,
-                                                individual_id=family_membership.individual_id,
-                                                role=family_membership.role)
-        db.add(db_membership)
-        db.commit()
-        db.refresh(db_membership)
-        return db_membership
+    if not memberships:
+        return {"created": [], "rejected": []}
+
+    # the batch is sent as three arrays, the number of bind parameters does not grow with the batch
+    batch = func.unnest(
+        bindparam("family_environment_ids", [m.family_environment_id for m in memberships], type_=ARRAY(Integer)),
+        bindparam("individual_ids", [m.individual_id for m in memberships], type_=ARRAY(Integer)),
+        bindparam("roles", [m.role for m in memberships], type_=ARRAY(String))
+    ).table_valued(
+        column("family_environment_id", Integer),
+        column("individual_id", Integer),
+        column("role", String),
+        with_ordinality="row_number"
+    ).render_derived(name="batch")
+
+    # number the occurrences of a membership in the batch, only the first one may be inserted
+    ranked = select(
+        batch,
+        func.row_number().over(partition_by=(batch.c.family_environment_id, batch.c.individual_id),
+                               order_by=batch.c.row_number).label("occurrence")
+    ).subquery("ranked")
+
+    member = FamilyEnvironmentMember
+    checked = select(
+        ranked,
+        case(
+            (~exists().where(FamilyEnvironment.family_environment_id == ranked.c.family_environment_id)
+             | ~exists().where(Individual.individual_id == ranked.c.individual_id),
+             "Bad values"),
+            (exists().where(member.family_environment_id == ranked.c.family_environment_id,
+                            member.individual_id == ranked.c.individual_id),
+             "The membership already exists"),
+            (ranked.c.occurrence > 1,
+             "The membership is repeated in the batch"),
+            (exists().where(Patient.patient_id == ranked.c.individual_id)
+             & exists().where(member.individual_id == ranked.c.individual_id),
+             "The individual is patient and already has a family"),
+            else_=None
+        ).label("detail")
+    ).cte("checked")
+
+    inserted = (
+        pg_insert(member)
+        .from_select(["family_environment_id", "individual_id", "role"],
+                     select(checked.c.family_environment_id, checked.c.individual_id, checked.c.role)
+                     .where(checked.c.detail.is_(None))
+                     .order_by(checked.c.row_number))
+        .on_conflict_do_nothing(constraint="uq_family_environment_members_family_individual")
+        .returning(member.family_environment_member_id, member.family_environment_id,
+                   member.individual_id, member.role)
+        .cte("inserted")
+    )
 
-    except IntegrityError:
-        db.rollback()
+    stmt = (
+        select(checked.c.row_number, checked.c.detail,
+               checked.c.family_environment_id, checked.c.individual_id, checked.c.role,
+               inserted.c.family_environment_member_id)
+        .outerjoin(inserted, (inserted.c.family_environment_id == checked.c.family_environment_id)
+                   & (inserted.c.individual_id == checked.c.individual_id)
+                   & checked.c.detail.is_(None))
+        .order_by(checked.c.row_number)
+    )
 
+    # the rows of the individuals are locked like by the single create, in the order of their IDs
+    lock = lock_rows(Individual.individual_id, [m.individual_id for m in memberships])
+    await db.execute(lock)
 
-def service_update_family_membership(db: Session, membership_id: int, membership: FamilyMemberUpdate):
+    try:
+        res = (await db.execute(stmt)).all()
+    except IntegrityError:
+        # a family or an individual was deleted after the checks, the batch is checked again on a new snapshot
+        await db.rollback()
+        await db.execute(lock)
+        try:
+            res = (await db.execute(stmt)).all()
+        except IntegrityError:
+            await db.rollback()
+            return {"created": [], "rejected": [{"row": row_number,
+                                                 "family_environment_id": m.family_environment_id,
+                                                 "individual_id": m.individual_id,
+                                                 "detail": "Bad values"}
+                                                for row_number, m in enumerate(memberships, start=1)]}
+
+    created, rejected = [], []
+    for row in res:
+        if row.family_environment_member_id is not None:
+            created.append({"family_environment_member_id": row.family_environment_member_id,
+                            "family_environment_id": row.family_environment_id,
+                            "individual_id": row.individual_id,
+                            "role": row.role})
+        else:
+            # a membership created concurrently is skipped by the unique constraint
+            rejected.append({"row": row.row_number,
+                             "family_environment_id": row.family_environment_id,
+                             "individual_id": row.individual_id,
+                             "detail": row.detail or "The membership already exists"})
+    await db.commit()
+
+    return {"created": created, "rejected": rejected}
+
+
+async def service_update_family_membership(db: AsyncSession, membership_id: int, membership: FamilyMemberUpdate):
     """
     Update a family membership
 
+    one guarded UPDATE, the membership is updated only if neither the new individual
+    nor the old individual is a patient, a patient has only one family
+
     :param db: database connection
     :param membership_id: ID of a family membership
     :param membership: pydantic schema of updating family membership
 
     :return:
-    None or an object of family membership
+    False if the values are not valid, or row of the updated membership
+    (family_environment_member_id is None if it is not updated) with the check membership_exists
     """
 
-    db_check = db.query(FamilyEnvironmentMember).filter(
-        FamilyEnvironmentMember.individual_id == membership.individual_id,
-        FamilyEnvironmentMember.family_environment_id == membership.family_environment_id).first()
-
-    # check if the family membership is exits
-    if not db_check:
+    member = FamilyEnvironmentMember
+    updated = (
+        update(member)
+        .where(member.family_environment_member_id == membership_id,
+               ~exists().where(or_(Patient.patient_id == membership.individual_id,
+                                   Patient.patient_id == member.individual_id)))
+        .values(**membership.model_dump())
+        .returning(member.family_environment_member_id, member.family_environment_id,
+                   member.individual_id, member.role)
+        .cte("updated")
+    )
 
-        try:
-            db_update = db.query(FamilyEnvironmentMember).filter(
-                FamilyEnvironmentMember.family_environment_member_id == membership_id)
-            db_update.update(membership.model_dump())
-            db.commit()
-            return db_update.first()
-        except IntegrityError:
-            db.rollback()
+    # the unique membership constraint fails if the family membership is exits
+    try:
+        res = (await db.execute(select_write_with_checks(
+            updated,
+            exists().where(member.family_environment_member_id == membership_id).label("membership_exists")
+        ))).one()
+        await db.commit()
+        return res
+    except IntegrityError:
+        await db.rollback()
+        return False
 
 
-def service_delete_family_membership(db: Session, membership_id: int):
+async def service_delete_family_membership(db: AsyncSession, membership_id: int):
     """
     Delete a family membership
 
+    one guarded DELETE, the membership is deleted only if its individual is not a patient
+
     :param db: database connection
     :param membership_id: ID of a family membership
 
     :return:
-    None
+    row of the deleted membership (family_environment_member_id is None if it is not deleted)
+    with the check membership_exists
     """
 
-    # TODO: handle failure of the deletion
-    db_query = db.query(FamilyEnvironmentMember).filter(
-        FamilyEnvironmentMember.family_environment_member_id == membership_id)
-    db_query.delete()
-    db.commit()
-
+    member = FamilyEnvironmentMember
+    deleted = (
+        delete(member)
+        .where(member.family_environment_member_id == membership_id,
+               ~exists().where(Patient.patient_id == member.individual_id))
+        .returning(member.family_environment_member_id)
+        .cte("deleted")
+    )
 
-def service_count_families_for_individual(db: Session, individual_id: int):
-    return db.query(FamilyEnvironmentMember).filter(FamilyEnvironmentMember.individual_id == individual_id).count()
+    res = (await db.execute(select_write_with_checks(
+        deleted,
+        exists().where(member.family_environment_member_id == membership_id).label("membership_exists")
+    ))).one()
+    await db.commit()
+    return res
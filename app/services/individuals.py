@@ -1,50 +1,166 @@
+from typing import AsyncIterable, Optional
+
+from sqlalchemy import select, update, delete, func, lambda_stmt, exists, Table, MetaData, Column, Integer, String, Date
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from sqlalchemy.schema import CreateTable
 
+from app.core.config import config
 from app.db.models.individual import Individual
-from app.schemas.individual_schema import IndividualCreate, IndividualUpdate
+from app.schemas.individual_schema import IndividualCreate, IndividualUpdate, IndividualResponse
+from app.utils.cache import LRUCache
+from app.utils.pagination import TYPEAHEAD_DEFAULT_LIMIT
+from app.utils.loader import EntityRows
+from app.utils.rows import Detail, detail_column, row_schemas, set_previews
+from app.utils.statements import similar_names
+
+# staging table of the bulk creation, filled by COPY and dropped at the end of the transaction
+individuals_staging = Table(
+    "individuals_staging", MetaData(),
+    Column("row_number", Integer, nullable=False),
+    Column("name", String(255), nullable=False),
+    Column("date_of_birth", Date, nullable=True),
+    Column("other_details", String, nullable=True),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP"
+)
+
+# columns of IndividualResponse by detail, read without ORM objects
+INDIVIDUAL_ROWS = row_schemas(IndividualResponse, Individual)
 
+# cache of the lookups, rows of individual_id, name and date_of_birth by ID
+# the rows are invalidated by the update and delete of an individual
+individual_cache = LRUCache(config.entity_cache_size, config.entity_cache_ttl)
+# negative cache, IDs of the lookups and deletes that found no individual, removed by the creates
+missing_individuals = LRUCache(config.missing_id_cache_size, config.missing_id_cache_ttl)
 
-def service_get_all_individuals(db: Session):
+# rows loaded by ID by the loader of a request, the rows of the lookups (cached) and of IndividualResponse by detail
+INDIVIDUAL_BY_ID = EntityRows(Individual.individual_id,
+                              (Individual.individual_id, Individual.name, Individual.date_of_birth),
+                              cache=individual_cache, missing=missing_individuals)
+INDIVIDUAL_RESPONSE_BY_ID = {detail: EntityRows(Individual.individual_id, rows.columns, missing=missing_individuals)
+                             for detail, rows in INDIVIDUAL_ROWS.items()}
+
+
+async def service_get_all_individuals(db: AsyncSession, limit: Optional[int] = None, after_id: Optional[int] = None,
+                                      detail: Detail = "full"):
     """
-    Get all individuals
+    Get all individuals ordered by ID
     :parameter:
     db: database connection
+    limit: max number of individuals, None for all
+    after_id: return only individuals with ID greater than after_id (keyset pagination)
+    detail: summary for a preview of other_details, full for the whole text
 
     :return:
     db_individuals: None or object of individuals
     """
 
-    db_individuals = db.query(Individual).all()
-    return db_individuals
+    if detail == "full":
+        stmt = select(Individual).options(undefer(Individual.other_details))
+    else:  # other_details stays deferred, its preview is selected with the individual
+        stmt = select(Individual, detail_column(Individual.other_details, detail))
+    stmt = stmt.order_by(Individual.individual_id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Individual.individual_id > after_id)
+
+    db_individuals = await db.execute(stmt)
+    if detail == "full":
+        return db_individuals.scalars().all()
+    return set_previews(db_individuals, "other_details")
 
 
-def service_get_individual_by_name(db: Session, name: str):
+async def service_get_all_individual_rows(db: AsyncSession, limit: Optional[int] = None,
+                                          after_id: Optional[int] = None, detail: Detail = "full"):
     """
-    Get an individual by name
+    Get all individuals ordered by ID, read without ORM objects (core read path)
+    :parameter:
+    db: database connection
+    limit: max number of individuals, None for all
+    after_id: return only individuals with ID greater than after_id (keyset pagination)
+    detail: summary for a preview of other_details, full for the whole text
+
+    :return:
+    List of IndividualResponse
+    """
+
+    rows = INDIVIDUAL_ROWS[detail]
+    stmt = select(*rows.columns).order_by(Individual.individual_id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Individual.individual_id > after_id)
+
+    res = await db.execute(stmt)
+    return rows.validate(res.all())
+
+
+async def service_search_individuals(db: AsyncSession, query: str, limit: int = TYPEAHEAD_DEFAULT_LIMIT,
+                                     detail: Detail = "full"):
+    """
+    Typeahead search of individuals by name, the most similar name first
+
     :param db: database connection
-    :param name: name of an individual
+    :param query: text typed by the user
+    :param limit: max number of individuals
+    :param detail: summary for a preview of other_details, full for the whole text
 
     :return:
-    None or an individual object
+    List of individuals with the similarity of their name
+    """
+
+    match, similarity = similar_names(Individual.name, query)
+    stmt = (select(Individual.individual_id, Individual.name, Individual.date_of_birth,
+                   detail_column(Individual.other_details, detail), Individual.membership_count,
+                   similarity.label("similarity"))
+            .where(match)
+            .order_by(similarity.desc(), Individual.name)
+            .limit(limit))
+
+    res = await db.execute(stmt)
+    return res.all()
+
+
+def _cache_individual(row):
+    if row is not None:
+        individual_cache.set(row.individual_id, row)
+    return row
+
+
+def invalidate_individual(individual_id: int):
+    """
+    Remove an individual from the cache of the lookups, called by the writes of an individual
+
+    :param individual_id: ID of an individual
     """
-    return db.query(Individual).filter(Individual.name == name).first()
+
+    individual_cache.invalidate(individual_id)
 
 
-def service_get_individual_by_id(db: Session, individual_id: int):
+async def service_get_individual_by_id(db: AsyncSession, individual_id: int):
     """
-    Get an individual by ID
+    Get an individual by ID, cached
 
     :param db: db connection
     :param individual_id: an individual ID
     :return:
-    None or and individual object
+    None or row of an individual (individual_id, name, date_of_birth)
     """
 
-    return db.query(Individual).filter(Individual.individual_id == individual_id).first()
+    row = individual_cache.get(individual_id)
+    if row is not None or missing_individuals.get(individual_id):
+        return row
+
+    res = await db.execute(lambda_stmt(lambda: select(Individual.individual_id, Individual.name,
+                                                      Individual.date_of_birth)
+                                       .where(Individual.individual_id == individual_id)))
+    row = _cache_individual(res.first())
+    if row is None:
+        missing_individuals.set(individual_id, True)
+    return row
 
 
-def service_create_individual(db: Session, individual: IndividualCreate):
+async def service_create_individual(db: AsyncSession, individual: IndividualCreate):
     """
     Create an individual
 
@@ -52,19 +168,96 @@ def service_create_individual(db: Session, individual: IndividualCreate):
     :param individual: Pydantic schema of individual create
 
     :return:
-    None or the created data of an individual
+    None if the name is already used, or the created data of an individual
     """
 
-    db_individual = Individual(name=individual.name,
-                               date_of_birth=individual.date_of_birth,
-                               other_details=individual.other_details)
-    db.add(db_individual)
-    db.commit()
-    db.refresh(db_individual)
+    # INSERT ... RETURNING, the created row is read by the same statement
+    # the unique name is checked by the insert itself
+    db_individual = await db.scalar(pg_insert(Individual)
+                                    .values(name=individual.name,
+                                            date_of_birth=individual.date_of_birth,
+                                            other_details=individual.other_details)
+                                    .on_conflict_do_nothing(index_elements=[Individual.name])
+                                    .returning(Individual)
+                                    .options(undefer(Individual.other_details)))
+    await db.commit()
+    if db_individual is not None:
+        missing_individuals.invalidate(db_individual.individual_id)
     return db_individual
 
 
-def service_update_individual(db: Session, individual_id: int, individual: IndividualUpdate):
+async def service_bulk_create_individuals(db: AsyncSession, individuals: AsyncIterable[IndividualCreate]):
+    """
+    Create individuals in bulk
+
+    the individuals are copied with COPY into a staging table, then merged with one INSERT ... SELECT.
+    An individual is not inserted if its name is already used or repeated earlier in the batch
+
+    :param db: database connection
+    :param individuals: stream of pydantic schema of individual create
+
+    :return:
+    dict: number of inserted individuals and the conflicts
+    """
+
+    staged = 0
+
+    async def records():
+        nonlocal staged
+        async for individual in individuals:
+            staged += 1
+            date_of_birth = individual.date_of_birth.date() if individual.date_of_birth else None
+            yield staged, individual.name, date_of_birth, individual.other_details
+
+    await db.execute(CreateTable(individuals_staging))
+
+    # COPY is not exposed by SQLAlchemy, it is sent by the asyncpg connection of the session transaction
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        individuals_staging.name,
+        records=records(),
+        columns=[column.name for column in individuals_staging.columns]
+    )
+
+    # number the occurrences of a name in the batch, only the first one may be inserted
+    ranked = select(
+        individuals_staging,
+        func.row_number().over(partition_by=individuals_staging.c.name,
+                               order_by=individuals_staging.c.row_number).label("occurrence")
+    ).cte("ranked")
+
+    inserted = (
+        pg_insert(Individual)
+        .from_select(["name", "date_of_birth", "other_details"],
+                     select(ranked.c.name, ranked.c.date_of_birth, ranked.c.other_details)
+                     .where(ranked.c.occurrence == 1)
+                     .order_by(ranked.c.row_number))
+        .on_conflict_do_nothing(index_elements=[Individual.name])
+        .returning(Individual.name)
+        .cte("inserted")
+    )
+
+    # the rows missing from the inserted ones are the conflicts
+    conflicts = await db.execute(
+        select(ranked.c.row_number, ranked.c.name, (ranked.c.occurrence > 1).label("duplicated"))
+        .where(~exists().where(inserted.c.name == ranked.c.name, ranked.c.occurrence == 1))
+        .order_by(ranked.c.row_number)
+    )
+    conflicts = [
+        {"row": row.row_number,
+         "name": row.name,
+         "detail": "Individual repeated in the batch" if row.duplicated else "Individual already exists"}
+        for row in conflicts
+    ]
+    await db.commit()
+    # the IDs of the batch are not returned, an ID of the batch may be cached as missing
+    missing_individuals.clear()
+
+    return {"inserted": staged - len(conflicts), "conflicts": conflicts}
+
+
+async def service_update_individual(db: AsyncSession, individual_id: int, individual: IndividualUpdate):
     """
     Update an individual
 
@@ -73,19 +266,25 @@ def service_update_individual(db: Session, individual_id: int, individual: Indiv
     :param individual: pydantic schema of individual update
 
     :return:
-    None or the updated data of individual
+    None if the individual is not found, False if the name is already used, or the updated data of individual
     """
 
     try:
-        db_query = db.query(Individual).filter(Individual.individual_id == individual_id)
-        db_query.update(individual.model_dump())
-        db.commit()
-        return db_query.first()
+        # UPDATE ... RETURNING, the updated row is read by the same statement
+        db_individual = await db.scalar(update(Individual)
+                                        .where(Individual.individual_id == individual_id)
+                                        .values(**individual.model_dump())
+                                        .returning(Individual)
+                                        .options(undefer(Individual.other_details)))
+        await db.commit()
+        invalidate_individual(individual_id)
+        return db_individual
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
+        return False
 
 
-def service_delete_individual(db: Session, individual_id: int):
+async def service_delete_individual(db: AsyncSession, individual_id: int):
     """
     Delete an individual
 
@@ -93,11 +292,17 @@ def service_delete_individual(db: Session, individual_id: int):
     :param individual_id: ID of an individual
 
     :return:
-    None
+    bool: False if the individual is not found
     """
 
-    # TODO: handle failure of the deletion
-    db_query = db.query(Individual).filter(Individual.individual_id == individual_id)
-    db_query.delete()
-    db.commit()
+    if missing_individuals.get(individual_id):
+        return False
 
+    # DELETE ... RETURNING, the deletion is also the existence check
+    deleted = await db.scalar(delete(Individual)
+                              .where(Individual.individual_id == individual_id)
+                              .returning(Individual.individual_id))
+    await db.commit()
+    invalidate_individual(individual_id)
+    missing_individuals.set(individual_id, True)
+    return deleted is not None
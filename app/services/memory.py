@@ -1,63 +1,165 @@
+from typing import AsyncIterable, List, Optional, Tuple
+
+from pydantic import TypeAdapter
+from sqlalchemy import (select, update, delete, func, case, exists, column, bindparam, cast, insert, tuple_,
+                        Integer, Text)
+from sqlalchemy.dialects.postgresql import ARRAY, REGCONFIG
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+
+from app.core.config import config
+from app.db.models.memory import Memory, MEMORY_TEXT_SEARCH_CONFIG
+from app.db.models.family_environment import FamilyEnvironment
+from app.db.models.family_member import FamilyEnvironmentMember
+from app.db.models.individual import Individual
+from app.db.models.patient import Patient
+from app.schemas.memory_schema import MemoryCreate, MemoryUpdate, MemoryFullResponse
+from app.utils.cache import LRUCache
+from app.utils.rows import Detail, detail_column
+
+# number of memories inserted by one statement of an import
+MEMORY_IMPORT_CHUNK_SIZE = 5000
+
+# memories with their individual and family, validated at once
+MEMORY_FULL = TypeAdapter(List[MemoryFullResponse])
 
-from app.db.models.memory import Memory
-from app.schemas.memory_schema import MemoryCreate, MemoryUpdate
+# negative cache, IDs of the updates and deletes that found no memory, removed by the creates
+missing_memories = LRUCache(config.missing_id_cache_size, config.missing_id_cache_ttl)
 
 
-def service_get_all_memory_family(db: Session, family_id: int):
+def _memory_columns(detail: Detail):
+    return Memory.memory_id, Memory.individual_id, Memory.family_environment_id, detail_column(Memory.text, detail)
+
+
+async def service_get_all_memory_family(db: AsyncSession, family_id: int, limit: Optional[int] = None,
+                                        after_id: Optional[int] = None, detail: Detail = "full"):
     """
-    get all memory of a family
+    get all memory of a family ordered by memory ID
 
     :param db: database connection
     :param family_id: ID of a family
+    :param limit: max number of memories, None for all
+    :param after_id: return only memories with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of the text, full for the whole text
 
     :return:
-    None or List of object
+    List of memories
     """
-    return db.query(Memory).filter(Memory.family_environment_id == family_id).all()
+    stmt = (select(*_memory_columns(detail)).where(Memory.family_environment_id == family_id)
+            .order_by(Memory.memory_id).limit(limit))
+    if after_id is not None:
+        stmt = stmt.where(Memory.memory_id > after_id)
+
+    res = await db.execute(stmt)
+    return res.all()
 
 
-def service_get_memory_family_individual(db: Session, family_id: int, individual_id: int):
+async def service_search_memories(db: AsyncSession, query: str, family_id: Optional[int] = None,
+                                  individual_id: Optional[int] = None, patient_id: Optional[int] = None,
+                                  limit: Optional[int] = None, after: Optional[Tuple[float, int]] = None,
+                                  detail: Detail = "full"):
     """
-    Get memory of a specific individual and a specific family with basic details
+    Full-text search of memories ordered by rank, the best match first
 
     :param db: database connection
-    :param family_id: ID of a family
-    :param individual_id: ID of an individual
+    :param query: web search syntax, e.g. words, "a phrase", -excluded, or
+    :param family_id: only memories of a family
+    :param individual_id: only memories of an individual
+    :param patient_id: only memories of the individuals that exist with a patient across all families
+    :param limit: max number of memories, None for all
+    :param after: return only memories after (rank, memory ID) of the previous page (keyset pagination)
+    :param detail: summary for a preview of the text, full for the whole text
 
     :return:
-    List of object
+    List of memories with their rank
     """
 
-    return db.query(Memory).filter(Memory.individual_id == individual_id,
-                                   Memory.family_environment_id == family_id).all()
+    ts_query = func.websearch_to_tsquery(cast(MEMORY_TEXT_SEARCH_CONFIG, REGCONFIG), query)
+    rank = func.ts_rank_cd(Memory.text_search, ts_query)
+
+    # the match is answered by the GIN index, only the matched memories are ranked
+    stmt = (select(*_memory_columns(detail), rank.label("rank"))
+            .where(Memory.text_search.bool_op("@@")(ts_query))
+            .order_by(rank.desc(), Memory.memory_id.desc())
+            .limit(limit))
 
+    if family_id is not None:
+        stmt = stmt.where(Memory.family_environment_id == family_id)
+    if individual_id is not None:
+        stmt = stmt.where(Memory.individual_id == individual_id)
+    if patient_id is not None:
+        stmt = stmt.where(Memory.individual_id.in_(
+            select(FamilyEnvironmentMember.individual_id)
+            .join(Patient, Patient.family_environment_id == FamilyEnvironmentMember.family_environment_id)
+            .where(Patient.patient_id == patient_id)
+        ))
+    if after is not None:
+        stmt = stmt.where(tuple_(rank, Memory.memory_id) < tuple_(*after))
 
-def service_get_memory_family_individual_full(db: Session, family_id: int, individual_id: int):
+    res = await db.execute(stmt)
+    return res.all()
+
+
+async def service_get_memory_family_individual(db: AsyncSession, family_id: int, individual_id: int,
+                                               limit: Optional[int] = None, after_id: Optional[int] = None,
+                                               detail: Detail = "full"):
     """
-    Get memory of a specific individual and a specific family with full details
+    Get memory of a specific individual and a specific family with basic details, ordered by memory ID
 
     :param db: database connection
     :param family_id: ID of a family
     :param individual_id: ID of an individual
+    :param limit: max number of memories, None for all
+    :param after_id: return only memories with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of the text, full for the whole text
 
     :return:
-    List of object
+    List of memories
     """
 
-    db_query = db.query(Memory).options(
-        joinedload(Memory.individual),
-        joinedload(Memory.family_environment)
-    ).filter(
-        Memory.individual_id == individual_id,
-        Memory.family_environment_id == family_id
-    ).all()
+    stmt = (select(*_memory_columns(detail)).where(Memory.individual_id == individual_id,
+                                                   Memory.family_environment_id == family_id)
+            .order_by(Memory.memory_id).limit(limit))
+    if after_id is not None:
+        stmt = stmt.where(Memory.memory_id > after_id)
 
-    return db_query
+    res = await db.execute(stmt)
+    return res.all()
 
 
-def service_create_memory(db: Session, memory: MemoryCreate):
+async def service_get_memory_family_individual_full(db: AsyncSession, individual, family,
+                                                    limit: Optional[int] = None, after_id: Optional[int] = None,
+                                                    detail: Detail = "full"):
+    """
+    Get memory of a specific individual and a specific family with full details, ordered by memory ID
+
+    the individual and the family are loaded once by the loader of the request, they are not joined to every memory
+
+    :param db: database connection
+    :param individual: row of IndividualResponse of the individual, see INDIVIDUAL_RESPONSE_BY_ID
+    :param family: row of FamilyEnvironmentResponse of the family, see FAMILY_RESPONSE_BY_ID
+    :param limit: max number of memories, None for all
+    :param after_id: return only memories with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of the text, full for the whole text
+
+    :return:
+    List of MemoryFullResponse
+    """
+
+    stmt = (select(*_memory_columns(detail))
+            .where(Memory.individual_id == individual.individual_id,
+                   Memory.family_environment_id == family.family_environment_id)
+            .order_by(Memory.memory_id).limit(limit))
+    if after_id is not None:
+        stmt = stmt.where(Memory.memory_id > after_id)
+
+    res = await db.execute(stmt)
+    nested = {"individual": individual._asdict(), "family_environment": family._asdict()}
+    return MEMORY_FULL.validate_python([{**row._asdict(), **nested} for row in res])
+
+
+async def service_create_memory(db: AsyncSession, memory: MemoryCreate):
     """
     Create a memory
 
@@ -67,31 +169,130 @@ def service_create_memory(db: Session, memory: MemoryCreate):
     None or object of a created memory
     """
     try:
-        memory_create = Memory(family_environment_id=memory.family_environment_id,
-                               individual_id=memory.individual_id,
-                               text=memory.text)
-        db.add(memory_create)
-        db.commit()
-        db.refresh(memory_create)
+        # INSERT ... RETURNING, the created row is read by the same statement
+        memory_create = await db.scalar(insert(Memory)
+                                        .values(family_environment_id=memory.family_environment_id,
+                                                individual_id=memory.individual_id,
+                                                text=memory.text)
+                                        .returning(Memory)
+                                        .options(undefer(Memory.text)))
+        await db.commit()
+        missing_memories.invalidate(memory_create.memory_id)
         return memory_create
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
 
 
-def service_get_memory_by_id(db: Session, memory_id: int):
+async def service_import_memories(db: AsyncSession,
+                                  memories: AsyncIterable[Tuple[int, Optional[MemoryCreate], Optional[str]]],
+                                  chunk_size: int = MEMORY_IMPORT_CHUNK_SIZE):
     """
-    get memory by id
+    Import a stream of memories
+
+    the memories are inserted by chunks, one multi-row INSERT ... SELECT and one commit per chunk,
+    only one chunk is held in memory
 
     :param db: database connection
-    :param memory_id: ID of a memory
+    :param memories: stream of (row number, pydantic schema of a memory or None, error of the row or None)
+    :param chunk_size: number of memories inserted by one statement
+
+    :return:
+    dict: number of inserted memories and the rejected rows with the reason
+    """
+
+    accepted = 0
+    rejected = []
+    chunk = []
+
+    async for row_number, memory, error in memories:
+        if error:
+            rejected.append({"row": row_number, "detail": error})
+            continue
+
+        chunk.append((row_number, memory))
+        if len(chunk) >= chunk_size:
+            accepted += await _insert_memory_chunk(db=db, chunk=chunk, rejected=rejected)
+            chunk = []
+
+    if chunk:
+        accepted += await _insert_memory_chunk(db=db, chunk=chunk, rejected=rejected)
+
+    # the IDs of the import are not returned, an ID of the import may be cached as missing
+    if accepted:
+        missing_memories.clear()
+
+    rejected.sort(key=lambda row: row["row"])
+    return {"accepted": accepted, "rejected": rejected}
+
+
+async def _insert_memory_chunk(db: AsyncSession, chunk: List[Tuple[int, MemoryCreate]], rejected: list) -> int:
+    """
+    Insert a chunk of memories, the memories with a foreign key that does not exist are skipped,
+    the whole chunk is rejected if a foreign key is deleted during the insert
+
+    :param db: database connection
+    :param chunk: list of (row number, pydantic schema of a memory)
+    :param rejected: list extended with the skipped rows
+
     :return:
-    None or object of memory
+    int: number of inserted memories
     """
 
-    return db.query(Memory).filter(Memory.memory_id == memory_id).first()
+    # the chunk is sent as four arrays, the number of bind parameters does not grow with the chunk
+    batch = func.unnest(
+        bindparam("row_numbers", [row_number for row_number, _ in chunk], type_=ARRAY(Integer)),
+        bindparam("family_environment_ids", [m.family_environment_id for _, m in chunk], type_=ARRAY(Integer)),
+        bindparam("individual_ids", [m.individual_id for _, m in chunk], type_=ARRAY(Integer)),
+        bindparam("texts", [m.text for _, m in chunk], type_=ARRAY(Text))
+    ).table_valued(
+        column("row_number", Integer),
+        column("family_environment_id", Integer),
+        column("individual_id", Integer),
+        column("text", Text)
+    ).render_derived(name="batch")
+
+    checked = select(
+        batch,
+        case(
+            (~exists().where(FamilyEnvironment.family_environment_id == batch.c.family_environment_id),
+             "family_environment_id is not a family"),
+            (~exists().where(Individual.individual_id == batch.c.individual_id),
+             "individual_id is not an individual"),
+            else_=None
+        ).label("detail")
+    ).cte("checked")
+
+    inserted = (
+        insert(Memory)
+        .from_select(["family_environment_id", "individual_id", "text"],
+                     select(checked.c.family_environment_id, checked.c.individual_id, checked.c.text)
+                     .where(checked.c.detail.is_(None))
+                     .order_by(checked.c.row_number))
+        .cte("inserted")
+    )
+
+    try:
+        # the insert is not read by the query, add_cte makes sure it is rendered
+        res = await db.execute(
+            select(checked.c.row_number, checked.c.detail)
+            .where(checked.c.detail.is_not(None))
+            .add_cte(inserted)
+        )
+        skipped = [{"row": row.row_number, "detail": row.detail} for row in res]
+        await db.commit()
+    except IntegrityError:
+        # a family or an individual is deleted between the checks and the insert, the chunk is rolled back
+        await db.rollback()
+        rejected.extend({"row": row_number, "detail": "a family or an individual of the chunk was deleted "
+                                                      "during the import, the chunk is not inserted"}
+                        for row_number, _ in chunk)
+        return 0
+
+    rejected.extend(skipped)
+    return len(chunk) - len(skipped)
 
 
-def service_update_memory_by_id(db: Session, memory_id: int, memory: MemoryUpdate):
+async def service_update_memory_by_id(db: AsyncSession, memory_id: int, memory: MemoryUpdate):
     """
     Update memory by ID
 
@@ -99,27 +300,42 @@ def service_update_memory_by_id(db: Session, memory_id: int, memory: MemoryUpdat
     :param memory_id: ID of a memory
     :param memory: pydantic schema of a memory
     :return:
-    None or object of updated memory
+    None if the memory is not found, or object of updated memory
     """
 
+    if missing_memories.get(memory_id):
+        return None
+
     try:
-        db_query = db.query(Memory).filter(Memory.memory_id == memory_id)
-        db_query.update(memory.model_dump())
-        db.commit()
-        return db_query.first()
+        # UPDATE ... RETURNING, the updated row is read by the same statement
+        memory_update = await db.scalar(update(Memory)
+                                        .where(Memory.memory_id == memory_id)
+                                        .values(**memory.model_dump())
+                                        .returning(Memory)
+                                        .options(undefer(Memory.text)))
+        await db.commit()
+        if memory_update is None:
+            missing_memories.set(memory_id, True)
+        return memory_update
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
 
 
-def service_delete_memory_by_id(db: Session, memory_id: int):
+async def service_delete_memory_by_id(db: AsyncSession, memory_id: int):
     """
     delete a memory
 
     :param db: database connection
     :param memory_id: ID of a memory
     :return:
-    None
+    bool: False if the memory is not found
     """
-    db_query = db.query(Memory).filter(Memory.memory_id == memory_id)
-    db_query.delete()
-    db.commit()
\ No newline at end of file
+
+    if missing_memories.get(memory_id):
+        return False
+
+    # DELETE ... RETURNING, the deletion is also the existence check
+    deleted = await db.scalar(delete(Memory).where(Memory.memory_id == memory_id).returning(Memory.memory_id))
+    await db.commit()
+    missing_memories.set(memory_id, True)
+    return deleted is not None
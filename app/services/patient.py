@@ -1,6 +1,9 @@
-from sqlalchemy import select
+from typing import Optional
+
+from sqlalchemy import select, update, delete, exists, false, func, literal, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.schemas.patient_schema import (PatientCreate,
                                         PatientBasic,
@@ -8,151 +11,249 @@ from app.schemas.patient_schema import (PatientCreate,
 
 from app.db.models.patient import Patient
 from app.db.models.family_environment import FamilyEnvironment
-from app.db.models.family_member import FamilyEnvironmentMember
 from app.db.models.individual import Individual
-from app.db.models.memory import Memory
+from app.db.models.patient_memory_feed import PatientMemoryFeed
+from app.core.config import config
+from app.utils.cache import LRUCache
+from app.utils.ndjson import STREAM_BATCH_SIZE
+from app.utils.rows import Detail, detail_column
+from app.utils.statements import lock_rows, select_write_with_checks
+
+# negative cache, IDs of the lookups and deletes that found no patient, removed by the creates
+missing_patients = LRUCache(config.missing_id_cache_size, config.missing_id_cache_ttl)
 
 
-def service_get_all_patient(db: Session):
+async def service_get_all_patient(db: AsyncSession, limit: Optional[int] = None, after_id: Optional[int] = None):
     """
-    Get all patient
+    Get all patient ordered by ID
 
     :param db: database connection
+    :param limit: max number of patients, None for all
+    :param after_id: return only patients with ID greater than after_id (keyset pagination)
     :return:
     None or List of all patient
     """
 
-    return db.query(Patient).all()
+    stmt = select(Patient).order_by(Patient.patient_id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Patient.patient_id > after_id)
 
+    res = await db.execute(stmt)
+    return res.scalars().all()
 
-def service_get_family_patient_by_id(db: Session, family_id: int):
-    """
-    Get family patient by ID
 
-    :param db: database connection
-    :param family_id: ID of a family
+def _memories_of_patient(patient_id: int, detail: Detail):
+    """
+    Select the memories of all individuals that exist with a patient across all families, ordered by memory ID
 
-    :return:
-    None or object of patient
+    the memories are read from the feed of the patient, a range of its primary key with one row per memory
     """
 
-    return db.query(Patient).filter(Patient.family_environment_id == family_id).first()
+    feed = PatientMemoryFeed
+    return (
+        select(feed.memory_id, feed.individual_id, feed.family_environment_id, detail_column(feed.text, detail))
+        .where(feed.patient_id == patient_id)
+        .order_by(feed.memory_id)
+    )
 
 
-def service_get_patient_by_id(db: Session, patient_id: int):
+async def service_get_all_memories_of_all_individual_by_patient(db: AsyncSession, patient_id: int,
+                                                                limit: Optional[int] = None,
+                                                                after_id: Optional[int] = None,
+                                                                detail: Detail = "full"):
     """
-    Get patient by id
+    Get all the memories of all individuals that exist with a patient across all families, ordered by memory ID
 
     :param db: database connection
     :param patient_id: ID of a patient
+    :param limit: max number of memories, None for all
+    :param after_id: return only memories with ID greater than after_id (keyset pagination)
+    :param detail: summary for a preview of the texts, full for the whole texts
 
     :return:
-    None or object of patient
+    None or List of memories
     """
 
-    return db.query(Patient).filter(Patient.patient_id == patient_id).first()
+    stmt = _memories_of_patient(patient_id, detail).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(PatientMemoryFeed.memory_id > after_id)
+
+    memories = (await db.execute(stmt)).all()
+
+    return memories
 
 
-def service_search_for_patients(db: Session, patient_ids: list):
+async def service_stream_memories_of_all_individual_by_patient(db: AsyncSession, patient_id: int,
+                                                                batch_size: int = STREAM_BATCH_SIZE,
+                                                                detail: Detail = "full"):
     """
-    search for a list of patient IDs
+    Stream all the memories of all individuals that exist with a patient through a server side cursor
 
     :param db: database connection
-    :param patient_ids: patient IDs
+    :param patient_id: ID of a patient
+    :param batch_size: number of memories fetched from the cursor at once
+    :param detail: summary for a preview of the texts, full for the whole texts
 
     :return:
-    None or List of patients
+    AsyncIterator of lists of at most batch_size memories
     """
-    return db.query(Patient).filter(Patient.patient_id.in_(patient_ids)).all()
+
+    res = await db.stream(_memories_of_patient(patient_id, detail).execution_options(yield_per=batch_size))
+    async for partition in res.partitions():
+        yield partition
 
 
-def service_get_all_memories_of_all_individual_by_patient(db: Session, patient_id: int):
+def _count_families_for_individual(individual_id: int):
+    """
+    Scalar subquery of the number of family memberships of an individual, 0 if the individual does not exist
+    the count is maintained on the individual, it reads one row
     """
-    Get all the memories of all individuals that exist with a patient across all families
 
-    :param db: database connection
-    :param patient_id: ID of a patient
+    return func.coalesce(select(Individual.membership_count)
+                         .where(Individual.individual_id == individual_id)
+                         .scalar_subquery(), 0)
 
-    :return:
-    None or List of memories
+
+def _patient_write_result(written, patient: PatientBasic):
     """
+    Select the written patient with the checks of a patient write, evaluated before the write
 
-    stmt = (
-        select(Memory)
-        .join(FamilyEnvironmentMember, Memory.individual_id == FamilyEnvironmentMember.individual_id)
-        .join(Patient, Patient.family_environment_id == FamilyEnvironmentMember.family_environment_id)
-        .filter(Patient.patient_id == patient_id)
-    )
+    :param written: CTE of the INSERT or UPDATE returning the patient
+    :param patient: pydantic schema of basic patient
 
-    memories = db.execute(stmt).scalars().all()
+    :return:
+    select of patient_id, family_environment_id (None if nothing is written),
+    patient_exists, family_full and memberships
+    """
 
-    return memories
+    return select_write_with_checks(
+        written,
+        exists().where(Patient.patient_id == patient.patient_id).label("patient_exists"),
+        exists().where(Patient.family_environment_id == patient.family_environment_id,
+                       Patient.patient_id != patient.patient_id).label("family_full"),
+        _count_families_for_individual(patient.patient_id).label("memberships")
+    )
 
 
-def service_get_patient(db: Session, patient: PatientBasic):
+async def _lost_write_result(db: AsyncSession, patient: PatientBasic):
     """
-    Get patient
+    Checks of a patient write that lost a race to a concurrent write of the same patient or family
+
+    the checks of the write are evaluated on its snapshot, before the concurrent write,
+    they are evaluated again once it is committed: patient_exists or family_full is set
 
     :param db: database connection
     :param patient: pydantic schema of basic patient
-
     :return:
-    None or object of a patient
+    row of the checks, nothing is written
     """
 
-    return db.query(Patient).filter(Patient.patient_id == patient.patient_id).first()
+    lost = select(Patient.patient_id, Patient.family_environment_id).where(false()).cte("lost")
+    return (await db.execute(_patient_write_result(lost, patient))).one()
+
+
+def _is_unique_violation(error: IntegrityError) -> bool:
+    # SQLSTATE of unique_violation, the other integrity errors are foreign keys
+    return getattr(error.orig, "sqlstate", None) == "23505"
 
 
-def service_create_patient(db: Session, patient: PatientCreate):
+async def service_create_patient(db: AsyncSession, patient: PatientCreate):
     """
     Create a patient
 
+    one conditional INSERT, the patient is created only if the individual has exactly one family membership.
+    The row of the individual is locked first, a concurrent membership of the individual is created before
+    or after the patient, never in between. The primary key and the unique family_environment_id reject
+    a second family for a patient and a second patient in a family
+
     :param db: database connection
     :param patient: pydantic schema of a patient
     :return:
-    None or object of a patient
+    None if a foreign key is not valid, or row of the created patient (patient_id is None if it is not created)
+    with the checks: patient_exists, family_full and memberships, evaluated again if a concurrent insert won
     """
 
+    inserted = (
+        pg_insert(Patient)
+        .from_select(["patient_id", "family_environment_id"],
+                     select(literal(patient.patient_id, Integer), literal(patient.family_environment_id, Integer))
+                     .where(_count_families_for_individual(patient.patient_id) == 1))
+        .on_conflict_do_nothing()
+        .returning(Patient.patient_id, Patient.family_environment_id)
+        .cte("inserted")
+    )
+
+    # the membership writes of the individual lock its row too, the checks see them once they are committed
+    await db.execute(lock_rows(Individual.individual_id, [patient.patient_id]))
+
     try:
-        db_patient = Patient(patient_id=patient.patient_id,
-                             family_environment_id=patient.family_environment_id)
-        db.add(db_patient)
-        db.commit()
-        db.refresh(db_patient)
-        return db_patient
+        res = (await db.execute(_patient_write_result(inserted, patient))).one()
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
+        return None
+
+    missing_patients.invalidate(patient.patient_id)
+    if res.patient_id is None and res.memberships == 1 and not (res.patient_exists or res.family_full):
+        # the checks passed, the patient or the family was inserted concurrently and ON CONFLICT skipped the row
+        return await _lost_write_result(db, patient)
+    return res
 
 
-def service_update_patient(db: Session, patient: PatientUpdate):
+async def service_update_patient(db: AsyncSession, patient: PatientUpdate):
     """
     update a patient
 
+    one conditional UPDATE, the family is changed only if no other patient is in the family
+    and the individual has exactly one family membership, the row of the individual is locked first
+
     :param db: database connection
     :param patient: pydantic schema of updating patient
     :return:
-    None or object of a patient
+    None if the update is not valid, or row of the updated patient (patient_id is None if it is not updated)
+    with the checks: patient_exists, family_full and memberships, evaluated again if a concurrent update won
     """
 
+    updated = (
+        update(Patient)
+        .where(Patient.patient_id == patient.patient_id,
+               _count_families_for_individual(patient.patient_id) == 1,
+               ~exists().where(Patient.family_environment_id == patient.family_environment_id,
+                               Patient.patient_id != patient.patient_id))
+        .values(family_environment_id=patient.family_environment_id)
+        .returning(Patient.patient_id, Patient.family_environment_id)
+        .cte("updated")
+    )
+
+    # the membership writes of the individual lock its row too, the checks see them once they are committed
+    await db.execute(lock_rows(Individual.individual_id, [patient.patient_id]))
+
     try:
-        db_query = db.query(Patient).filter(Patient.patient_id == patient.patient_id)
-        db_query.update(patient.model_dump())
-        db.commit()
-        return db_query.first()
-    except IntegrityError:
-        db.rollback()
+        res = (await db.execute(_patient_write_result(updated, patient))).one()
+        await db.commit()
+        return res
+    except IntegrityError as error:
+        await db.rollback()
+        if _is_unique_violation(error):  # a patient was moved to the family concurrently
+            return await _lost_write_result(db, patient)
+        return None
 
 
-def service_delete_patient(db: Session, patient_id: int):
+async def service_delete_patient(db: AsyncSession, patient_id: int):
     """
     Delete patient
 
     :param db: database connection
     :param patient_id: ID of a patient
     :return:
-    None
+    bool: False if the patient is not found
     """
-    db_query = db.query(Patient).filter(Patient.patient_id == patient_id)
-    db_query.delete()
-    db.commit()
-    return True
+
+    if missing_patients.get(patient_id):
+        return False
+
+    # DELETE ... RETURNING, the deletion is also the existence check
+    deleted = await db.scalar(delete(Patient).where(Patient.patient_id == patient_id).returning(Patient.patient_id))
+    await db.commit()
+    missing_patients.set(patient_id, True)
+    return deleted is not None
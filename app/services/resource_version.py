@@ -0,0 +1,21 @@
+from sqlalchemy import select, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.resource_version import ResourceVersion
+
+
+async def service_get_version(db: AsyncSession, resource: str, scope_id: int = 0) -> int:
+    """
+    Get the version of a resource, one primary key lookup
+
+    :param db: database connection
+    :param resource: name of the resource, see app.db.models.resource_version
+    :param scope_id: ID of the family of the resource, 0 for a whole table
+    :return:
+    int: version of the resource, 0 if it was never written
+    """
+
+    # lambda statement, the statement is built and compiled once, the resource and scope are bound parameters
+    version = await db.scalar(lambda_stmt(lambda: select(ResourceVersion.version).where(
+        ResourceVersion.resource == resource, ResourceVersion.scope_id == scope_id)))
+    return version or 0
@@ -0,0 +1,230 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from redis.exceptions import ResponseError
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models.family_environment import FamilyEnvironment
+from app.services import family_membership
+from app.services.memory import missing_memories, service_delete_memory_by_id
+from app.utils.cache import CacheBackend, LRUCache, MemoryCacheBackend, RedisCacheBackend
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_eviction():
+    """
+    the least recently used entry is evicted when the cache is full
+    :return:
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set(1, "Ali")
+    cache.set(2, "hassan")
+    assert cache.get(1) == "Ali"  # 2 is now the least recently used
+
+    cache.set(3, "John")
+    assert cache.get(2) is None
+    assert cache.get(1) == "Ali" and cache.get(3) == "John"
+
+    assert cache.status() == {"size": 2, "maxsize": 2, "ttl": 60, "hits": 3, "misses": 1, "hit_ratio": 0.75,
+                              "evictions": 1, "expirations": 0, "invalidations": 0, "errors": 0}
+
+
+def test_ttl_and_invalidation():
+    """
+    an entry expires ttl seconds after it is stored, an invalidated entry is removed at once
+    :return:
+    """
+    clock = _Clock()
+    cache = LRUCache(maxsize=10, ttl=5, clock=clock)
+    cache.set(1, "Ali")
+    cache.set(2, "hassan")
+
+    clock.now = 4.9
+    assert cache.get(1) == "Ali"
+    cache.invalidate(2)
+    assert cache.get(2) is None
+
+    clock.now = 5
+    assert cache.get(1) is None
+
+    stats = cache.status()
+    assert (stats["size"], stats["expirations"], stats["invalidations"]) == (0, 1, 1)
+
+    disabled = LRUCache(maxsize=0, ttl=5)
+    disabled.set(1, "Ali")
+    assert disabled.get(1) is None
+
+
+def test_memory_backend():
+    """
+    the memory backend is a LRUCache of the worker
+    :return:
+    """
+    clock = _Clock()
+    backend = MemoryCacheBackend(maxsize=10, ttl=5, clock=clock)
+
+    async def lookups():
+        await backend.set("roster:1:3", b'{"name": "Smith"}')
+        hit = await backend.get("roster:1:3")
+        clock.now = 5
+        return hit, await backend.get("roster:1:3"), await backend.get("roster:1:4")
+
+    assert asyncio.run(lookups()) == (b'{"name": "Smith"}', None, None)
+    assert backend.status()["hits"] == 1 and backend.status()["misses"] == 2
+
+    class NoStatus(CacheBackend):  # a backend implements get, set and status
+        async def get(self, key):
+            return None
+
+        async def set(self, key, value):
+            pass
+
+    with pytest.raises(TypeError):
+        NoStatus()
+
+
+async def _read_command(reader: asyncio.StreamReader) -> list:
+    # a command is an array of bulk strings
+    count = int((await reader.readuntil(b"\r\n"))[1:-2])
+    args = []
+    for _ in range(count):
+        length = int((await reader.readuntil(b"\r\n"))[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+class _RedisStandIn:
+    """
+    Server of the Redis protocol with the commands of RedisCacheBackend, the entries are kept in a dict
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.commands = []
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                command, *args = await _read_command(reader)
+                command = command.upper()
+                if command == b"CLIENT":  # the name of the client library, sent on every connection
+                    writer.write(b"+OK\r\n")
+                    await writer.drain()
+                    continue
+
+                self.commands.append(command)
+                if command == b"GET":
+                    value = self.entries.get(args[0])
+                    writer.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+                elif command == b"SET" and [arg.upper() for arg in args[2:]] == [b"PX", b"300000"]:
+                    self.entries[args[0]] = args[1]
+                    writer.write(b"+OK\r\n")
+                elif command in (b"AUTH", b"SELECT"):
+                    writer.write(b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+def test_redis_backend():
+    """
+    the redis backend sends the commands on a pool of connections, a server that is not available is a miss
+    :return:
+    """
+    stand_in = _RedisStandIn()
+    clock = _Clock()
+
+    async def lookups():
+        server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = RedisCacheBackend(f"redis://:secret@127.0.0.1:{port}/2", ttl=300, clock=clock)
+
+        miss = await backend.get("roster:1:3")
+        await backend.set("roster:1:3", b'{"name": "Smith"}')
+        hit = await backend.get("roster:1:3")
+        # the concurrent lookups are not serialised on one connection
+        concurrent = await asyncio.gather(*(backend.get("roster:1:3") for _ in range(3)))
+
+        # an error reply is a bug, not a miss: it is raised
+        with pytest.raises(ResponseError):
+            await RedisCacheBackend(f"redis://:secret@127.0.0.1:{port}/2", ttl=1).set("roster:1:3", b"{}")
+
+        # the server is gone, the next command fails to connect
+        await backend.client.connection_pool.disconnect()
+        server.close()
+        await server.wait_closed()
+        down = await backend.get("roster:1:3")
+        skipped = await backend.get("roster:1:3")  # not sent until the retry
+        return backend, miss, hit, concurrent, down, skipped
+
+    backend, miss, hit, concurrent, down, skipped = asyncio.run(lookups())
+    assert (miss, hit, down, skipped) == (None, b'{"name": "Smith"}', None, None)
+    assert concurrent == [b'{"name": "Smith"}'] * 3
+    assert stand_in.commands[:4] == [b"AUTH", b"SELECT", b"GET", b"SET"]
+    assert stand_in.connections > 1
+
+    stats = backend.status()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["errors"]) == (None, 4, 3, 1)
+
+
+def test_missing_id_is_not_queried_again():
+    """
+    a deleted or missing ID is recorded by the negative cache, a retried delete does not query the database
+    :return:
+    """
+    missing_memories.clear()
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.scalar.return_value = None
+
+    first = asyncio.run(service_delete_memory_by_id(mock_db, memory_id=424242))
+    second = asyncio.run(service_delete_memory_by_id(mock_db, memory_id=424242))
+
+    assert (first, second) == (False, False)
+    mock_db.scalar.assert_awaited_once()
+    missing_memories.clear()
+
+
+def test_roster_of_a_renamed_family(monkeypatch):
+    """
+    a stale row of a renamed family (its name is cached in a worker) never reads the roster of its ID,
+    the members are loaded by ID and the roster is served only under the name of the family
+    :return:
+    """
+    monkeypatch.setattr(family_membership, "roster_cache", MemoryCacheBackend(maxsize=10, ttl=60))
+    mock_db = AsyncMock(spec=AsyncSession)
+
+    def family_row(name: str):
+        result = MagicMock()
+        result.unique.return_value.scalars.return_value.first.return_value = FamilyEnvironment(
+            family_environment_id=1, name=name, members=[])
+        mock_db.execute.return_value = result
+
+    async def roster(name: str, version: int):
+        family = SimpleNamespace(family_environment_id=1, name=name)
+        return await family_membership.service_get_family_roster(mock_db, family=family, version=version)
+
+    family_row("Smith")
+    assert asyncio.run(roster("Smith", 3)) == b'{"name":"Smith","members":[]}'
+
+    # the family 1 is renamed to Jones (version 4), a worker still resolves Smith to the family 1
+    family_row("Jones")
+    assert asyncio.run(roster("Jones", 4)) == b'{"name":"Jones","members":[]}'
+    assert asyncio.run(roster("Smith", 4)) is None
+
+    stmt = mock_db.execute.await_args.args[0]
+    assert "family_environments.family_environment_id = 1" in str(stmt.compile(compile_kwargs={"literal_binds": True}))
+    assert mock_db.execute.await_count == 3
@@ -0,0 +1,19 @@
+from app.utils.etag import etag_matches, make_etag
+
+
+def test_etag_matches():
+    """
+    If-None-Match is a list of ETags, weak ETags and * match too
+    :return:
+    """
+    etag = make_etag("memories", 3, 7)
+    assert etag == '"memories-3-7"'
+
+    assert etag_matches('"memories-3-7"', etag)
+    assert etag_matches('W/"memories-3-7"', etag)
+    assert etag_matches('"memories-3-6", "memories-3-7"', etag)
+    assert etag_matches("*", etag)
+
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"memories-3-6"', etag)
+    assert not etag_matches('"memories-4-7"', etag)
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import individual, family_environment, patient, family_member, memory, patient_memory_feed
+from app.schemas.family_member_schema import FamilyMemberCreate
+from app.schemas.patient_schema import PatientCreate
+from app.services.family_membership import service_bulk_create_family_membership, service_create_family_membership
+from app.services.patient import service_create_patient
+
+
+def test_bulk_create_checks_again_after_integrity_error():
+    """
+    a batch that fails on a family or an individual deleted after its checks is checked again on a new snapshot,
+    every membership is rejected if it fails again
+    :return:
+    """
+    memberships = [FamilyMemberCreate(family_environment_id=1, individual_id=n, role="son") for n in (1, 2)]
+    error = IntegrityError("INSERT", {}, Exception("foreign key"))
+
+    rows = [SimpleNamespace(row_number=1, detail=None, family_environment_id=1, individual_id=1, role="son",
+                            family_environment_member_id=7),
+            SimpleNamespace(row_number=2, detail="Bad values", family_environment_id=1, individual_id=2, role="son",
+                            family_environment_member_id=None)]
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.execute.side_effect = [None, error, None, SimpleNamespace(all=lambda: rows)]
+    res = asyncio.run(service_bulk_create_family_membership(mock_db, memberships))
+    assert [row["family_environment_member_id"] for row in res["created"]] == [7]
+    assert [(row["row"], row["detail"]) for row in res["rejected"]] == [(2, "Bad values")]
+
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.execute.side_effect = [None, error, None, error]
+    res = asyncio.run(service_bulk_create_family_membership(mock_db, memberships))
+    assert res["created"] == []
+    assert [(row["row"], row["detail"]) for row in res["rejected"]] == [(1, "Bad values"), (2, "Bad values")]
+    assert mock_db.rollback.await_count == 2
+
+
+
+def test_writes_lock_the_individual_first():
+    """
+    the patient and membership writes lock the row of the individual before their checks,
+    a patient and a second membership of the individual are never created concurrently
+    :return:
+    """
+    creates = (lambda db: service_create_patient(db, PatientCreate(patient_id=3, family_environment_id=1)),
+               lambda db: service_create_family_membership(db, FamilyMemberCreate(family_environment_id=1,
+                                                                                   individual_id=3)))
+    for create in creates:
+        mock_db = AsyncMock(spec=AsyncSession)
+        mock_db.execute.return_value = MagicMock()
+        asyncio.run(create(mock_db))
+
+        lock = mock_db.execute.await_args_list[0].args[0]
+        sql = str(lock.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+        assert "FROM individuals" in sql and "IN (3)" in sql and sql.endswith("FOR UPDATE")
@@ -0,0 +1,51 @@
+import asyncio
+from collections import namedtuple
+from unittest.mock import AsyncMock
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import individual, family_environment, patient, family_member, memory, patient_memory_feed
+from app.db.models.family_environment import FamilyEnvironment
+from app.db.models.individual import Individual
+from app.utils.cache import LRUCache
+from app.utils.loader import EntityLoader, EntityRows
+
+IndividualRow = namedtuple("IndividualRow", ["individual_id", "name"])
+FamilyRow = namedtuple("FamilyRow", ["family_environment_id", "name"])
+
+
+def test_loader_batches_and_deduplicates():
+    """
+    the lookups awaited together are fetched by one IN query per entity, an ID is fetched once per request
+    :return:
+    """
+    missing = LRUCache(maxsize=10, ttl=60)
+    individuals = EntityRows(Individual.individual_id, (Individual.individual_id, Individual.name), missing=missing)
+    families = EntityRows(FamilyEnvironment.family_environment_id,
+                          (FamilyEnvironment.family_environment_id, FamilyEnvironment.name))
+
+    tables = {
+        "individuals": [IndividualRow(1, "Ali"), IndividualRow(2, "hassan")],
+        "family_environments": [FamilyRow(5, "Smith")],
+    }
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.execute.side_effect = lambda stmt: tables[stmt.get_final_froms()[0].name]
+
+    async def request():
+        loader = EntityLoader(mock_db)
+        rows, family = await asyncio.gather(loader.load_many(individuals, [1, 2, 1, 3]), loader.load(families, 5))
+        again = await loader.load_many(individuals, [2, 3])  # loaded by this request, not queried
+        return rows, family, again
+
+    rows, family, again = asyncio.run(request())
+    assert rows == [IndividualRow(1, "Ali"), IndividualRow(2, "hassan"), IndividualRow(1, "Ali"), None]
+    assert family == FamilyRow(5, "Smith")
+    assert again == [IndividualRow(2, "hassan"), None]
+
+    assert mock_db.execute.await_count == 2
+    statements = [str(call.args[0].compile(compile_kwargs={"literal_binds": True}))
+                  for call in mock_db.execute.await_args_list]
+    assert any("individuals.individual_id IN (1, 2, 3)" in sql for sql in statements)
+
+    # an ID not found is in the negative cache, the next requests do not query it
+    assert missing.get(3) is True
@@ -1,7 +1,8 @@
-from unittest.mock import MagicMock
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
 
 from fastapi.testclient import TestClient
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.main import app
 from app.db.models.individual import Individual
@@ -12,7 +13,7 @@ client = TestClient(app)
 
 def test_service_get_all_individuals(mocker):
     # Arrange: Create a mock database session
-    mock_db = MagicMock(spec=Session)
+    mock_db = AsyncMock(spec=AsyncSession)
 
     # Create mock individuals to return from the mock db
     mock_individuals = [
@@ -20,21 +21,24 @@ def test_service_get_all_individuals(mocker):
         Individual(name="John Obama")
     ]
 
-    # Mock the query method and the .all() call on it to return the mock individuals
-    mock_query = mock_db.query.return_value  # Mock the return value of the query() method
-    mock_query.all.return_value = mock_individuals
+    # Mock the execute method and the .scalars().all() call on its result to return the mock individuals
+    mock_result = MagicMock()  # Mock the return value of the execute() method
+    mock_result.scalars.return_value.all.return_value = mock_individuals
+    mock_db.execute.return_value = mock_result
 
     # Act: Call the service function with the mocked db session
-    result = service_get_all_individuals(mock_db)
+    result = asyncio.run(service_get_all_individuals(mock_db))
 
     # Assert: Verify that the returned data matches the mock individuals
     assert result == mock_individuals
 
-    # Verify that the query method was called once with the Individual model
-    mock_db.query.assert_called_once_with(Individual)
+    # Verify that the execute method was awaited once with a select of the Individual model
+    mock_db.execute.assert_awaited_once()
+    stmt = mock_db.execute.await_args.args[0]
+    assert stmt.column_descriptions[0]["entity"] is Individual
 
-    # Verify that the all() method was called once on the query object
-    mock_query.all.assert_called_once()
+    # Verify that the all() method was called once on the scalars of the result
+    mock_result.scalars.return_value.all.assert_called_once()
 
 def test_get_all_individual():
     """
@@ -43,29 +47,36 @@ def test_get_all_individual():
     """
     response = client.get("http://127.0.0.1:8000/v1/individual/")
     assert response.status_code == 200  # Assert status code is 200 (OK)
-    assert response.json() == [
-        {
-            "name": "Ali",
-            "individual_id": 1,
-            "date_of_birth": "2024-11-23T00:00:00",
-            "other_details": "string"
-        },
-        {
-            "name": "hassan",
-            "individual_id": 2,
-            "date_of_birth": "2024-11-23T00:00:00",
-            "other_details": "string"
-        },
-        {
-            "name": "John",
-            "individual_id": 6,
-            "date_of_birth": "2024-11-23T00:00:00",
-            "other_details": None
-        },
-        {
-            "name": "travolta",
-            "individual_id": 7,
-            "date_of_birth": "2024-11-23T00:00:00",
-            "other_details": None
-        }
-    ]  # Assert response data matches expected output
+    assert response.json() == {
+        "items": [
+            {
+                "name": "Ali",
+                "individual_id": 1,
+                "date_of_birth": "2024-11-23T00:00:00",
+                "other_details": "string",
+                "membership_count": 0
+            },
+            {
+                "name": "hassan",
+                "individual_id": 2,
+                "date_of_birth": "2024-11-23T00:00:00",
+                "other_details": "string",
+                "membership_count": 0
+            },
+            {
+                "name": "John",
+                "individual_id": 6,
+                "date_of_birth": "2024-11-23T00:00:00",
+                "other_details": None,
+                "membership_count": 0
+            },
+            {
+                "name": "travolta",
+                "individual_id": 7,
+                "date_of_birth": "2024-11-23T00:00:00",
+                "other_details": None,
+                "membership_count": 0
+            }
+        ],
+        "next_cursor": None
+    }  # Assert response data matches expected output
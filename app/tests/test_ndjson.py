@@ -0,0 +1,132 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.schemas.memory_schema import MemoryCreate, MemoryUpdate
+from app.services.memory import service_import_memories
+from app.utils.ndjson import iter_ndjson, iter_ndjson_lines, iter_ndjson_models, iter_json_batches
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(stream):
+    return [row async for row in iter_ndjson(stream)]
+
+
+def test_iter_ndjson_lines_split_across_chunks():
+    """
+    a line split across chunks is decoded once it is complete, blank lines are skipped
+    :return:
+    """
+    rows = asyncio.run(_collect(_chunks(b'{"name": "A', b'li"}\n\n{"name"', b': "John"}')))
+    assert rows == [(1, {"name": "Ali"}), (3, {"name": "John"})]
+
+
+def test_iter_ndjson_lines_max_line_length():
+    """
+    a line longer than the max is rejected with 413, even if it is received in small chunks
+    :return:
+    """
+    async def lines(*chunks: bytes):
+        return [line async for line in iter_ndjson_lines(_chunks(*chunks), max_line_length=8)]
+
+    assert asyncio.run(lines(b"1234", b"5678\n12", b"\n\n", b"abc")) == [(1, b"12345678"), (2, b"12"), (4, b"abc")]
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(lines(b"12345", b"6789", b"\n"))
+    assert error.value.status_code == 413 and "line 1" in error.value.detail
+
+    with pytest.raises(HTTPException):
+        asyncio.run(lines(b"ok\n123456789"))  # the last line, without a newline
+
+
+def test_iter_ndjson_invalid_line():
+    """
+    an invalid line is reported with its line number
+    :return:
+    """
+    with pytest.raises(ValueError, match="line 2"):
+        asyncio.run(_collect(_chunks(b'{"name": "Ali"}\n{"name": \n')))
+
+
+def test_iter_ndjson_models_keeps_going_after_invalid_line():
+    """
+    an invalid line is returned as an error and the following lines are still parsed
+    :return:
+    """
+    async def collect():
+        stream = _chunks(b'{"text": "Hi all"}\n{bad\n{"text": 1}\n{"text": "Bonjour"}\n')
+        return [row async for row in iter_ndjson_models(stream, MemoryUpdate)]
+
+    rows = asyncio.run(collect())
+    assert [(row_number, memory) for row_number, memory, _ in rows] == [
+        (1, MemoryUpdate(text="Hi all")), (2, None), (3, None), (4, MemoryUpdate(text="Bonjour"))
+    ]
+    assert rows[1][2] and rows[2][2]
+
+
+def test_iter_json_batches():
+    """
+    the batches of rows are serialised as NDJSON lines or as one JSON array, empty batches are skipped
+    :return:
+    """
+    async def collect(stream_format):
+        batches = _chunks([SimpleNamespace(text="a")], [], [SimpleNamespace(text="b"), SimpleNamespace(text="c")])
+        return b"".join([chunk async for chunk in iter_json_batches(batches, MemoryUpdate, stream_format)])
+
+    ndjson = asyncio.run(collect("ndjson"))
+    assert [json.loads(line) for line in ndjson.splitlines()] == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+    assert json.loads(asyncio.run(collect("json"))) == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+
+    async def empty():
+        return b"".join([chunk async for chunk in iter_json_batches(_chunks(), MemoryUpdate, "json")])
+
+    assert json.loads(asyncio.run(empty())) == []
+
+
+def test_import_rejects_chunk_on_integrity_error():
+    """
+    a chunk whose family or individual is deleted during the insert is rolled back and reported as rejected,
+    the committed chunks are kept
+    :return:
+    """
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.execute.side_effect = [[], IntegrityError("INSERT", {}, Exception("foreign key"))]
+
+    async def memories():
+        for row in range(1, 4):
+            yield row, MemoryCreate(family_environment_id=1, individual_id=1, text=f"m{row}"), None
+
+    res = asyncio.run(service_import_memories(mock_db, memories(), chunk_size=2))
+    assert res["accepted"] == 2
+    assert [row["row"] for row in res["rejected"]] == [3]
+    mock_db.rollback.assert_awaited_once()
+
+
+def test_import_reports_line_too_long():
+    """
+    a line too long stops the import, the stored rows and the line are reported instead of a 413
+    :return:
+    """
+    mock_db = AsyncMock(spec=AsyncSession)
+    mock_db.execute.return_value = []
+
+    line = b'{"family_environment_id": 1, "individual_id": 1, "text": "m"}\n'
+    memories = iter_ndjson_models(_chunks(line, line, b'{"text": "' + b"x" * 100 + b'"}\n', line), MemoryCreate,
+                                  max_line_length=80)
+
+    res = asyncio.run(service_import_memories(mock_db, memories, chunk_size=2))
+    assert res["accepted"] == 2
+    assert [row["row"] for row in res["rejected"]] == [3]
+    assert "line 3: longer than 80 bytes" in res["rejected"][0]["detail"]
+    mock_db.commit.assert_awaited_once()
@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.pagination import encode_cursor, decode_cursor, get_pagination, build_page
+
+
+def test_cursor_round_trip():
+    """
+    a cursor decodes back to the key it was built from
+    :return:
+    """
+    assert decode_cursor(encode_cursor(42)) == 42
+    assert decode_cursor(encode_cursor([0.5, 7])) == [0.5, 7]
+
+
+def test_invalid_cursor_is_rejected():
+    """
+    a malformed cursor is a bad request
+    :return:
+    """
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+    with pytest.raises(HTTPException) as e:
+        get_pagination(limit=10, cursor="not a cursor")
+    assert e.value.status_code == 400
+
+
+def test_build_page():
+    """
+    the extra row fetched with limit + 1 is dropped and gives the next cursor
+    :return:
+    """
+    rows = [SimpleNamespace(individual_id=i) for i in (1, 2, 3)]
+
+    page = build_page(rows, limit=2, key=lambda row: row.individual_id)
+    assert page["items"] == rows[:2]
+    assert decode_cursor(page["next_cursor"]) == 2
+    assert get_pagination(limit=2, cursor=page["next_cursor"]).after == 2
+
+    last_page = build_page(rows[2:], limit=2, key=lambda row: row.individual_id)
+    assert last_page["items"] == rows[2:]
+    assert last_page["next_cursor"] is None
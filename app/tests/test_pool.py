@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from app.core.database.config_loader import Settings
+from app.db.pool import (MeteredQueuePool, MeteredAsyncAdaptedQueuePool, MeteredNullPool,
+                         get_connect_args, get_pool_options, get_pool_status)
+
+
+def _settings(**pool) -> Settings:
+    return Settings(name="socialnetwork", host="db", port=5432, user_db="admin", password="admin", **pool)
+
+
+def test_pool_options():
+    """
+    the pool arguments follow the settings, NullPool drops the queue arguments
+    :return:
+    """
+    options = get_pool_options(_settings(pool_size=3, pool_max_overflow=2, pool_timeout=1.5,
+                                         pool_recycle=60, pool_pre_ping=True, pool_null_pool=False),
+                               is_async=True)
+    assert options == {"poolclass": MeteredAsyncAdaptedQueuePool, "pool_size": 3, "max_overflow": 2,
+                       "pool_timeout": 1.5, "pool_recycle": 60, "pool_pre_ping": True}
+
+    assert get_pool_options(_settings(pool_null_pool=True))["poolclass"] is MeteredNullPool
+    assert "pool_size" not in get_pool_options(_settings(pool_null_pool=True))
+
+
+def test_connect_args():
+    """
+    the statements are cached by the connections, behind PgBouncer the caches are disabled
+    :return:
+    """
+    assert get_connect_args(_settings(prepared_statement_cache_size=100)) == {"prepared_statement_cache_size": 100}
+
+    connect_args = get_connect_args(_settings(prepared_statement_cache_size=100, pool_null_pool=True))
+    assert (connect_args["prepared_statement_cache_size"], connect_args["statement_cache_size"]) == (0, 0)
+    assert connect_args["prepared_statement_name_func"]() != connect_args["prepared_statement_name_func"]()
+
+
+def test_pool_status():
+    """
+    the status counts the checked out, idle and overflow connections and the waits of the checkouts
+    :return:
+    """
+    pool = MeteredQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=1, timeout=0.01)
+
+    first, second = pool.connect(), pool.connect()
+    status = get_pool_status(pool)
+    assert (status["size"], status["checked_out"], status["idle"], status["overflow"]) == (1, 2, 0, 1)
+
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+
+    first.close()
+    status = get_pool_status(pool)
+    assert (status["checked_out"], status["idle"]) == (1, 1)
+    assert status["wait"]["checkouts"] == 3
+    assert status["wait"]["timeouts"] == 1
+    assert status["wait"]["wait_time_max"] >= 0.01
+    second.close()
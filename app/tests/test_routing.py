@@ -0,0 +1,86 @@
+from sqlalchemy import create_engine, select, insert, lambda_stmt, literal, table, column
+
+from app.db.models import individual, family_environment, patient, family_member, memory, patient_memory_feed
+from app.db.models.individual import Individual
+from app.db.routing import ReplicaSet, RoutingSession, is_read_only, _read_only_lambdas
+from app.utils.statements import select_write_with_checks
+
+individuals = table("individuals", column("individual_id"), column("name"))
+
+
+def _engines(n):
+    return [create_engine("sqlite://") for _ in range(n)]
+
+
+def test_read_only_statements():
+    """
+    a select is read only unless it has a data modifying CTE
+    :return:
+    """
+    written = insert(individuals).values(name="Ali").returning(individuals.c.individual_id).cte("written")
+
+    assert is_read_only(select(individuals))
+    assert is_read_only(lambda_stmt(lambda: select(individuals)))
+    assert not is_read_only(lambda_stmt(lambda: insert(individuals).values(name="Ali")))
+    assert not is_read_only(insert(individuals).values(name="Ali"))
+    assert not is_read_only(select_write_with_checks(written, literal(True).label("check")))
+    assert not is_read_only(select(individuals).with_for_update())
+    assert not is_read_only(lambda_stmt(lambda: select(individuals).with_for_update()))
+    assert not is_read_only(select(select(individuals).with_for_update(read=True).subquery()))
+    assert not is_read_only(None)
+
+
+def test_read_only_lambda_is_checked_once():
+    """
+    a lambda statement is checked once per cache key, not for every value of its parameters
+    :return:
+    """
+    def by_id(individual_id):
+        return lambda_stmt(lambda: select(individuals).where(individuals.c.individual_id == individual_id))
+
+    checked = len(_read_only_lambdas)
+    assert is_read_only(by_id(1))
+    assert is_read_only(by_id(2))
+    assert len(_read_only_lambdas) == checked + 1
+
+
+def test_session_reads_its_writes():
+    """
+    the reads of a session go to one replica until the session writes, then everything goes to the primary
+    :return:
+    """
+    primary, = _engines(1)
+    replicas = ReplicaSet(_engines(2))
+
+    first = RoutingSession(bind=primary, replicas=replicas)
+    second = RoutingSession(bind=primary, replicas=replicas)
+    assert first.get_bind(clause=select(individuals)) is replicas.engines[0]
+    assert first.get_bind(clause=select(individuals)) is replicas.engines[0]
+    assert second.get_bind(clause=select(individuals)) is replicas.engines[1]
+
+    assert first.get_bind(clause=insert(individuals).values(name="Ali")) is primary
+    assert first.get_bind(clause=select(individuals)) is primary
+
+    Individual.__table__.create(primary)
+    flushed = RoutingSession(bind=primary, replicas=replicas)
+    flushed.add(Individual(name="Ali"))
+    flushed.flush()  # the before_flush hook of the session, the flush is a write
+    assert flushed.get_bind(clause=select(individuals)) is primary
+    flushed.close()
+
+    without_replicas = RoutingSession(bind=primary, replicas=ReplicaSet([]))
+    assert without_replicas.get_bind(clause=select(individuals)) is primary
+
+
+def test_least_connections():
+    """
+    least_connections picks the replica with fewer connections in use
+    :return:
+    """
+    replicas = ReplicaSet(_engines(2), balancing="least_connections")
+
+    with replicas.engines[0].connect():
+        assert replicas.in_use(replicas.engines[0]) == 1
+        assert replicas.pick() is replicas.engines[1]
+
+    assert replicas.in_use(replicas.engines[0]) == 0
@@ -0,0 +1,57 @@
+from sqlalchemy import inspect, select
+
+from app.db.models import individual, family_environment, patient, family_member, memory, patient_memory_feed
+from app.db.models.family_member import FamilyEnvironmentMember
+from app.db.models.family_environment import FamilyEnvironment
+from app.db.models.individual import Individual
+from app.schemas.family_member_schema import FamilyMemberFullResponse
+from app.schemas.individual_schema import IndividualResponse
+from app.utils.rows import PREVIEW_LENGTH, RowSchema, set_previews
+
+
+def test_row_schema():
+    """
+    the columns of the schema are selected once, the nested schemas are built from their own columns
+    :return:
+    """
+    rows = RowSchema(FamilyMemberFullResponse, FamilyEnvironmentMember,
+                     individual=Individual, family_environment=FamilyEnvironment)
+
+    assert list(select(*rows.columns).selected_columns.keys()) == [
+        "family_environment_id", "individual_id", "role", "family_environment_member_id",
+        "individual_name", "individual_individual_id", "individual_date_of_birth", "individual_other_details",
+        "individual_membership_count",
+        "family_environment_name", "family_environment_family_environment_id", "family_environment_member_count",
+    ]
+
+    member, = rows.validate([(1, 2, "son", 3, "Ali", 2, None, None, 1, "Smith", 1, 4)])
+    assert member == FamilyMemberFullResponse(
+        family_environment_id=1, individual_id=2, role="son", family_environment_member_id=3,
+        individual={"name": "Ali", "individual_id": 2, "membership_count": 1},
+        family_environment={"name": "Smith", "family_environment_id": 1, "member_count": 4},
+    )
+
+
+def test_row_schema_summary():
+    """
+    with detail summary the deferred columns are selected as a preview, computed by the database
+    :return:
+    """
+    rows = RowSchema(IndividualResponse, Individual, detail="summary")
+
+    sql = str(select(*rows.columns).compile(compile_kwargs={"literal_binds": True}))
+    assert f"left(individuals.other_details, {PREVIEW_LENGTH}) AS other_details" in sql
+    assert "individuals.name AS name" in sql
+
+
+def test_set_previews():
+    """
+    the preview selected with an ORM object is its loaded value, the object is not changed in its session
+    :return:
+    """
+    member = FamilyEnvironmentMember(individual=Individual(name="Ali"))
+    members = set_previews([(member, "a preview")], "other_details", target=lambda row: row.individual)
+
+    assert members == [member]
+    assert member.individual.other_details == "a preview"
+    assert not inspect(member.individual).attrs.other_details.history.has_changes()
@@ -0,0 +1,121 @@
+import asyncio
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.db.database import ASYNC_DATABASE_URL
+from app.db.models.family_environment import FamilyEnvironment
+from app.db.models.family_member import FamilyEnvironmentMember
+from app.db.models.individual import Individual
+from app.db.models.memory import Memory
+from app.db.models.patient import Patient
+from app.db.models.patient_memory_feed import PatientMemoryFeed
+from app.db.models.resource_version import ResourceVersion, VERSION_FAMILY_MEMBERS
+
+# the triggers run on the configured database, the connections of a test are not shared with the event loop of another
+engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+
+
+async def _versions(connection, family_ids):
+    rows = await connection.execute(select(ResourceVersion.scope_id, ResourceVersion.version).where(
+        ResourceVersion.resource == VERSION_FAMILY_MEMBERS, ResourceVersion.scope_id.in_(family_ids)))
+    versions = dict(rows.all())
+    return [versions.get(family_id, 0) for family_id in family_ids]
+
+
+async def _roster_bumps():
+    async with engine.connect() as connection:
+        async with connection.begin() as transaction:
+            individual_id = await connection.scalar(
+                insert(Individual).values(name="test triggers individual").returning(Individual.individual_id))
+            family_ids = list((await connection.scalars(
+                insert(FamilyEnvironment).returning(FamilyEnvironment.family_environment_id),
+                [{"name": "test triggers family 1"}, {"name": "test triggers family 2"}])).all())
+            await connection.execute(insert(FamilyEnvironmentMember).values(
+                family_environment_id=family_ids[0], individual_id=individual_id))
+
+            # the membership count of the individual is shown in the roster of its other family
+            before = await _versions(connection, family_ids)
+            await connection.execute(insert(FamilyEnvironmentMember).values(
+                family_environment_id=family_ids[1], individual_id=individual_id))
+            after_membership = await _versions(connection, family_ids)
+
+            await connection.execute(update(Individual).where(Individual.individual_id == individual_id)
+                                     .values(name="test triggers individual renamed"))
+            after_rename = await _versions(connection, family_ids)
+
+            await transaction.rollback()
+
+    return before, after_membership, after_rename
+
+
+def test_membership_bumps_the_rosters_once():
+    """
+    a membership updates the counters of individuals and family_environments from its trigger,
+    the rosters of the families of the individual are bumped once, by the trigger of the memberships
+    :return:
+    """
+    before, after_membership, after_rename = asyncio.run(_roster_bumps())
+
+    assert after_membership == [before[0] + 1, before[1] + 1]
+    assert after_rename == [before[0] + 2, before[1] + 2]
+
+
+async def _interleaved_feed(second_write: str):
+    async with engine.begin() as connection:
+        individual_id, patient_id = (await connection.scalars(
+            insert(Individual).returning(Individual.individual_id),
+            [{"name": "test triggers member"}, {"name": "test triggers patient"}])).all()
+        family_id = await connection.scalar(insert(FamilyEnvironment).values(name="test triggers feed")
+                                            .returning(FamilyEnvironment.family_environment_id))
+        # the row that is not written concurrently
+        if second_write == "membership":
+            await connection.execute(insert(Patient).values(patient_id=patient_id, family_environment_id=family_id))
+        else:
+            await connection.execute(insert(FamilyEnvironmentMember).values(
+                family_environment_id=family_id, individual_id=individual_id))
+
+    second = {
+        "membership": insert(FamilyEnvironmentMember).values(family_environment_id=family_id,
+                                                             individual_id=individual_id),
+        "patient": insert(Patient).values(patient_id=patient_id, family_environment_id=family_id),
+    }[second_write]
+
+    try:
+        async with engine.connect() as first, engine.connect() as concurrent:
+            await first.begin()
+            await concurrent.begin()
+            memory_id = await first.scalar(insert(Memory).values(
+                family_environment_id=family_id, individual_id=individual_id, text="memory").returning(
+                Memory.memory_id))
+
+            # the trigger of the second write waits for the memory, it reads it once committed
+            write = asyncio.create_task(concurrent.execute(second))
+            await asyncio.sleep(0.2)
+            await first.commit()
+            await write
+            await concurrent.commit()
+
+        async with engine.connect() as connection:
+            return (await connection.execute(select(PatientMemoryFeed.patient_id, PatientMemoryFeed.memory_id)
+                                             .where(PatientMemoryFeed.patient_id == patient_id))).all(), \
+                [(patient_id, memory_id)]
+    finally:
+        async with engine.begin() as connection:
+            await connection.execute(delete(Individual).where(Individual.individual_id.in_([individual_id,
+                                                                                             patient_id])))
+            await connection.execute(delete(FamilyEnvironment).where(
+                FamilyEnvironment.family_environment_id == family_id))
+            await connection.execute(delete(ResourceVersion).where(ResourceVersion.scope_id == family_id))
+
+
+def test_feed_of_interleaved_writes():
+    """
+    a memory and a membership of its individual (or the patient of its family) are written by two transactions,
+    neither sees the row of the other: the triggers lock the individuals and the families, the feed has the memory
+    :return:
+    """
+    for second_write in ("membership", "patient"):
+        feed, expected = asyncio.run(_interleaved_feed(second_write))
+        assert feed == expected, second_write
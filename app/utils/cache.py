@@ -0,0 +1,269 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Literal, Optional
+
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+# memory: a LRUCache in every worker
+# redis: a server speaking the Redis protocol, shared by the workers
+CacheBackendName = Literal["memory", "redis"]
+
+
+class CacheStats:
+    """
+    Counters of a cache
+
+    hits: lookups answered by the cache
+    misses: lookups not in the cache, or expired
+    evictions: entries removed because the cache is full
+    expirations: entries removed because they are older than the ttl
+    invalidations: entries removed by the writes
+    errors: lookups and writes of a shared cache that failed, a failed lookup is a miss
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
+
+
+class LRUCache:
+    """
+    Bounded cache of a worker, the least recently used entry is evicted when it is full
+    and an entry expires ttl seconds after it is stored
+
+    the cache is not shared by the workers, a write invalidates the entries of its own worker only,
+    the other workers see the change once their entries expire
+
+    maxsize: max number of entries, 0 disables the cache
+    ttl: seconds an entry is kept
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get an entry
+
+        :param key: key of the entry
+        :return:
+        the value, None if the key is not cached or expired
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Store an entry, None is not stored
+
+        :param key: key of the entry
+        :param value: cached value
+        """
+
+        if value is None or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """
+        Remove an entry, called by the writes of the cached rows
+
+        :param key: key of the entry
+        """
+
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.stats.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def status(self) -> dict:
+        """
+        Snapshot of the cache
+
+        :return:
+        dict: size, maxsize, ttl and the counters
+        """
+
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "ttl": self.ttl, **self.stats.as_dict()}
+
+
+class CacheBackend(ABC):
+    """
+    Cache of serialised values (bytes) by key, the backend is chosen by the settings, see create_cache_backend
+
+    the methods never raise, a cache that is not available is a miss,
+    an entry is not invalidated, its key is changed by the writes (e.g. a version of the rows) and it expires
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Value of a key, None if it is not cached or the cache is not available
+        """
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes):
+        """
+        Cache a value, it expires after the ttl of the backend
+        """
+
+    @abstractmethod
+    def status(self) -> dict:
+        """
+        Snapshot of the cache, the status of /internal/cache
+        """
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Backend of a LRUCache, the entries are not shared by the workers
+
+    maxsize: max number of entries, 0 disables the cache
+    ttl: seconds an entry is kept
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.cache = LRUCache(maxsize, ttl, clock=clock)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: bytes):
+        self.cache.set(key, value)
+
+    def status(self) -> dict:
+        return self.cache.status()
+
+
+# a server that is not available or too slow is a miss, any other error is a bug and is raised
+_ERRORS = (RedisConnectionError, RedisTimeoutError)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend of a Redis server (or Valkey, KeyDB), the entries are shared by the workers
+
+    the commands (GET, and SET with an expiry) are sent by redis-py on a connection pool of the worker,
+    the concurrent requests of the worker each take a connection of the pool
+
+    after an error the commands are skipped for retry_after seconds (misses),
+    a server that is down does not slow down every request
+
+    url: redis://[[user]:password@]host[:port][/db], or rediss:// and unix:// of redis-py
+    ttl: seconds an entry is kept, the server expires the entries
+    timeout: seconds of a command or a connection, a slower cache is a miss
+    retry_after: seconds the commands are skipped after an error
+    max_connections: max number of connections of the pool of the worker
+    """
+
+    def __init__(self, url: str, ttl: float, timeout: float = 0.5, retry_after: float = 5.0,
+                 max_connections: int = 50, clock: Callable[[], float] = time.monotonic):
+        # the connections are opened by the first commands, in the event loop of the worker
+        self.client = Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout,
+                                     max_connections=max_connections)
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.stats = CacheStats()
+        self._clock = clock
+        self._retry_at = 0.0
+
+    def _available(self) -> bool:
+        return self._clock() >= self._retry_at
+
+    def _failed(self):
+        self.stats.errors += 1
+        self._retry_at = self._clock() + self.retry_after
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = None
+        if self._available():
+            try:
+                value = await self.client.get(key)
+            except _ERRORS:
+                self._failed()
+
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes):
+        if self._available():
+            try:
+                await self.client.set(key, value, px=int(self.ttl * 1000))
+            except _ERRORS:
+                self._failed()
+
+    def status(self) -> dict:
+        # the entries are counted by the server, the counters are the ones of this worker
+        return {"size": None, "maxsize": None, "ttl": self.ttl, **self.stats.as_dict()}
+
+
+def create_cache_backend(backend: CacheBackendName, maxsize: int, ttl: float, url: str = "") -> CacheBackend:
+    """
+    Cache backend of the settings
+
+    :param backend: memory or redis
+    :param maxsize: max number of entries of the memory backend, 0 disables it
+    :param ttl: seconds an entry is kept
+    :param url: url of the redis backend
+    :return:
+    CacheBackend
+    """
+
+    if backend == "redis":
+        return RedisCacheBackend(url, ttl)
+    return MemoryCacheBackend(maxsize, ttl)
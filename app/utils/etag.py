@@ -0,0 +1,62 @@
+from typing import Optional
+
+from fastapi import Request, Response, status
+
+
+def make_etag(resource: str, scope_id: int, version: int) -> str:
+    """
+    Strong ETag of a resource version
+
+    the version is bumped by every write of the resource, a response of the same URL
+    with the same version is the same representation
+
+    :param resource: name of the resource, see app.db.models.resource_version
+    :param scope_id: ID of the family of the resource, 0 for a whole table
+    :param version: version of the resource
+    :return:
+    str: quoted ETag
+    """
+
+    return f'"{resource}-{scope_id}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header, a list of ETags or *
+
+    the comparison is weak (RFC 9110), W/"x" matches "x"
+
+    :param if_none_match: value of the header, None if missing
+    :param etag: current ETag of the resource
+    :return:
+    bool: True if the client has the current representation
+    """
+
+    if not if_none_match:
+        return False
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Conditional GET of an endpoint, called before the rows are read
+
+    :param request: the request, its If-None-Match header
+    :param response: the response of the endpoint, the ETag is set on it
+    :param etag: current ETag of the resource
+    :return:
+    Response 304 Not Modified if the client has the current representation, None to read the rows
+    """
+
+    # no-cache: the caches keep the response but revalidate it on every request
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,137 @@
+import asyncio
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Set
+
+from fastapi import Depends
+from sqlalchemy import lambda_stmt, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_async_db
+from app.utils.cache import LRUCache
+
+
+class EntityRows:
+    """
+    Rows of an entity loaded by ID by an EntityLoader
+
+    key: column of the ID, e.g. Individual.individual_id, the rows have a column of the same name
+    columns: selected columns, the key included
+    cache: cache of the rows by ID, only if its rows are rows of these columns
+    missing: negative cache of the entity, the IDs not found are recorded and not queried again
+    """
+
+    def __init__(self, key, columns: Sequence, cache: Optional[LRUCache] = None, missing: Optional[LRUCache] = None):
+        self.key = key
+        self.columns = list(columns)
+        self.cache = cache
+        self.missing = missing
+
+    def select(self, keys: List[Hashable]):
+        """
+        SELECT of the rows of the IDs
+
+        lambda statement, the statement is built and compiled once per entity and columns,
+        the IDs are an expanding bound parameter
+        """
+
+        columns, key = self.columns, self.key
+        return lambda_stmt(lambda: select(*columns), track_on=[self]) + (lambda stmt: stmt.where(key.in_(keys)))
+
+
+class EntityLoader:
+    """
+    Request-scoped loader of rows by ID, the lookups of a request are collected
+    and fetched by one SELECT ... WHERE id IN (...) per entity, an ID is fetched once per request
+
+        individual, family = await asyncio.gather(loader.load(INDIVIDUAL_BY_ID, individual_id),
+                                                  loader.load(FAMILY_BY_ID, family_id))
+        individuals = await loader.load_many(INDIVIDUAL_BY_ID, individual_ids)
+
+    the lookups made before the request awaits are fetched by the same query,
+    the queries run one after the other on the session of the request
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._lock = asyncio.Lock()
+        self._loaded: Dict[EntityRows, Dict[Hashable, asyncio.Future]] = {}
+        self._pending: Dict[EntityRows, List[Hashable]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def load(self, rows: EntityRows, key: Hashable) -> "asyncio.Future[Optional[Any]]":
+        """
+        Load a row by ID
+
+        :param rows: entity and columns of the row
+        :param key: ID of the row
+        :return:
+        Future of the row, None if it is not found
+        """
+
+        loaded = self._loaded.setdefault(rows, {})
+        future = loaded.get(key)
+        if future is not None:  # the ID is already loaded, or in the pending query
+            return future
+
+        future = loaded[key] = asyncio.get_running_loop().create_future()
+        row = rows.cache.get(key) if rows.cache is not None else None
+        if row is not None:
+            future.set_result(row)
+        elif rows.missing is not None and rows.missing.get(key):
+            future.set_result(None)
+        else:
+            pending = self._pending.setdefault(rows, [])
+            pending.append(key)
+            if len(pending) == 1:  # the query runs once the current step of the request awaits
+                task = asyncio.ensure_future(self._fetch(rows))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return future
+
+    async def load_many(self, rows: EntityRows, keys: Iterable[Hashable]) -> List[Optional[Any]]:
+        """
+        Load rows by ID, in the order of the IDs
+
+        :param rows: entity and columns of the rows
+        :param keys: IDs of the rows, repeated IDs are fetched once
+        :return:
+        list of the rows, None for an ID not found
+        """
+
+        return list(await asyncio.gather(*[self.load(rows, key) for key in keys]))
+
+    async def _fetch(self, rows: EntityRows):
+        async with self._lock:
+            # the IDs added while the other entities are fetched are in the same query
+            keys = self._pending.pop(rows)
+            futures = self._loaded[rows]
+            try:
+                res = await self.db.execute(rows.select(keys))
+                found = {getattr(row, rows.key.key): row for row in res}
+            except asyncio.CancelledError:
+                for key in keys:
+                    futures.pop(key).cancel()
+                raise
+            except Exception as error:  # raised by the lookups, a next lookup of the IDs queries again
+                for key in keys:
+                    futures.pop(key).set_exception(error)
+                return
+
+        for key in keys:
+            row = found.get(key)
+            if row is not None and rows.cache is not None:
+                rows.cache.set(key, row)
+            elif row is None and rows.missing is not None:
+                rows.missing.set(key, True)
+            futures[key].set_result(row)
+
+
+def get_loader(db: AsyncSession = Depends(get_async_db)) -> EntityLoader:
+    """
+    FastAPI dependency of the loader of a request, on the session of the request
+
+    :param db: database connection
+    :return:
+    EntityLoader
+    """
+
+    return EntityLoader(db)
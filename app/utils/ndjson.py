@@ -0,0 +1,214 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator, List, Literal, Optional, Sequence, Tuple, Type, TypeVar
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+# rows fetched from a server side cursor and serialised at once by a streaming response
+STREAM_BATCH_SIZE = 1000
+
+StreamFormat = Literal["ndjson", "json"]
+
+# max bytes of a line of a NDJSON body, a longer line is rejected with 413
+MAX_NDJSON_LINE_LENGTH = 1024 * 1024
+
+T = TypeVar("T", bound=BaseModel)
+
+
+async def iter_ndjson_lines(stream: AsyncIterable[bytes],
+                            max_line_length: int = MAX_NDJSON_LINE_LENGTH) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Split a NDJSON byte stream in lines incrementally, only the current line is buffered
+
+    only the new chunk is searched for the end of a line, the pieces of a line are joined once it is complete
+
+    :param stream: chunks of a NDJSON document
+    :param max_line_length: max bytes of a line
+    :return:
+    AsyncIterator of (line number, line), blank lines are skipped
+
+    :raise LineTooLong: 413 if a line is longer than max_line_length
+    """
+
+    pieces: List[bytes] = []  # the current line, received in pieces
+    length = 0
+    line_number = 0
+    async for chunk in stream:
+        start = 0
+        end = chunk.find(b"\n")
+        while end >= 0:
+            length += end - start
+            if length > max_line_length:
+                raise LineTooLong(line_number + 1, max_line_length)
+
+            line = b"".join(pieces) + chunk[start:end] if pieces else chunk[start:end]
+            pieces, length = [], 0
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+
+            start = end + 1
+            end = chunk.find(b"\n", start)
+
+        if start < len(chunk):
+            length += len(chunk) - start
+            if length > max_line_length:
+                raise LineTooLong(line_number + 1, max_line_length)
+            pieces.append(chunk[start:])
+
+    line = b"".join(pieces)
+    if line.strip():
+        yield line_number + 1, line
+
+
+class LineTooLong(HTTPException):
+    """
+    413 of a NDJSON line longer than the max, the lines before it are already read
+    """
+
+    def __init__(self, line_number: int, max_line_length: int):
+        super().__init__(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f"line {line_number}: longer than {max_line_length} bytes")
+        self.line_number = line_number
+
+
+async def iter_ndjson(stream: AsyncIterable[bytes]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Parse a NDJSON byte stream incrementally
+
+    :param stream: chunks of a NDJSON document
+    :return:
+    AsyncIterator of (line number, decoded value), blank lines are skipped
+
+    :raise ValueError: a line is not valid JSON
+    """
+
+    async for line_number, line in iter_ndjson_lines(stream):
+        yield line_number, _loads(line, line_number)
+
+
+async def iter_ndjson_models(stream: AsyncIterable[bytes], schema: Type[T],
+                             max_line_length: int = MAX_NDJSON_LINE_LENGTH
+                             ) -> AsyncIterator[Tuple[int, Optional[T], Optional[str]]]:
+    """
+    Parse and validate a NDJSON byte stream incrementally, an invalid line does not stop the stream
+
+    :param stream: chunks of a NDJSON document
+    :param schema: pydantic schema of a line
+    :param max_line_length: max bytes of a line
+    :return:
+    AsyncIterator of (line number, validated row or None, error or None),
+    a line too long is the last error, the rest of the stream is not read
+    """
+
+    try:
+        async for line_number, line in iter_ndjson_lines(stream, max_line_length):
+            try:
+                yield line_number, schema.model_validate_json(line), None
+            except ValidationError as e:
+                yield line_number, None, str(e.errors(include_url=False, include_input=False))
+    except LineTooLong as e:
+        # the rows before the line may already be stored, they are reported with the line instead of a 413
+        yield e.line_number, None, f"{e.detail}, the rest of the stream is not read"
+
+
+def _loads(line: bytes, line_number: int) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"line {line_number}: invalid JSON, {e}") from e
+
+
+async def iter_request_rows(request: Request, schema: Type[T]) -> AsyncIterator[T]:
+    """
+    Read the rows of a bulk request body, either a JSON array or a NDJSON stream
+
+    the NDJSON body is streamed, the JSON array body is read at once
+
+    :param request: the bulk request, the content type selects the format
+    :param schema: pydantic schema of a row
+    :return:
+    AsyncIterator of validated rows
+
+    :raise HTTPException: 422 if a row is not valid
+    """
+
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        rows = iter_ndjson(request.stream())
+    else:
+        rows = _iter_json_array(request)
+
+    try:
+        async for row_number, row in rows:
+            try:
+                yield schema.model_validate(row)
+            except ValidationError as e:
+                raise ValueError(f"row {row_number}: {e.errors(include_url=False, include_input=False)}") from e
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+
+
+async def _iter_json_array(request: Request) -> AsyncIterator[Tuple[int, Any]]:
+    body = await request.json()
+    if not isinstance(body, list):
+        raise ValueError("the body must be a JSON array or a NDJSON stream")
+
+    for row_number, row in enumerate(body, start=1):
+        yield row_number, row
+
+
+async def iter_json_batches(batches: AsyncIterable[Sequence[Any]], schema: Type[BaseModel],
+                            stream_format: StreamFormat = "ndjson") -> AsyncIterator[bytes]:
+    """
+    Serialise batches of rows incrementally, one chunk per batch
+
+    :param batches: batches of rows (ORM objects or rows)
+    :param schema: pydantic schema of a row
+    :param stream_format: ndjson for a line per row, json for a JSON array sent in chunks
+    :return:
+    AsyncIterator of chunks of the document
+    """
+
+    separator = b"\n" if stream_format == "ndjson" else b","
+    first = True
+
+    if stream_format == "json":
+        yield b"["
+
+    async for batch in batches:
+        if not batch:
+            continue
+
+        chunk = separator.join(schema.model_validate(row, from_attributes=True).model_dump_json().encode()
+                               for row in batch)
+        if stream_format == "ndjson":
+            yield chunk + separator
+        else:
+            yield chunk if first else separator + chunk
+        first = False
+
+    if stream_format == "json":
+        yield b"]"
+
+
+def streaming_response(batches: AsyncIterable[Sequence[Any]], schema: Type[BaseModel],
+                       stream_format: StreamFormat) -> StreamingResponse:
+    """
+    Stream batches of rows as NDJSON or as a chunked JSON array
+
+    :param batches: batches of rows, the memory of the response depends on the size of a batch
+    :param schema: pydantic schema of a row
+    :param stream_format: ndjson or json
+    :return:
+    StreamingResponse
+    """
+
+    media_type = NDJSON_MEDIA_TYPE if stream_format == "ndjson" else JSON_MEDIA_TYPE
+    return StreamingResponse(iter_json_batches(batches, schema, stream_format), media_type=media_type)
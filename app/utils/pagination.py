@@ -0,0 +1,130 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Sequence
+
+from fastapi import HTTPException, Query, status
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# typeahead searches return only the best matches, they are not paginated
+TYPEAHEAD_DEFAULT_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+
+
+def encode_cursor(key: Any) -> str:
+    """
+    Encode the key of the last returned row to an opaque cursor
+
+    :param key: JSON serializable key of a row, e.g. the primary key
+    :return:
+    str: url safe cursor
+    """
+
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    """
+    Decode an opaque cursor to the key of the last returned row
+
+    :param cursor: url safe cursor
+    :return:
+    the key of a row
+
+    :raise ValueError: the cursor is not valid
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+
+
+@dataclass
+class Pagination:
+    """
+    Keyset pagination parameters
+
+    limit: max number of rows in a page
+    after: key of the last row of the previous page, None for the first page
+    """
+
+    limit: int = DEFAULT_PAGE_SIZE
+    after: Any = None
+
+
+def get_pagination(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                   cursor: Optional[str] = Query(None, description="next_cursor of the previous page")) -> Pagination:
+    """
+    FastAPI dependency of the keyset pagination parameters
+
+    :param limit: max number of rows in a page
+    :param cursor: opaque cursor of the previous page
+
+    :return:
+    Pagination: decoded pagination parameters
+    """
+
+    # primary keys are integers
+    return Pagination(limit=limit, after=_decode_after(cursor, lambda key: isinstance(key, int)))
+
+
+def get_ranked_pagination(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                          cursor: Optional[str] = Query(None, description="next_cursor of the previous page")
+                          ) -> Pagination:
+    """
+    FastAPI dependency of the keyset pagination parameters of a ranked list (e.g. search results)
+    the key of a row is [rank, primary key]
+
+    :param limit: max number of rows in a page
+    :param cursor: opaque cursor of the previous page
+
+    :return:
+    Pagination: decoded pagination parameters
+    """
+
+    def is_ranked_key(key) -> bool:
+        return (isinstance(key, list) and len(key) == 2
+                and isinstance(key[0], (int, float)) and isinstance(key[1], int))
+
+    return Pagination(limit=limit, after=_decode_after(cursor, is_ranked_key))
+
+
+def _decode_after(cursor: Optional[str], is_valid: Callable[[Any], bool]) -> Any:
+    if cursor is None:
+        return None
+
+    try:
+        after = decode_cursor(cursor)
+    except ValueError:
+        after = None
+
+    if after is None or not is_valid(after):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+    return after
+
+
+def build_page(rows: Sequence, limit: int, key: Callable[[Any], Any]) -> dict:
+    """
+    Build a page from rows fetched with limit + 1
+
+    :param rows: rows of the page, with one extra row if there is a next page
+    :param limit: max number of rows in a page
+    :param key: function returning the key of a row
+
+    :return:
+    dict: items and next_cursor of a page
+    """
+
+    items = list(rows[:limit])
+    next_cursor = encode_cursor(key(items[-1])) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,149 @@
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Sequence, Tuple, Type, get_args
+
+from fastapi import Query, Request
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.core.config import config
+from app.utils.statements import preview
+
+# orm: the rows are loaded as ORM objects and read by the schemas with orm_mode
+# core: only the columns of the response are selected, the rows are validated in bulk, see RowSchema
+ReadPath = Literal["orm", "core"]
+
+# summary: the large text columns (deferred in the mappers) are read as a preview of PREVIEW_LENGTH characters
+# full: the whole text
+Detail = Literal["summary", "full"]
+PREVIEW_LENGTH = 200
+
+
+def get_read_path(request: Request) -> ReadPath:
+    """
+    FastAPI dependency of the read path of an endpoint
+
+    the endpoints listed by name (the name of the route function) in the setting core_read_endpoints
+    use the core read path
+
+    :param request: the request, its route is the endpoint
+    :return:
+    ReadPath: orm or core
+    """
+
+    route = request.scope.get("route")
+    return "core" if route is not None and route.name in config.core_read_endpoints else "orm"
+
+
+def get_detail(detail: Detail = Query("summary", description="summary for a preview of the large texts, "
+                                                              "full for the whole texts")) -> Detail:
+    """
+    FastAPI dependency of the detail of a list
+
+    :param detail: summary or full
+    :return:
+    Detail
+    """
+
+    return detail
+
+
+def detail_column(column, detail: Detail):
+    """
+    Column of a select for the detail of a list
+
+    :param column: column of a mapped class
+    :param detail: summary or full
+
+    :return:
+    the column, or its preview if it is deferred by the mapper and the detail is summary
+    """
+
+    if detail == "summary" and getattr(column.property, "deferred", False):
+        return preview(column, PREVIEW_LENGTH)
+    return column
+
+
+def set_previews(rows: Iterable[Sequence], name: str, target: Optional[Callable[[Any], Any]] = None) -> list:
+    """
+    ORM objects of a summary, selected with the preview of their deferred column (see detail_column)
+
+        select(Individual, detail_column(Individual.other_details, "summary"))
+
+    the preview is set as the loaded value of the attribute, the object is not modified in its session
+
+    :param rows: rows of (object, preview)
+    :param name: name of the deferred attribute
+    :param target: object of the attribute from the object of a row, e.g. the individual of a membership
+    :return:
+    list of the objects
+    """
+
+    objects = []
+    for obj, text in rows:
+        set_committed_value(obj if target is None else target(obj), name, text)
+        objects.append(obj)
+    return objects
+
+
+class RowSchema:
+    """
+    Read path without ORM objects, the columns of a pydantic schema are selected and the rows validated at once
+
+    the columns are selected from mapped classes, a nested schema (a many-to-one relationship)
+    is selected from its own mapped class:
+
+        RowSchema(FamilyMemberFullResponse, FamilyEnvironmentMember,
+                  individual=Individual, family_environment=FamilyEnvironment)
+
+    with detail summary the deferred columns are selected as a preview, see detail_column
+
+    columns: labelled columns of the select, in the order of the rows
+    validate(rows): list of validated schemas
+    """
+
+    def __init__(self, schema: Type[BaseModel], entity: Any, detail: Detail = "full", **nested: Any):
+        self.detail = detail
+        self.adapter = TypeAdapter(List[schema])
+        self.columns = []
+        self._fields = self._select(schema, entity, nested=nested)
+        self._nested = {field: self._select(schema.model_fields[field].annotation, nested_entity, prefix=f"{field}_")
+                        for field, nested_entity in nested.items()}
+
+    def _select(self, schema: Type[BaseModel], entity: Any, prefix: str = "",
+                nested: Optional[Dict[str, Any]] = None) -> Tuple[List[str], int]:
+        # the labels keep the columns of the same name apart, e.g. individual_id of the membership and the individual
+        names = [name for name in schema.model_fields if not nested or name not in nested]
+        start = len(self.columns)
+        self.columns.extend(detail_column(getattr(entity, name), self.detail).label(prefix + name) for name in names)
+        return names, start
+
+    def _as_dict(self, row: Sequence) -> dict:
+        names, start = self._fields
+        values = dict(zip(names, row[start:start + len(names)]))
+        for field, (nested_names, nested_start) in self._nested.items():
+            values[field] = dict(zip(nested_names, row[nested_start:nested_start + len(nested_names)]))
+        return values
+
+    def validate(self, rows: Sequence[Sequence]) -> list:
+        """
+        Validate rows of the columns at once
+
+        :param rows: rows selected with the columns
+        :return:
+        list of the schemas
+        """
+
+        return self.adapter.validate_python([self._as_dict(row) for row in rows])
+
+
+def row_schemas(schema: Type[BaseModel], entity: Any, **nested: Any) -> Dict[Detail, RowSchema]:
+    """
+    RowSchema of every detail, the columns of a detail are selected once
+
+    :param schema: pydantic schema of a row
+    :param entity: mapped class of the columns
+    :param nested: mapped classes of the nested schemas
+    :return:
+    dict of RowSchema by detail
+    """
+
+    return {detail: RowSchema(schema, entity, detail=detail, **nested) for detail in get_args(Detail)}
@@ -0,0 +1,71 @@
+from typing import Iterable
+
+from sqlalchemy import CTE, Select, func, literal, select, true
+
+
+def select_write_with_checks(written: CTE, *checks) -> Select:
+    """
+    Select the row of an INSERT/UPDATE/DELETE ... RETURNING CTE with checks, in one statement
+
+    the checks are evaluated on the snapshot before the write, they explain why nothing was written.
+    The statement always returns one row, the columns of the CTE are None if nothing was written
+
+    :param written: CTE of an INSERT, UPDATE or DELETE with RETURNING of one row
+    :param checks: labeled boolean or scalar expressions
+
+    :return:
+    select of the returned columns and the checks
+    """
+
+    one = select(literal(1).label("one")).subquery("one")
+    return select(*written.c, *checks).select_from(one.outerjoin(written, true()))
+
+
+def lock_rows(key, ids: Iterable[int]) -> Select:
+    """
+    Lock rows by ID until the end of the transaction, SELECT ... FOR UPDATE
+
+    a check of a write that reads a locked row is run by a next statement, on a snapshot taken once
+    the concurrent writes of the rows are committed. The rows are locked in the order of the IDs,
+    concurrent writes lock them in the same order
+
+    :param key: primary key column, e.g. Individual.individual_id
+    :param ids: IDs of the rows
+    :return:
+    select of the locked IDs
+    """
+
+    return select(key).where(key.in_(sorted(set(ids)))).order_by(key).with_for_update()
+
+
+def similar_names(name, query: str):
+    """
+    Trigram match of a name for a typeahead search
+
+    name %> query is true when the query is similar to a word of the name (word_similarity_threshold),
+    the operator is answered by a gin_trgm_ops index of the name
+
+    :param name: column of a name
+    :param query: text typed by the user
+
+    :return:
+    condition of the match and the similarity used as rank
+    """
+
+    return name.bool_op("%>")(query), func.word_similarity(query, name)
+
+
+def preview(column, length: int):
+    """
+    The first characters of a large text column, computed by the database
+
+    left() reads only the first slice of a compressed or TOAST value, not the whole text
+
+    :param column: text column
+    :param length: max number of characters
+
+    :return:
+    expression of the preview, labeled with the name of the column
+    """
+
+    return func.left(column, length).label(column.key)
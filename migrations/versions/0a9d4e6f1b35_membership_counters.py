@@ -0,0 +1,51 @@
+"""membership counters
+
+Revision ID: 0a9d4e6f1b35
+Revises: f8c3b6a1d274
+Create Date: 2026-10-18 17:58:44.120396
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.models.family_member import FAMILY_MEMBERS_COUNT_FUNCTIONS, FAMILY_MEMBERS_COUNT_TRIGGERS
+from app.db.triggers import create_trigger_statements, drop_trigger_statements
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a9d4e6f1b35'
+down_revision: Union[str, None] = 'f8c3b6a1d274'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('individuals', sa.Column('membership_count', sa.Integer(), server_default=sa.text('0'),
+                                           nullable=False))
+    op.add_column('family_environments', sa.Column('member_count', sa.Integer(), server_default=sa.text('0'),
+                                                   nullable=False))
+
+    # the triggers lock the memberships until the end of the migration, the counts can not drift during the backfill
+    for statement in create_trigger_statements(FAMILY_MEMBERS_COUNT_FUNCTIONS, FAMILY_MEMBERS_COUNT_TRIGGERS):
+        op.execute(statement)
+
+    op.execute("""
+    UPDATE individuals AS i SET membership_count = d.n
+    FROM (SELECT individual_id, count(*) AS n FROM family_environment_members GROUP BY individual_id) AS d
+    WHERE i.individual_id = d.individual_id
+    """)
+    op.execute("""
+    UPDATE family_environments AS f SET member_count = d.n
+    FROM (SELECT family_environment_id, count(*) AS n FROM family_environment_members
+          GROUP BY family_environment_id) AS d
+    WHERE f.family_environment_id = d.family_environment_id
+    """)
+
+
+def downgrade() -> None:
+    for statement in drop_trigger_statements(FAMILY_MEMBERS_COUNT_FUNCTIONS, FAMILY_MEMBERS_COUNT_TRIGGERS):
+        op.execute(statement)
+    op.drop_column('family_environments', 'member_count')
+    op.drop_column('individuals', 'membership_count')
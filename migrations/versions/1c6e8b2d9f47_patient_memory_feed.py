@@ -0,0 +1,63 @@
+"""patient memory feed
+
+Revision ID: 1c6e8b2d9f47
+Revises: 0a9d4e6f1b35
+Create Date: 2026-10-18 19:12:05.774581
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.models.patient_memory_feed import (
+    PATIENT_MEMORY_FEED_FUNCTIONS,
+    PATIENT_MEMORY_FEED_INSERT,
+    PATIENT_MEMORY_FEED_TRIGGERS
+)
+from app.db.triggers import create_trigger_statements, drop_trigger_statements
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c6e8b2d9f47'
+down_revision: Union[str, None] = '0a9d4e6f1b35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'patient_memory_feed',
+        sa.Column('patient_id', sa.Integer(), nullable=False),
+        sa.Column('memory_id', sa.Integer(), nullable=False),
+        sa.Column('family_environment_id', sa.Integer(), nullable=False),
+        sa.Column('individual_id', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['memory_id', 'family_environment_id'],
+                                ['memories.memory_id', 'memories.family_environment_id'],
+                                ondelete='CASCADE', onupdate='CASCADE'),
+        sa.ForeignKeyConstraint(['patient_id'], ['patients.patient_id'], ondelete='CASCADE', onupdate='CASCADE'),
+        sa.PrimaryKeyConstraint('patient_id', 'memory_id')
+    )
+    op.create_index('ix_patient_memory_feed_memory_id', 'patient_memory_feed',
+                    ['memory_id', 'family_environment_id'])
+    op.create_index('ix_patient_memory_feed_patient_id_individual_id', 'patient_memory_feed',
+                    ['patient_id', 'individual_id'])
+
+    # the triggers lock the source tables until the end of the migration, the backfill can not miss a write
+    for statement in create_trigger_statements(PATIENT_MEMORY_FEED_FUNCTIONS, PATIENT_MEMORY_FEED_TRIGGERS):
+        op.execute(statement)
+
+    op.execute(f"""
+    {PATIENT_MEMORY_FEED_INSERT}
+    FROM patients AS p
+    JOIN family_environment_members AS fm ON fm.family_environment_id = p.family_environment_id
+    JOIN memories AS m ON m.individual_id = fm.individual_id
+    ON CONFLICT DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    for statement in drop_trigger_statements(PATIENT_MEMORY_FEED_FUNCTIONS, PATIENT_MEMORY_FEED_TRIGGERS):
+        op.execute(statement)
+    op.drop_table('patient_memory_feed')
@@ -0,0 +1,62 @@
+"""index foreign keys
+
+Revision ID: 7c1d9e4b2a60
+Revises: 2410d461c13f
+Create Date: 2026-10-18 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1d9e4b2a60'
+down_revision: Union[str, None] = '2410d461c13f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_memories_family_environment_id_memory_id', 'memories',
+                        ['family_environment_id', 'memory_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_memories_individual_id_family_environment_id', 'memories',
+                        ['individual_id', 'family_environment_id', 'memory_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_family_environment_members_individual_id', 'family_environment_members',
+                        ['individual_id', 'family_environment_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_patients_family_environment_id', 'patients',
+                        ['family_environment_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+        # the unique constraint is attached to an index built concurrently,
+        # it fails if there are duplicated memberships, they must be removed first
+        op.create_index('uq_family_environment_members_family_individual', 'family_environment_members',
+                        ['family_environment_id', 'individual_id'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+    op.execute(
+        'ALTER TABLE family_environment_members '
+        'ADD CONSTRAINT uq_family_environment_members_family_individual '
+        'UNIQUE USING INDEX uq_family_environment_members_family_individual'
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_family_environment_members_family_individual', 'family_environment_members',
+                       type_='unique')
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_patients_family_environment_id', table_name='patients',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_family_environment_members_individual_id', table_name='family_environment_members',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_memories_individual_id_family_environment_id', table_name='memories',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_memories_family_environment_id_memory_id', table_name='memories',
+                      postgresql_concurrently=True, if_exists=True)
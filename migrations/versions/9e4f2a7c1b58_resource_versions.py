@@ -0,0 +1,41 @@
+"""resource versions
+
+Revision ID: 9e4f2a7c1b58
+Revises: 1c6e8b2d9f47
+Create Date: 2026-10-18 21:03:47.215093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.models.resource_version import RESOURCE_VERSION_FUNCTIONS, RESOURCE_VERSION_TRIGGERS
+from app.db.triggers import create_trigger_statements, drop_trigger_statements
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4f2a7c1b58'
+down_revision: Union[str, None] = '1c6e8b2d9f47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'resource_versions',
+        sa.Column('resource', sa.String(length=64), nullable=False),
+        sa.Column('scope_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('resource', 'scope_id')
+    )
+
+    # no backfill, a missing version is 0 and the ETags of the existing rows start at 0
+    for statement in create_trigger_statements(RESOURCE_VERSION_FUNCTIONS, RESOURCE_VERSION_TRIGGERS):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    for statement in drop_trigger_statements(RESOURCE_VERSION_FUNCTIONS, RESOURCE_VERSION_TRIGGERS):
+        op.execute(statement)
+    op.drop_table('resource_versions')
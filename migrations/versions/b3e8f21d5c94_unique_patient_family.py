@@ -0,0 +1,37 @@
+"""unique patient family
+
+Revision ID: b3e8f21d5c94
+Revises: 7c1d9e4b2a60
+Create Date: 2026-10-18 11:47:05.618392
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8f21d5c94'
+down_revision: Union[str, None] = '7c1d9e4b2a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a family has only one patient, it fails if a family has more than one patient
+    with op.get_context().autocommit_block():
+        op.create_index('uq_patients_family_environment_id', 'patients',
+                        ['family_environment_id'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_patients_family_environment_id', table_name='patients',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_patients_family_environment_id', 'patients',
+                        ['family_environment_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('uq_patients_family_environment_id', table_name='patients',
+                      postgresql_concurrently=True, if_exists=True)
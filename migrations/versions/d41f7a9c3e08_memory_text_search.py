@@ -0,0 +1,35 @@
+"""memory text search
+
+Revision ID: d41f7a9c3e08
+Revises: b3e8f21d5c94
+Create Date: 2026-10-18 14:02:31.284617
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f7a9c3e08'
+down_revision: Union[str, None] = 'b3e8f21d5c94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # a stored generated column rewrites the table, memories is locked while it is added
+    op.add_column('memories', sa.Column('text_search', postgresql.TSVECTOR(),
+                                        sa.Computed("to_tsvector('english', text)", persisted=True)))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_memories_text_search', 'memories', ['text_search'], postgresql_using='gin',
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_memories_text_search', table_name='memories',
+                      postgresql_concurrently=True, if_exists=True)
+    op.drop_column('memories', 'text_search')
@@ -0,0 +1,38 @@
+"""name trigram search
+
+Revision ID: e5a2c7d9b813
+Revises: d41f7a9c3e08
+Create Date: 2026-10-18 15:26:48.903152
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a2c7d9b813'
+down_revision: Union[str, None] = 'd41f7a9c3e08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # pg_trgm is a trusted extension, the owner of the database can create it
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.create_index('ix_individuals_name_trgm', 'individuals', ['name'], postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_family_environments_name_trgm', 'family_environments', ['name'],
+                        postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_family_environments_name_trgm', table_name='family_environments',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_individuals_name_trgm', table_name='individuals',
+                      postgresql_concurrently=True, if_exists=True)
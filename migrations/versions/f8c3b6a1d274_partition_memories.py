@@ -0,0 +1,92 @@
+"""partition memories
+
+Revision ID: f8c3b6a1d274
+Revises: e5a2c7d9b813
+Create Date: 2026-10-18 16:40:12.551930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8c3b6a1d274'
+down_revision: Union[str, None] = 'e5a2c7d9b813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# must match MEMORY_PARTITIONS of app.db.models.memory
+PARTITIONS = 16
+
+INDEXES = [
+    ('ix_memories_family_environment_id_memory_id', ['family_environment_id', 'memory_id'], {}),
+    ('ix_memories_individual_id_family_environment_id', ['individual_id', 'family_environment_id', 'memory_id'], {}),
+    ('ix_memories_text_search', ['text_search'], {'postgresql_using': 'gin'}),
+]
+
+COLUMNS = "memory_id, family_environment_id, individual_id, text"
+
+
+def _create_memories(partitioned: bool) -> None:
+    op.create_table(
+        'memories',
+        sa.Column('memory_id', sa.Integer(), server_default=sa.text("nextval('memories_memory_id_seq'::regclass)"),
+                  nullable=False),
+        sa.Column('family_environment_id', sa.Integer(), nullable=False),
+        sa.Column('individual_id', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('text_search', postgresql.TSVECTOR(),
+                  sa.Computed("to_tsvector('english', text)", persisted=True)),
+        sa.ForeignKeyConstraint(['family_environment_id'], ['family_environments.family_environment_id'],
+                                name='memories_family_environment_id_fkey', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['individual_id'], ['individuals.individual_id'],
+                                name='memories_individual_id_fkey', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(*(['memory_id', 'family_environment_id'] if partitioned else ['memory_id']),
+                                name='memories_pkey'),
+        **({'postgresql_partition_by': 'HASH (family_environment_id)'} if partitioned else {})
+    )
+
+    if partitioned:
+        for remainder in range(PARTITIONS):
+            op.execute(f"CREATE TABLE memories_p{remainder} PARTITION OF memories "
+                       f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})")
+
+
+def _replace_memories(partitioned: bool) -> None:
+    """
+    Move the memories to a new table, the old table is renamed and dropped once the rows are copied
+    the indexes are built after the copy, the table is locked until the end of the migration
+    """
+
+    op.rename_table('memories', 'memories_old')
+    # the names of the constraints and indexes are reused by the new table
+    op.drop_constraint('memories_pkey', 'memories_old', type_='primary')
+    op.drop_constraint('memories_family_environment_id_fkey', 'memories_old', type_='foreignkey')
+    op.drop_constraint('memories_individual_id_fkey', 'memories_old', type_='foreignkey')
+    for name, _, _ in INDEXES:
+        op.drop_index(name, table_name='memories_old', if_exists=True)
+    op.drop_index('ix_memories_memory_id', table_name='memories_old', if_exists=True)
+
+    _create_memories(partitioned)
+    op.execute(f"INSERT INTO memories ({COLUMNS}) SELECT {COLUMNS} FROM memories_old")
+
+    # the sequence of memory_id is kept, it is dropped with the table that owns it
+    op.execute("ALTER SEQUENCE memories_memory_id_seq OWNED BY memories.memory_id")
+    op.drop_table('memories_old')
+
+    # an index of the partitioned table is created on every partition
+    for name, columns, kwargs in INDEXES:
+        op.create_index(name, 'memories', columns, **kwargs)
+    if not partitioned:
+        op.create_index('ix_memories_memory_id', 'memories', ['memory_id'])
+
+
+def upgrade() -> None:
+    _replace_memories(partitioned=True)
+
+
+def downgrade() -> None:
+    _replace_memories(partitioned=False)